@@ -0,0 +1,67 @@
+"""Payload codecs: encoded size, encode/decode CPU and events table size, JSON against the binary reading format.
+
+Run from the project root:  python -m benchmarks.bench_codec --events 50000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from codec import JSON, READING
+from db import Database
+
+from .load_generator import SHAPES, SensorFleet
+
+CODECS = (JSON, READING)
+
+
+def best_of(runs, function, items):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items)
+
+
+def db_size(directory, codec, payloads, batch_size=500):
+    path = os.path.join(directory, f"{codec.content_type.rsplit('/', 1)[-1]}.db")
+    db = Database(db_path=path)
+    events = [("sensor", payload["sensor_id"], payload, codec.encode(payload)) for payload in payloads]
+    for start in range(0, len(events), batch_size):
+        db.log_events(events[start:start + batch_size])
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    events_bytes = db.conn.execute("SELECT SUM(length(CAST(payload AS BLOB))) FROM events").fetchone()[0]
+    db.close()
+    return os.path.getsize(path), events_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    categories = list(SHAPES)
+    fleet = SensorFleet([(i + 1, categories[i % len(categories)]) for i in range(args.sensors)])
+    payloads = [fleet.reading(*fleet.sensors[i % args.sensors])[1] for i in range(args.events)]
+    payloads = [JSON.decode(payload) for payload in payloads]
+    sample = payloads[:min(len(payloads), 10000)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in CODECS:
+            encoded = [codec.encode(payload) for payload in sample]
+            encode = best_of(args.runs, codec.encode, sample)
+            decode = best_of(args.runs, codec.decode, encoded)
+            file_size, payload_bytes = db_size(directory, codec, payloads)
+            print(f"{codec.content_type:<36} {sum(map(len, encoded)) / len(encoded):6.1f} B/payload  "
+                  f"encode {encode * 1e6:5.2f} us  decode {decode * 1e6:5.2f} us  "
+                  f"payload column {payload_bytes / 1024:8.0f} KiB  db file {file_size / 1024:8.0f} KiB "
+                  f"({args.events} events)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Micro-benchmark: trigger condition evaluation with eval() vs compiled predicates.
+
+Run from the project root:  python -m benchmarks.bench_conditions
+"""
+import argparse
+import time
+
+from controller.conditions import compile_conditions
+
+CONDITIONS = {"temperature": ">=14", "humidity": "20..80", "mode": "==auto", "occupied": "true"}
+PAYLOAD = {"sensor_id": 1, "temperature": 22.5, "humidity": 45, "mode": "auto", "occupied": True}
+LEGACY_CONDITIONS = {"temperature": ">=14", "humidity": ">=25"}
+
+
+def eval_legacy(conditions, payload):
+    # The pre-compilation implementation of is_trigger_valid's condition loop
+    is_valid = True
+    for key, comparator in conditions.items():
+        is_valid = is_valid and (key in payload and eval(str(payload[key]) + comparator))
+        if not is_valid:
+            break
+    return is_valid
+
+
+def eval_compiled(compiled, payload):
+    for key, predicate in compiled:
+        if key not in payload or not predicate(payload[key]):
+            return False
+    return True
+
+
+def measure(fn, args, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    # eval() only understands the numeric subset, so compare both on the same legacy rule
+    before = measure(eval_legacy, (LEGACY_CONDITIONS, PAYLOAD), args.iterations)
+    after = measure(eval_compiled, (compile_conditions(LEGACY_CONDITIONS), PAYLOAD), args.iterations)
+    mixed = measure(eval_compiled, (compile_conditions(CONDITIONS), PAYLOAD), args.iterations)
+
+    print(f"eval()   {LEGACY_CONDITIONS}: {before:>12,.0f} evaluations/s")
+    print(f"compiled {LEGACY_CONDITIONS}: {after:>12,.0f} evaluations/s  ({after / before:.1f}x)")
+    print(f"compiled {CONDITIONS}: {mixed:>12,.0f} evaluations/s")
+
+
+if __name__ == "__main__":
+    main()
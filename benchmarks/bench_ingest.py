@@ -0,0 +1,57 @@
+"""Ingest throughput: the single-process EventWriter against ShardedWriter with N worker processes.
+
+Run from the project root:  python -m benchmarks.bench_ingest --events 200000 --shards 0 2 4
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from db import open_database
+from monitor.event_writer import EventWriter
+from monitor.sharded_writer import ShardedWriter
+
+
+def events(count, sensors):
+    for i in range(count):
+        sensor_id = i % sensors + 1
+        payload = {"sensor_id": sensor_id, "temperature": 20 + i % 100 / 10, "humidity": 40 + i % 30}
+        yield "sensor", sensor_id, payload, json.dumps(payload).encode()
+
+
+def run(shards, count, sensors, directory):
+    db_path = os.path.join(directory, f"ingest-{shards}.db")
+    db = open_database(db_path=db_path, shards=shards)
+    writer = ShardedWriter(db_path=db_path, shards=shards) if shards else EventWriter(db_path=db_path)
+    writer.start()
+    started = time.perf_counter()
+    for source_type, source_id, payload, raw in events(count, sensors):
+        writer.submit(source_type, source_id, payload, raw)
+    submitted = time.perf_counter()
+    # stop() returns once every event is committed
+    writer.stop()
+    elapsed = time.perf_counter() - started
+    stored = sum(1 for _ in db.iter_events())
+    db.close()
+    return {"shards": shards, "events": count, "stored": stored, "submit_us": (submitted - started) / count * 1e6,
+            "events_per_s": count / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 2, 4], help="0 = single-process EventWriter")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as directory:
+        for shards in args.shards:
+            result = run(shards, args.events, args.sensors, directory)
+            print(f"shards={result['shards']}: {result['events_per_s']:,.0f} events/s, "
+                  f"submit {result['submit_us']:.2f} us/event, {result['stored']}/{result['events']} stored")
+
+
+if __name__ == "__main__":
+    main()
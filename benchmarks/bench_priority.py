@@ -0,0 +1,120 @@
+"""Latency of safety actions (gas valve) while routine light/temperature readings flood the controller.
+
+Runs the same flood twice: with the default priority lanes and with every category in one lane.
+
+Run from the project root:  python -m benchmarks.bench_priority --rate 4000 --duration 10
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as paho
+
+from controller import Controller
+from controller.dispatch import DEFAULT_PRIORITIES
+from db import Database
+from transport import MqttTransport
+
+from .e2e import attribute_actions, summarize_ms
+from .fake_broker import FakeBroker, FakeClient
+from .load_generator import SHAPES, SensorFleet
+
+ROUTINE_CATEGORIES = ("light", "temperature")
+GAS_THRESHOLD = 500
+
+
+def setup_database(path, sensor_count, rules_per_sensor):
+    """Routine sensors with threshold rules, and one gas sensor that opens or closes a valve"""
+    db = Database(db_path=path)
+    valve = db.add_device("gas valve", "gas", "Valve")
+    gas_sensor = db.add_sensor("gas sensor", "gas", "Bench")
+    db.add_trigger("gas leak", gas_sensor, {"ppm": f">={GAS_THRESHOLD}"}, valve, {"state": "closed"})
+    db.add_trigger("gas clear", gas_sensor, {"ppm": f"<{GAS_THRESHOLD}"}, valve, {"state": "open"})
+    devices = {category: db.add_device(f"{category} actuator", category, "Bench") for category in ROUTINE_CATEGORIES}
+    sensors = []
+    for i in range(sensor_count):
+        category = ROUTINE_CATEGORIES[i % len(ROUTINE_CATEGORIES)]
+        sensor_id = db.add_sensor(f"{category} sensor {i}", category, "Bench")
+        sensors.append((sensor_id, category))
+        field, low, high, _ = SHAPES[category]
+        for j in range(rules_per_sensor):
+            threshold = low + (high - low) * (j + 1) / (rules_per_sensor + 1)
+            db.add_trigger(f"routine {i}.{j}", sensor_id, {field: f">={threshold}"}, devices[category],
+                           {"state": "on", "level": j})
+    db.close()
+    return gas_sensor, sensors
+
+
+def run(db_path, gas_sensor, sensors, priorities, args):
+    broker = FakeBroker()
+    broker.start()
+    gas_latencies = []
+
+    def on_action(topic, payload, inbound):
+        if topic.startswith("gas/"):
+            gas_latencies.append(time.perf_counter() - inbound.sent_at)
+
+    broker.on_action = on_action
+    restore = attribute_actions(broker)
+    transport = MqttTransport("Smart_Home", paho.MQTTv5, client=FakeClient(broker, "Smart_Home"))
+    # Valve commands alternate, so deduplication never holds one back; the default rate limit of one command a
+    # second per device would, but commands to CRITICAL categories are exempt from it
+    controller = Controller(transport, db_path=db_path, rule_poll_ms=0, priorities=priorities)
+    transport.connect("localhost", 1883, "bench", "bench")
+    transport.start()
+    controller.start()
+
+    stop = threading.Event()
+
+    def probe():
+        client = FakeClient(broker, "GasSensor")
+        leak = False
+        while not stop.wait(args.probe_ms / 1000):
+            leak = not leak
+            ppm = GAS_THRESHOLD * 2 if leak else GAS_THRESHOLD / 5
+            client.publish("gas/get", json.dumps({"sensor_id": gas_sensor, "ppm": ppm, "action": "get"}), 1)
+
+    prober = threading.Thread(target=probe, name="GasProbe", daemon=True)
+    try:
+        prober.start()
+        fleet = SensorFleet(sensors, rate_hz=args.rate / len(sensors))
+        sent = fleet.run(FakeClient(broker, "Sensors").publish, args.duration)
+        stop.set()
+        prober.join()
+        broker.drain()
+        controller.stop()
+        transport.stop()
+    finally:
+        restore()
+        broker.stop()
+    return sent, gas_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--rules-per-sensor", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=4000, help="routine readings per second, all sensors")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--probe-ms", type=float, default=100, help="interval between gas readings")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "priority.db")
+        gas_sensor, sensors = setup_database(db_path, args.sensors, args.rules_per_sensor)
+        for label, priorities in (("priority lanes", DEFAULT_PRIORITIES), ("single lane", {})):
+            sent, latencies = run(db_path, gas_sensor, sensors, priorities, args)
+            summary = summarize_ms(latencies)
+            if not latencies:
+                print(f"{label:<15} {sent} routine readings, no gas actions")
+                continue
+            print(f"{label:<15} {sent / args.duration:6.0f} routine readings/s, {summary['count']} gas actions, "
+                  f"latency ms: p50 {summary['p50']:.2f}  p95 {summary['p95']:.2f}  p99 {summary['p99']:.2f}  "
+                  f"max {summary['max']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
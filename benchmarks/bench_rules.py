@@ -0,0 +1,68 @@
+"""Rule loading: the joined rules query and compilation into the Controller's TriggerIndex.
+
+Run from the project root:  python -m benchmarks.bench_rules --rules 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from controller import RuleBuilder
+from controller.controller import load_trigger_index
+from db import Database
+
+CATEGORIES = ("temperature", "humidity", "light", "gas", "water")
+
+
+def setup_rules(db, count, sensors):
+    sensor_ids = [db.add_sensor(f"sensor {i}", CATEGORIES[i % len(CATEGORIES)], "bench") for i in range(sensors)]
+    for i in range(count):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        rule = (RuleBuilder(f"bench {i}")
+                .add_trigger(f"{category}/get", sensor_ids[i % sensors])
+                .add_trigger_condition("value", f">={i % 50}")
+                .add_trigger_condition("value", f"<={i % 50 + 20}")
+                .add_action(f"{category}/send", 1, f'{{"device_id": {i % 10 + 1}, "state": "on"}}'))
+        if i % 4 == 0:
+            rule.add_action("alerts/send", 0, f'{{"rule": {i}}}')
+        db.add_rule(rule.build())
+
+
+def measure(db, runs):
+    query, total = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        db.get_rules()
+        query.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        load_trigger_index(db)
+        total.append(time.perf_counter() - started)
+    tracemalloc.start()
+    index = load_trigger_index(db)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(query), min(total), size / len(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(db_path=os.path.join(directory, "rules.db"))
+        started = time.perf_counter()
+        setup_rules(db, args.rules, args.sensors)
+        print(f"saved {args.rules} rules in {time.perf_counter() - started:.2f}s")
+        query, total, per_rule = measure(db, args.runs)
+        db.close()
+
+    print(f"get_rules query: {query * 1000:.1f} ms, load into TriggerIndex: {total * 1000:.1f} ms "
+          f"(best of {args.runs}), {per_rule / 1024:.2f} KiB per compiled rule")
+
+
+if __name__ == "__main__":
+    main()
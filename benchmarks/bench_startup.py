@@ -0,0 +1,73 @@
+"""Cold start of the headless services: launch to first processed message, in a fresh interpreter.
+
+Run from the project root:  python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .e2e import setup_database
+
+# Runs in the child with the project root on sys.path and a scratch directory as cwd
+CHILD = r"""
+import time
+launched = time.perf_counter()
+import json, os, sys
+
+import paho.mqtt.client as paho
+
+import main as entry
+from benchmarks.fake_broker import FakeBroker, FakeClient
+from db.registry import MetadataRegistry
+from metrics import STARTUP
+from monitor import EventFeed, LastValueCache
+from transport import MqttTransport
+
+STARTUP.launched = launched
+broker = FakeBroker()
+broker.start()
+transport = MqttTransport("bench", paho.MQTTv5, client=FakeClient(broker))
+entry.main(EventFeed(), MetadataRegistry(), LastValueCache(), 0, transport=transport)
+broker.publish("temperature/get", json.dumps({"sensor_id": 1, "temperature": 99}))
+transport.wait_first_message(timeout=10)
+print(json.dumps({
+    "first_message_ms": (time.perf_counter() - launched) * 1000,
+    "gui_modules_loaded": sorted(name for name in ("tkinter", "matplotlib", "numpy") if name in sys.modules),
+    "report": STARTUP.summary(),
+}))
+os._exit(0)
+"""
+
+
+def run_once(root, directory):
+    env = dict(os.environ, PYTHONPATH=root, SMART_HOME_METRICS_PORT="0", SMART_HOME_LOG_LEVEL="WARNING")
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=directory, env=env, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--triggers", type=int, default=500)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "db"))
+        setup_database(os.path.join(directory, "db", "smart_home_monitor.db"), args.sensors, args.triggers)
+        results = [run_once(root, directory) for _ in range(args.runs)]
+
+    print(results[-1]["report"])
+    print(f"GUI modules imported: {results[-1]['gui_modules_loaded'] or 'none'}")
+    times = sorted(result["first_message_ms"] for result in results)
+    print(f"launch -> first processed message: min {times[0]:.0f} ms, median {times[len(times) // 2]:.0f} ms, "
+          f"max {times[-1]:.0f} ms over {len(times)} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""End-to-end throughput and latency benchmark for Controller and Monitor, fully offline.
+
+Run from the project root, e.g.:
+    python -m benchmarks.e2e --sensors 1000 --rate 1 --duration 10
+    python -m benchmarks.e2e --rate 0 --compare benchmarks/results/e2e-previous.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import paho.mqtt.client as paho
+
+from codec import JSON, READING, get_codec
+from controller import Controller, PriorityDispatcher
+from db import Database
+from monitor import Monitor
+from transport import MqttTransport
+
+from .fake_broker import FakeBroker, FakeClient
+from .load_generator import SHAPES, SensorFleet
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def setup_database(path, sensor_count, trigger_count):
+    """Create sensors across all categories, one device per category and threshold triggers"""
+    db = Database(db_path=path)
+    categories = list(SHAPES)
+    devices = {category: db.add_device(f"{category} actuator", category, "Bench") for category in categories}
+    sensors = []
+    for i in range(sensor_count):
+        category = categories[i % len(categories)]
+        sensors.append((db.add_sensor(f"{category} sensor {i}", category, "Bench"), category))
+    for i in range(trigger_count):
+        sensor_id, category = sensors[i % len(sensors)]
+        field, low, high, _ = SHAPES[category]
+        # Threshold at the midpoint: roughly half of the readings fire
+        db.add_trigger(f"bench {i}", sensor_id, {field: f">={(low + high) / 2}"}, devices[category], {"state": "on"})
+    db.close()
+    return sensors
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def time_calls(cls, name, samples):
+    # Records the wall time of every call to cls.name; returns a function that undoes it
+    original = getattr(cls, name)
+
+    def timed(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    setattr(cls, name, timed)
+    return lambda: setattr(cls, name, original)
+
+
+def attribute_actions(broker):
+    # Rules are evaluated on the dispatcher's thread, not the broker's; count what they publish as
+    # actions of the message being handled. Returns a function that undoes it
+    original = PriorityDispatcher.handle
+
+    def handle(self, topic, payload, msg, *context):
+        with broker.handling(msg):
+            return original(self, topic, payload, msg, *context)
+
+    PriorityDispatcher.handle = handle
+    return lambda: setattr(PriorityDispatcher, "handle", original)
+
+
+def summarize_ms(samples):
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values) * 1000,
+        "p50": percentile(values, 50) * 1000,
+        "p95": percentile(values, 95) * 1000,
+        "p99": percentile(values, 99) * 1000,
+        "max": values[-1] * 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="smarthome-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    sensors = setup_database(db_path, args.sensors, args.triggers)
+    fleet = SensorFleet(sensors, rate_hz=args.rate, extra_fields=args.extra_fields, codec=get_codec(args.codec))
+
+    broker = FakeBroker()
+    broker.start()
+    commit_samples, trigger_samples = [], []
+    restore = [time_calls(Database, "log_events", commit_samples),
+               time_calls(Database, "log_triggers", trigger_samples),
+               attribute_actions(broker)]
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    try:
+        transport = MqttTransport("Smart_Home", paho.MQTTv5, client=FakeClient(broker, "Smart_Home"))
+        controller = Controller(transport, db_path=db_path)
+        monitor = Monitor(transport, db_path=db_path)
+        transport.connect("localhost", 1883, "bench", "bench")
+        transport.start()
+        controller.start()
+        monitor.start()
+
+        publisher = FakeClient(broker, "Sensors")
+        started = time.perf_counter()
+        sent = fleet.run(publisher.publish, args.duration)
+        published = time.perf_counter()
+        broker.drain()
+        monitor.stop()
+        controller.stop()
+        transport.stop()
+        finished = time.perf_counter()
+    finally:
+        for undo in restore:
+            undo()
+        broker.stop()
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    elapsed = finished - started
+    return {
+        "benchmark": "e2e",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {"sensors": args.sensors, "rate_hz": args.rate, "duration_s": args.duration,
+                   "triggers": args.triggers, "extra_fields": args.extra_fields, "codec": args.codec},
+        "messages": {"sent": sent, "offered_per_s": sent / (published - started), "processed_per_s": sent / elapsed,
+                     "actions": len(broker.action_latencies), "elapsed_s": elapsed},
+        "sensor_to_action_latency_ms": summarize_ms(broker.action_latencies),
+        "db_event_commit_ms": summarize_ms(commit_samples),
+        "db_trigger_commit_ms": summarize_ms(trigger_samples),
+        "db_size_kb": sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)) // 1024,
+        "memory": {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   "tracemalloc_peak_kb": traced_peak // 1024 if traced_peak is not None else None},
+    }
+
+
+def compare(result, baseline):
+    rows = (
+        ("processed msgs/s", result["messages"]["processed_per_s"], baseline["messages"]["processed_per_s"]),
+        ("latency p50 ms", result["sensor_to_action_latency_ms"].get("p50"),
+         baseline["sensor_to_action_latency_ms"].get("p50")),
+        ("latency p99 ms", result["sensor_to_action_latency_ms"].get("p99"),
+         baseline["sensor_to_action_latency_ms"].get("p99")),
+        ("event commit p95 ms", result["db_event_commit_ms"].get("p95"), baseline["db_event_commit_ms"].get("p95")),
+        ("max rss kB", result["memory"]["max_rss_kb"], baseline["memory"]["max_rss_kb"]),
+    )
+    for label, current, previous in rows:
+        if current is None or not previous:
+            continue
+        print(f"  {label:<22} {previous:>12.2f} -> {current:>12.2f}  ({(current - previous) / previous:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=1.0, help="readings per sensor per second, 0 = unthrottled")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load to generate")
+    parser.add_argument("--triggers", type=int, default=200)
+    parser.add_argument("--extra-fields", type=int, default=0, help="padding fields per payload")
+    parser.add_argument("--codec", default=JSON.content_type, choices=[JSON.content_type, READING.content_type],
+                        help="content type sensors publish with")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations (slower)")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/e2e-<time>.json)")
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    latency = result["sensor_to_action_latency_ms"]
+    print(f"{result['messages']['sent']} messages, {result['messages']['processed_per_s']:.0f} msgs/s processed, "
+          f"{result['messages']['actions']} actions")
+    if latency["count"]:
+        print(f"sensor->action latency ms: p50 {latency['p50']:.2f}  p95 {latency['p95']:.2f}  p99 {latency['p99']:.2f}")
+    print(f"results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
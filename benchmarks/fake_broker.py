@@ -0,0 +1,146 @@
+"""In-process stand-in for the MQTT broker and paho client, for offline benchmarks."""
+from contextlib import contextmanager
+import queue
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+
+class FakeMessage:
+    __slots__ = ("topic", "payload", "qos", "retain", "properties", "sent_at")
+
+    def __init__(self, topic, payload, qos, sent_at, properties=None):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else str(payload).encode()
+        self.qos = qos
+        self.retain = False
+        self.properties = properties
+        self.sent_at = sent_at
+
+
+class FakeBroker:
+    # Delivers every publish to the matching subscribers on a single thread, like
+    # paho's network loop. A publish made while a message is being delivered is
+    # attributed to that message, which is how sensor-to-action latency is measured.
+    # Handlers that run off the delivery thread mark their message with handling().
+
+    def __init__(self):
+        self.__queue = queue.Queue()
+        self.__subscriptions = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__thread = None
+        self.delivered = 0
+        self.action_latencies = []
+        self.on_action = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="FakeBroker", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def drain(self):
+        self.__queue.join()
+
+    @contextmanager
+    def handling(self, msg):
+        """Attribute publishes made on this thread to `msg` while the block runs"""
+        previous = getattr(self.__local, "inbound", None)
+        self.__local.inbound = msg
+        try:
+            yield
+        finally:
+            self.__local.inbound = previous
+
+    def subscribe(self, client, topic):
+        with self.__lock:
+            self.__subscriptions.append((topic, client))
+
+    def unsubscribe(self, client, topic):
+        with self.__lock:
+            self.__subscriptions = [sub for sub in self.__subscriptions if sub != (topic, client)]
+
+    def publish(self, topic, payload, qos=0, properties=None):
+        now = time.perf_counter()
+        inbound = getattr(self.__local, "inbound", None)
+        if inbound is not None:
+            self.action_latencies.append(now - inbound.sent_at)
+            if self.on_action is not None:
+                self.on_action(topic, payload, inbound)
+        self.__queue.put(FakeMessage(topic, payload, qos, now, properties))
+
+    def __run(self):
+        while True:
+            msg = self.__queue.get()
+            if msg is None:
+                self.__queue.task_done()
+                return
+            with self.__lock:
+                clients = [client for topic, client in self.__subscriptions if topic_matches_sub(topic, msg.topic)]
+            self.__local.inbound = msg
+            for client in clients:
+                client.deliver(msg)
+            self.__local.inbound = None
+            self.delivered += 1
+            self.__queue.task_done()
+
+
+class FakeClient:
+    # Implements the subset of paho.mqtt.client.Client used by MqttTransport
+
+    def __init__(self, broker, client_id=""):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_subscribe = None
+        self.on_publish = None
+        self.on_message = None
+        self.__mid = 0
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, *args, **kwargs):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0, None)
+
+    def connect_async(self, host, port=1883, *args, **kwargs):
+        self.connect(host, port)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self, *args, **kwargs):
+        pass
+
+    def subscribe(self, topic, qos=0, *args, **kwargs):
+        self.broker.subscribe(self, topic)
+        self.__mid += 1
+        if self.on_subscribe:
+            self.on_subscribe(self, None, self.__mid, (qos,), None)
+        return 0, self.__mid
+
+    def unsubscribe(self, topic, *args, **kwargs):
+        self.broker.unsubscribe(self, topic)
+        return 0, self.__mid
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.broker.publish(topic, payload, qos, properties)
+        self.__mid += 1
+        if self.on_publish:
+            self.on_publish(self, None, self.__mid, None)
+
+    def deliver(self, msg):
+        if self.on_message:
+            self.on_message(self, None, msg)
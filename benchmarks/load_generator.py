@@ -0,0 +1,54 @@
+"""Synthetic Node-RED-style sensor fleet for benchmarks."""
+import random
+import time
+
+from codec import JSON
+from transport import content_type_properties
+
+# category -> (payload field, low, high, unit), mirroring the Node-RED simulation flows
+SHAPES = {
+    "temperature": ("temperature", 14.0, 30.0, "C"),
+    "light": ("brightness", 0.0, 100.0, "%"),
+    "water": ("humidity", 20.0, 90.0, "%"),
+    "gas": ("ppm", 0.0, 1200.0, "ppm"),
+}
+
+
+class SensorFleet:
+    # `sensors` is a list of (sensor_id, category). Each tick every sensor publishes one
+    # reading on '<category>/get'; `extra_fields` pads payloads to exercise larger shapes.
+    # Readings are encoded with `codec` and carry its content type unless that is JSON.
+
+    def __init__(self, sensors, rate_hz=1.0, extra_fields=0, seed=1, codec=JSON):
+        self.sensors = sensors
+        self.rate_hz = rate_hz
+        self.extra_fields = extra_fields
+        self.random = random.Random(seed)
+        self.codec = codec
+
+    def reading(self, sensor_id, category):
+        field, low, high, unit = SHAPES[category]
+        payload = {"sensor_id": sensor_id, field: round(self.random.uniform(low, high), 2), "unit": unit,
+                   "action": "get"}
+        for i in range(self.extra_fields):
+            payload[f"extra_{i}"] = self.random.random()
+        return f"{category}/get", self.codec.encode(payload)
+
+    def run(self, publish, duration_s):
+        """Publish readings for `duration_s`; rate_hz <= 0 publishes as fast as possible. Returns the count sent."""
+        sent = 0
+        interval = 1.0 / self.rate_hz if self.rate_hz > 0 else 0.0
+        properties = {} if self.codec is JSON else {"properties": content_type_properties(self.codec.content_type)}
+        started = time.perf_counter()
+        next_tick = started
+        while time.perf_counter() - started < duration_s:
+            for sensor_id, category in self.sensors:
+                topic, payload = self.reading(sensor_id, category)
+                publish(topic, payload, 1, **properties)
+                sent += 1
+            if interval:
+                next_tick += interval
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        return sent
@@ -0,0 +1,4 @@
+from .base import Codec, CodecError
+from .json_codec import JSON, JsonCodec
+from .reading import READING, ReadingCodec
+from .registry import content_type_of, detect, get_codec, register
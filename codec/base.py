@@ -0,0 +1,21 @@
+from abc import ABC, abstractmethod
+
+
+class CodecError(ValueError):
+    pass
+
+
+class Codec(ABC):
+    # Encodes payload objects to bytes and back. `content_type` is the MQTTv5 content-type
+    # that selects the codec. Binary codecs also set `magic`, the first byte of everything
+    # they encode, so their payloads are recognised where no content type travels with them.
+    content_type = None
+    magic = None
+
+    @abstractmethod
+    def encode(self, payload):
+        """Bytes for a payload object"""
+
+    @abstractmethod
+    def decode(self, data):
+        """The payload object in `data`; raises ValueError (CodecError) if it is not one"""
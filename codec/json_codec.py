@@ -0,0 +1,19 @@
+import json
+
+from .base import Codec
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+class JsonCodec(Codec):
+    # The default: what Node-RED and older clients send, with or without a content type
+    content_type = "application/json"
+
+    def encode(self, payload):
+        return _ENCODER.encode(payload).encode()
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+JSON = JsonCodec()
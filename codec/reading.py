@@ -0,0 +1,167 @@
+import math
+import struct
+
+from .base import Codec, CodecError
+
+# Layout of an encoded reading:
+#   magic byte, layout length (1 byte), layout, then the values packed little-endian.
+# The layout names each field and its type, so a sensor sending the same shape every time
+# produces the same layout bytes, and decoding is one cached struct unpack plus a dict.
+# Per field the layout holds a key (a byte below 0x80 indexes KEYS; 0x80 | n is followed
+# by an n-byte UTF-8 key), a type tag, and for strings a length byte.
+
+MAGIC = 0xB1    # Format version 1; never the first byte of JSON text
+
+# Keys common in sensor and device payloads. Append only: indexes are part of the format.
+KEYS = (
+    "sensor_id", "device_id", "action", "unit", "value", "state", "temperature", "humidity", "brightness", "ppm",
+    "level", "battery", "pressure", "power", "energy", "voltage", "current", "flow", "motion", "occupied", "mode",
+    "timestamp",
+)
+_KEY_INDEX = {key: index for index, key in enumerate(KEYS)}
+
+_NONE, _BOOL, _INT8, _INT16, _INT32, _INT64, _FLOAT64, _STR = range(8)
+# Decimal fractions such as 22.5 are sent as an integer and a power-of-ten scale (tag | scale)
+_SCALED16, _SCALED32 = 0x10, 0x20
+_MAX_SCALE = 6
+
+_FORMATS = {_NONE: "B", _BOOL: "?", _INT8: "b", _INT16: "h", _INT32: "i", _INT64: "q", _FLOAT64: "d"}
+
+_LAYOUT_CACHE_LIMIT = 1024
+
+
+def _number_tag(value):
+    if isinstance(value, int):
+        if -0x80 <= value < 0x80:
+            return _INT8, value
+        if -0x8000 <= value < 0x8000:
+            return _INT16, value
+        if -0x80000000 <= value < 0x80000000:
+            return _INT32, value
+        if -0x8000000000000000 <= value < 0x8000000000000000:
+            return _INT64, value
+        raise CodecError(f"Integer {value} does not fit in 64 bits")
+    if math.isfinite(value) and abs(value) < 1e9:
+        for scale in range(_MAX_SCALE + 1):
+            factor = 10 ** scale
+            mantissa = round(value * factor)
+            # Scale 0 still decodes to a float, so 21.0 stays a float
+            if mantissa / factor == value:
+                if -0x8000 <= mantissa < 0x8000:
+                    return _SCALED16 | scale, mantissa
+                if -0x80000000 <= mantissa < 0x80000000:
+                    return _SCALED32 | scale, mantissa
+                break
+    return _FLOAT64, value
+
+
+class ReadingCodec(Codec):
+    # Compact binary encoding of flat readings: string keys mapped to numbers, booleans,
+    # None or short strings. Anything else, e.g. nested objects, raises CodecError and
+    # should be sent as JSON.
+    content_type = "application/vnd.smarthome.reading"
+    magic = MAGIC
+
+    def __init__(self):
+        self.__layouts = {}
+
+    def encode(self, payload):
+        if not isinstance(payload, dict):
+            raise CodecError(f"Readings are flat objects, got {type(payload).__name__}")
+        layout = bytearray()
+        fmt = ["<"]
+        values = []
+        for key, value in payload.items():
+            if not isinstance(key, str):
+                raise CodecError(f"Reading keys are strings, got {key!r}")
+            index = _KEY_INDEX.get(key)
+            if index is not None:
+                layout.append(index)
+            else:
+                encoded = key.encode()
+                if len(encoded) >= 0x80:
+                    raise CodecError(f"Key {key!r} is too long for a reading")
+                layout.append(0x80 | len(encoded))
+                layout += encoded
+
+            if value is None:
+                tag, value = _NONE, 0
+            elif isinstance(value, bool):
+                tag = _BOOL
+            elif isinstance(value, (int, float)):
+                tag, value = _number_tag(value)
+            elif isinstance(value, str):
+                value = value.encode()
+                if len(value) > 0xFF:
+                    raise CodecError(f"String value of {key!r} is too long for a reading")
+                layout += bytes((_STR, len(value)))
+                fmt.append(f"{len(value)}s")
+                values.append(value)
+                continue
+            else:
+                raise CodecError(f"Value of {key!r} is not a number, boolean, None or string")
+            layout.append(tag)
+            fmt.append("h" if tag & _SCALED16 else "i" if tag & _SCALED32 else _FORMATS[tag])
+            values.append(value)
+
+        if len(layout) > 0xFF:
+            raise CodecError("Reading has too many fields")
+        return bytes((MAGIC, len(layout))) + layout + struct.pack("".join(fmt), *values)
+
+    def decode(self, data):
+        if len(data) < 2 or data[0] != MAGIC:
+            raise CodecError("Not an encoded reading")
+        start = 2 + data[1]
+        layout_bytes = bytes(data[2:start])
+        layout = self.__layouts.get(layout_bytes)
+        if layout is None:
+            layout = self.__parse_layout(layout_bytes)
+        keys, packed, fixups = layout
+        if len(data) != start + packed.size:
+            raise CodecError("Encoded reading is truncated")
+        values = packed.unpack_from(data, start)
+        if fixups:
+            values = list(values)
+            for index, fixup in fixups:
+                values[index] = fixup(values[index])
+        return dict(zip(keys, values))
+
+    def __parse_layout(self, layout):
+        keys, fmt, fixups = [], ["<"], []
+        offset = 0
+        try:
+            while offset < len(layout):
+                key = layout[offset]
+                offset += 1
+                if key < 0x80:
+                    keys.append(KEYS[key])
+                else:
+                    length = key & 0x7F
+                    keys.append(layout[offset:offset + length].decode())
+                    offset += length
+                tag = layout[offset]
+                offset += 1
+                index = len(keys) - 1
+                if tag == _STR:
+                    fmt.append(f"{layout[offset]}s")
+                    offset += 1
+                    fixups.append((index, bytes.decode))
+                elif tag >> 4 in (1, 2):
+                    if tag & 0x0F > _MAX_SCALE:
+                        raise CodecError("Encoded reading has an unknown decimal scale")
+                    fmt.append("h" if tag & _SCALED16 else "i")
+                    fixups.append((index, lambda mantissa, factor=10 ** (tag & 0x0F): mantissa / factor))
+                else:
+                    fmt.append(_FORMATS[tag])
+                    if tag == _NONE:
+                        fixups.append((index, lambda _: None))
+        except (IndexError, KeyError, UnicodeDecodeError):
+            raise CodecError("Encoded reading has a malformed layout") from None
+        parsed = (tuple(keys), struct.Struct("".join(fmt)), tuple(fixups))
+        if len(self.__layouts) >= _LAYOUT_CACHE_LIMIT:
+            self.__layouts.clear()
+        self.__layouts[layout] = parsed
+        return parsed
+
+
+READING = ReadingCodec()
@@ -0,0 +1,37 @@
+from .json_codec import JSON
+from .reading import READING
+
+_BY_CONTENT_TYPE = {}
+_BY_MAGIC = {}
+
+
+def register(codec):
+    _BY_CONTENT_TYPE[codec.content_type] = codec
+    if codec.magic is not None:
+        _BY_MAGIC[codec.magic] = codec
+
+
+def get_codec(content_type):
+    """Codec for an MQTTv5 content type; JSON when there is none, None when it is not supported"""
+    if not content_type:
+        return JSON
+    return _BY_CONTENT_TYPE.get(content_type.split(";", 1)[0].strip().lower())
+
+
+def detect(data, content_type=None):
+    """Codec for a payload: by its content type when it has one, else by its first byte"""
+    if content_type:
+        return get_codec(content_type)
+    if data:
+        return _BY_MAGIC.get(data[0], JSON)
+    return JSON
+
+
+def content_type_of(msg):
+    """The content-type property of a received MQTT message, if it carries one"""
+    properties = getattr(msg, "properties", None)
+    return getattr(properties, "ContentType", None) if properties is not None else None
+
+
+register(JSON)
+register(READING)
@@ -1,2 +1,3 @@
 from .controller import Controller
-from .rules import RuleBuilder
+from .dispatch import CRITICAL, ROUTINE, PriorityDispatcher
+from .rules import Action, Rule, RuleBuilder
@@ -0,0 +1,179 @@
+import operator
+
+from .conditions import Comparison, Range
+
+# Integers past 2**53 do not survive float64; messages carrying one are evaluated one at a time
+_EXACT_INT = 2 ** 53
+_INEXACT = object()
+_NAN = float("nan")
+
+# Buckets with fewer batchable triggers than this are cheaper to evaluate one message at a time
+MIN_BATCHED = 4
+
+_PROGRAM_CACHE_LIMIT = 65536
+
+
+def _exact(number):
+    return isinstance(number, float) or -_EXACT_INT <= number <= _EXACT_INT
+
+
+def is_batchable(trigger):
+    """Whether a trigger's decision depends on nothing but the current message's numbers: no debounce,
+    no windows, and only numeric comparisons and ranges, which float64 evaluates like Python does"""
+    if trigger.debounce is not None or not trigger.compiled:
+        return False
+    for _, predicate in trigger.compiled:
+        if isinstance(predicate, Comparison):
+            if not predicate.vectorizable or not _exact(predicate.operand):
+                return False
+        elif isinstance(predicate, Range):
+            if not (_exact(predicate.low) and _exact(predicate.high)):
+                return False
+        else:
+            return False
+    return True
+
+
+def _number(value):
+    # The coercion the predicates apply for a numeric operand; None where they would not hold
+    if type(value) is float:
+        return value
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if _exact(value) else _INEXACT
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+class BatchProgram:
+    # The batchable triggers of one match() result in vector form. Every condition is a
+    # column, and the columns of each (field, operator) are one slice, so the messages'
+    # values are compared against all of them in one broadcast. A trigger fires for a
+    # message when each of its columns holds.
+    __slots__ = ("triggers", "scalar", "fields", "width", "order", "starts", "fired_at")
+
+    def __init__(self, triggers, batched):
+        import numpy as np
+
+        self.triggers = triggers
+        self.scalar = frozenset(range(len(triggers))).difference(batched)
+        groups = {}
+        for rule, position in enumerate(batched):
+            for key, predicate in triggers[position].compiled:
+                if isinstance(predicate, Range):
+                    groups.setdefault(key, {}).setdefault(None, []).append((rule, predicate.low, predicate.high))
+                else:
+                    groups.setdefault(key, {}).setdefault(predicate.op, []).append((rule, predicate.operand, None))
+        ufuncs = {operator.lt: np.less, operator.le: np.less_equal, operator.eq: np.equal,
+                  operator.ne: np.not_equal, operator.ge: np.greater_equal, operator.gt: np.greater}
+        self.fields = []
+        rules = []
+        for key, ops in groups.items():
+            slices = []
+            for op, columns in ops.items():
+                low = np.array([low for _, low, _ in columns], dtype=float)
+                high = np.array([high for _, _, high in columns], dtype=float) if op is None else None
+                slices.append((ufuncs.get(op), op is operator.ne, len(rules), len(rules) + len(columns), low, high))
+                rules.extend(rule for rule, _, _ in columns)
+            self.fields.append((key, slices))
+        self.width = len(rules)
+        if self.width == len(batched):
+            # One condition per trigger, the common case: every column already is a trigger
+            self.order = self.starts = None
+            self.fired_at = np.array(batched, dtype=np.intp)[rules]
+        else:
+            self.order = np.argsort(rules, kind="stable")
+            self.starts = np.searchsorted(np.array(rules)[self.order], np.arange(len(batched)))
+            self.fired_at = np.array(batched, dtype=np.intp)
+
+    def evaluate(self, payloads):
+        """(fired, inexact): for each payload the positions in `triggers` of the batched triggers
+        that fire, and the set of payloads it cannot decide, which are left to the scalar path"""
+        import numpy as np
+
+        count = len(payloads)
+        held = np.empty((count, self.width), dtype=bool)
+        inexact = set()
+        for key, slices in self.fields:
+            numbers = [_number(payload.get(key)) for payload in payloads]
+            valid = None
+            if None in numbers or _INEXACT in numbers:
+                # NaN fails every comparison but '!=', which is masked below
+                valid = np.ones((count, 1), dtype=bool)
+                for row, number in enumerate(numbers):
+                    if number is None or number is _INEXACT:
+                        if number is _INEXACT:
+                            inexact.add(row)
+                        numbers[row] = _NAN
+                        valid[row] = False
+            values = np.array(numbers, dtype=float)[:, None]
+            for ufunc, masked, start, stop, low, high in slices:
+                if ufunc is None:
+                    np.logical_and(values >= low, values <= high, out=held[:, start:stop])
+                elif masked and valid is not None:
+                    np.logical_and(values != low, valid, out=held[:, start:stop])
+                else:
+                    ufunc(values, low, out=held[:, start:stop])
+        if self.order is None:
+            fires = held
+        else:
+            fires = np.logical_and.reduceat(held[:, self.order], self.starts, axis=1)
+        fired = [[] for _ in range(count)]
+        # Thresholds rarely hold, so collect only the hits. Columns are in (field, operator)
+        # order; sort the hits back into bucket order, which is the order actions go out in
+        rows, columns = np.nonzero(fires)
+        positions = self.fired_at[columns]
+        order = np.lexsort((positions, rows))
+        for row, position in zip(rows[order].tolist(), positions[order].tolist()):
+            fired[row].append(position)
+        return fired, inexact
+
+
+class BatchEvaluator:
+    # Decides the batchable triggers of a micro-batch of messages with one BatchProgram
+    # per (topic, sensor_id), before any of them is dispatched. What depends on state
+    # (debounce, windows, device deduplication) is left to the per-message pass.
+
+    def __init__(self, triggers):
+        self.__triggers = triggers
+        self.__programs = {}
+
+    def prepare(self, items):
+        """A decision per (topic, payload, ...) item: (program, fired positions) for Controller's
+        decided_triggers, or None where the message is evaluated as usual"""
+        groups = {}
+        for index, (topic, payload, *_) in enumerate(items):
+            if isinstance(payload, dict):
+                try:
+                    groups.setdefault((topic, payload.get("sensor_id")), []).append(index)
+                except TypeError:
+                    pass
+        decisions = [None] * len(items)
+        for key, indexes in groups.items():
+            program = self.__program(*key)
+            if program is None:
+                continue
+            fired, inexact = program.evaluate([items[index][1] for index in indexes])
+            for row, index in enumerate(indexes):
+                if row not in inexact:
+                    decisions[index] = (program, fired[row])
+        return decisions
+
+    def __program(self, topic, sensor_id):
+        # Buckets are replaced, never changed, when rules change, so identity tells a stale program
+        exact, wide = self.__triggers.buckets(topic, sensor_id)
+        cached = self.__programs.get((topic, sensor_id))
+        if cached is not None and cached[0] is exact and cached[1] is wide:
+            return cached[2]
+        triggers = exact + wide
+        batched = [position for position, trigger in enumerate(triggers) if is_batchable(trigger)]
+        program = BatchProgram(triggers, batched) if len(batched) >= MIN_BATCHED else None
+        if len(self.__programs) >= _PROGRAM_CACHE_LIMIT:
+            self.__programs.clear()
+        self.__programs[(topic, sensor_id)] = (exact, wide, program)
+        return program
@@ -0,0 +1,240 @@
+import operator
+import re
+
+
+class ConditionError(ValueError):
+    pass
+
+
+# Longest operators first so '>=' is not read as '>' followed by '=14'
+_OPERATORS = (
+    (">=", operator.ge),
+    ("<=", operator.le),
+    ("==", operator.eq),
+    ("!=", operator.ne),
+    (">", operator.gt),
+    ("<", operator.lt),
+    ("=", operator.eq),
+)
+
+_SYMBOLS = {fn: symbol for symbol, fn in reversed(_OPERATORS)}
+
+AGGREGATES = ("avg", "min", "max", "sum", "count")
+
+# 'avg(5m) >= 22': an aggregate over a trailing window, then an ordinary condition
+_WINDOW = re.compile(r"^(avg|min|max|sum|count)\(\s*(\d+(?:\.\d+)?)\s*(s|m|h)?\s*\)")
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def _parse_literal(text, condition):
+    text = text.strip()
+    if not text:
+        raise ConditionError(f"Condition {condition!r} has no value to compare against")
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _coerce(value, operand):
+    # Payloads from Node-RED sometimes carry numbers and booleans as strings
+    if _is_number(operand):
+        if _is_number(value):
+            return value
+        if isinstance(value, str):
+            return float(value)
+        raise TypeError
+    if isinstance(operand, bool):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        raise TypeError
+    if isinstance(value, str):
+        return value
+    raise TypeError
+
+
+class Comparison:
+    __slots__ = ("op", "operand")
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def __call__(self, value):
+        try:
+            return self.op(_coerce(value, self.operand), self.operand)
+        except (TypeError, ValueError):
+            return False
+
+    @property
+    def vectorizable(self):
+        return _is_number(self.operand)
+
+    def vectorized(self, values):
+        # NumPy arrays broadcast through the same operator functions
+        return self.op(values, self.operand)
+
+    def relaxed(self, margin):
+        """The condition that keeps a fired trigger latched: thresholds moved back by `margin`"""
+        if not self.vectorizable:
+            return self
+        if self.op in (operator.gt, operator.ge):
+            return Comparison(self.op, self.operand - margin)
+        if self.op in (operator.lt, operator.le):
+            return Comparison(self.op, self.operand + margin)
+        return self
+
+    def __repr__(self):
+        return f"Comparison({_SYMBOLS[self.op]}{self.operand!r})"
+
+
+class Range:
+    __slots__ = ("low", "high")
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def __call__(self, value):
+        try:
+            value = _coerce(value, self.low)
+        except (TypeError, ValueError):
+            return False
+        return self.low <= value <= self.high
+
+    vectorizable = True
+
+    def vectorized(self, values):
+        return (values >= self.low) & (values <= self.high)
+
+    def relaxed(self, margin):
+        return Range(self.low - margin, self.high + margin)
+
+    def __repr__(self):
+        return f"Range({self.low!r}..{self.high!r})"
+
+
+class Windowed:
+    # Applies a condition to an aggregate of the field's trailing window instead of the
+    # current value. The window itself is owned by a WindowStore, which binds it here.
+    __slots__ = ("aggregate", "seconds", "inner", "window")
+
+    vectorizable = False
+
+    def __init__(self, aggregate, seconds, inner, window=None):
+        self.aggregate = aggregate
+        self.seconds = seconds
+        self.inner = inner
+        self.window = window
+
+    def __call__(self, value):
+        if self.window is None:
+            return False
+        aggregate = self.window.value()
+        return aggregate is not None and self.inner(aggregate)
+
+    def relaxed(self, margin):
+        return Windowed(self.aggregate, self.seconds, self.inner.relaxed(margin), self.window)
+
+    def __repr__(self):
+        return f"Windowed({self.aggregate}({self.seconds:g}s) {self.inner!r})"
+
+
+_SHARED = {}
+_SHARED_LIMIT = 4096
+
+
+def compile_condition(condition):
+    """Parse a single condition, e.g. '>=14', '!=off', '18..24', 'true' or 'avg(5m)>=22', into a predicate"""
+    if not isinstance(condition, (str, int, float)):
+        return _compile_condition(condition)
+    # Comparison and Range are immutable, so rules with the same condition share one;
+    # a Windowed predicate holds its rule's window and is always built anew
+    key = (type(condition), condition)
+    predicate = _SHARED.get(key)
+    if predicate is None:
+        predicate = _compile_condition(condition)
+        if not isinstance(predicate, Windowed) and len(_SHARED) < _SHARED_LIMIT:
+            _SHARED[key] = predicate
+    return predicate
+
+
+def _compile_condition(condition):
+    if isinstance(condition, bool) or _is_number(condition):
+        return Comparison(operator.eq, condition)
+    if not isinstance(condition, str):
+        raise ConditionError(f"Condition {condition!r} must be a string, number or boolean")
+
+    text = condition.strip()
+    window = _WINDOW.match(text)
+    if window is not None:
+        aggregate, amount, unit = window.groups()
+        seconds = float(amount) * _UNITS[unit]
+        if seconds <= 0:
+            raise ConditionError(f"Condition {condition!r} has an empty window")
+        if not text[window.end():].strip():
+            raise ConditionError(f"Condition {condition!r} has nothing to compare the {aggregate} with")
+        inner = compile_condition(text[window.end():])
+        if isinstance(inner, Windowed) or not inner.vectorizable:
+            raise ConditionError(f"Condition {condition!r} must compare the {aggregate} with a number")
+        return Windowed(aggregate, seconds, inner)
+
+    for symbol, op in _OPERATORS:
+        if text.startswith(symbol):
+            operand = _parse_literal(text[len(symbol):], condition)
+            if op not in (operator.eq, operator.ne) and isinstance(operand, bool):
+                raise ConditionError(f"Condition {condition!r} orders a boolean value")
+            return Comparison(op, operand)
+
+    if ".." in text:
+        low, _, high = text.partition("..")
+        low, high = _parse_literal(low, condition), _parse_literal(high, condition)
+        if not (_is_number(low) and _is_number(high)):
+            raise ConditionError(f"Range condition {condition!r} needs numeric bounds")
+        if low > high:
+            raise ConditionError(f"Range condition {condition!r} has its lower bound above its upper bound")
+        return Range(low, high)
+
+    return Comparison(operator.eq, _parse_literal(text, condition))
+
+
+def compile_conditions(conditions):
+    """Compile a {payload_key: condition} mapping, or (payload_key, condition) pairs that may repeat a key,
+    into a tuple of (key, predicate) pairs"""
+    if isinstance(conditions, dict):
+        conditions = conditions.items()
+    elif not isinstance(conditions, (list, tuple)):
+        raise ConditionError(f"Conditions must be a mapping of payload keys, got {type(conditions).__name__}")
+    compiled = []
+    for pair in conditions:
+        try:
+            key, condition = pair
+        except (TypeError, ValueError):
+            raise ConditionError(f"Conditions must be (payload key, condition) pairs, got {pair!r}") from None
+        try:
+            compiled.append((key, compile_condition(condition)))
+        except ConditionError as e:
+            raise ConditionError(f"Invalid condition for '{key}': {e}") from None
+    return tuple(compiled)
+
+
+def relax_conditions(compiled, margin):
+    """compile_conditions output with every numeric threshold moved back by the hysteresis `margin`"""
+    if not margin:
+        return compiled
+    return tuple((key, predicate.relaxed(margin)) for key, predicate in compiled)
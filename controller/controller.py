@@ -1,138 +1,345 @@
 import datetime
+import logging
+import sqlite3
+import threading
+import time
 
-import paho.mqtt.client as paho
-from paho import mqtt
-import json
+from db import Database, open_database
+from metrics import REGISTRY, STARTUP
+from .batch import BatchEvaluator
+from .conditions import ConditionError
+from .device_state import RATE_LIMITED, DeviceStateCache
+from .dispatch import CRITICAL, PriorityDispatcher
+from .rules import Action, Rule
+from .trigger_index import TriggerIndex
+from .trigger_log import TriggerLog
+from .windows import WindowStore
 
-from db import Database
 
+logger = logging.getLogger(__name__)
 
-def is_trigger_valid(trigger_condition, msg):
-    if trigger_condition["topic"] != msg.topic:
-        return False
-    msg_payload = json.loads(msg.payload)
-    if "sensor_id" not in msg_payload or trigger_condition["sensor_id"] != msg_payload["sensor_id"]:
-        return False
-    conditions = trigger_condition["conditions"]
-    is_triggers_valid = True
+RULE_EVALUATION_SECONDS = REGISTRY.histogram("smarthome_rule_evaluation_seconds",
+                                             "Time to evaluate the triggers matching one message")
+TRIGGER_FIRINGS = REGISTRY.counter("smarthome_trigger_firings_total", "Triggers whose conditions held", ("trigger",))
 
-    for key, comparator in conditions.items():
-        is_triggers_valid = is_triggers_valid and (
-                key in msg_payload and eval(str(msg_payload[key]) + comparator))
-        if not is_triggers_valid:
-            break
-    return is_triggers_valid
+# Seconds between deletions of rule changes older than a day
+RULE_CHANGE_PRUNE_INTERVAL = 3600
+
+
+def is_trigger_valid(compiled, msg_payload):
+    # Topic and sensor_id are matched by the TriggerIndex; only the payload conditions are checked here
+    for key, predicate in compiled:
+        if key not in msg_payload or not predicate(msg_payload[key]):
+            return False
+    return True
+
+
+def trigger_fires(trigger, msg_payload, now):
+    debounce = trigger.debounce
+    if debounce is None:
+        return is_trigger_valid(trigger.compiled, msg_payload)
+    # A message without the trigger's fields says nothing about it either way
+    for key, _ in trigger.compiled:
+        if key not in msg_payload:
+            return False
+    return debounce.update(is_trigger_valid(trigger.compiled, msg_payload),
+                           is_trigger_valid(trigger.sustained, msg_payload), now)
+
+
+def matching_triggers(triggers, topic, msg_payload, windows=None, now=None):
+    """The enabled triggers in `triggers` (a TriggerIndex) that fire for this decoded message.
+    `windows` is the WindowStore bound to them; `now` defaults to the current epoch time."""
+    if not isinstance(msg_payload, dict):
+        return []
+    sensor_id = msg_payload.get("sensor_id")
+    now = time.time() if now is None else now
+    if windows is not None and sensor_id is not None:
+        windows.push(sensor_id, msg_payload, now)
+    return [trigger for trigger in triggers.match(topic, sensor_id) if trigger_fires(trigger, msg_payload, now)]
+
+
+def decided_triggers(decision, msg_payload, windows=None, now=None):
+    """matching_triggers for a message whose batchable triggers a BatchEvaluator has already decided"""
+    program, fired = decision
+    sensor_id = msg_payload.get("sensor_id")
+    now = time.time() if now is None else now
+    if windows is not None and sensor_id is not None:
+        windows.push(sensor_id, msg_payload, now)
+    triggers = program.triggers
+    if not program.scalar:
+        return [triggers[position] for position in fired]
+    fired = set(fired)
+    return [trigger for position, trigger in enumerate(triggers)
+            if position in fired or (position in program.scalar and trigger_fires(trigger, msg_payload, now))]
+
+
+def build_trigger(db, trigger_id, name, sensor_id, conditions, device_id, action_payload, enabled=1,
+                  hold_seconds=0, cooldown_seconds=0, hysteresis=0):
+    """Rule on one sensor that sends `action_payload` to one device; raises ConditionError for malformed conditions"""
+    action = Action(db.get_device_category(device_id) + "/send", 1, {"device_id": device_id} | action_payload)
+    return Rule(trigger_id, name, db.get_sensor_category(sensor_id) + "/get", sensor_id, conditions, [action],
+                enabled, hold_seconds, cooldown_seconds, hysteresis)
+
+
+def load_rules(db, rule_ids=None):
+    """Every stored rule, or those in `rule_ids`, that compiles"""
+    rules = []
+    # Rules sending the same command share one Action (get_rules already shares the payload)
+    shared = {}
+    for rule_id, name, topic, sensor_id, conditions, actions, *options in db.get_rules(rule_ids):
+        for i, (action_topic, qos, payload) in enumerate(actions):
+            key = (action_topic, qos, id(payload))
+            action = shared.get(key)
+            if action is None:
+                action = shared[key] = Action(action_topic, qos, payload)
+            actions[i] = action
+        try:
+            rule = Rule(rule_id, name, topic, sensor_id, conditions, actions, *options)
+        except ConditionError as e:
+            logger.warning("Skipping rule %s: %s", name, e)
+            continue
+        rules.append(rule)
+    return rules
+
+
+def load_trigger_index(db):
+    """Every stored rule that compiles, indexed for dispatch"""
+    triggers = TriggerIndex()
+    triggers.add_many(load_rules(db))
+    return triggers
 
 
 class Controller:
-    def __init__(self, client_id, protocol, db_path=None):
-        self.__db = Database(db_path=db_path)
-        self.__client = paho.Client(client_id=client_id, protocol=protocol, userdata=None)
-        self.__client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
-
-        self.__triggers = []
-
-        def on_connect(client, userdata, flags, rc, properties=None):
-            print("CONNACK received with code " + str(rc))
-
-        def on_publish(client, userdata, mid, properties=None):
-            print("Published mid: " + str(mid))
-
-        def on_subscribe(client, userdata, mid, granted_qos, properties=None):
-            print("Subscribed: " + str(mid) + " " + str(granted_qos))
-
-        def on_message(client, userdata, msg):
-            print("Received message: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
-            enabled_triggers = filter(lambda tr: tr["enabled"] > 0, self.__triggers)
-            for trigger in enabled_triggers:
-                if is_trigger_valid(trigger["condition"], msg):
-                    print("Running trigger_condition: " + trigger["name"])
-                    self.__db.log_trigger(trigger["id"], datetime.datetime.now())
-                    for action in trigger["actions"]:
-                        self.publish(action["topic"], json.dumps(action["payload"]), action["qos"])
+    # Construction touches neither the database nor the broker; start() opens the database
+    # and loads triggers, and can run while the transport is still connecting. Rules that
+    # other processes add, edit or switch are picked up from the database's rule change
+    # feed every `rule_poll_ms` (0 turns that off), while messages keep being dispatched.
+    # Messages are evaluated on a PriorityDispatcher, whose lanes come from `priorities`
+    # (category -> class; gas and water are CRITICAL by default), and rule firings are
+    # recorded by a background TriggerLog after the actions have been published. Commands
+    # to a CRITICAL category are never rate limited, only deduplicated. Routine
+    # messages are taken from their lane up to `batch_size` at a time, waiting at most
+    # `batch_window_ms` for a batch to fill, and a BatchEvaluator decides the plain numeric
+    # thresholds of the whole batch at once; everything else still runs per message, in order.
+    # With a Monitor in the same process, pass its LastValueCache as `last_values` and device
+    # states are read from it; otherwise they are loaded from devices.current_status.
+
+    def __init__(self, transport, db_path=None, registry=None, command_rate=1.0, command_burst=5, shards=0,
+                 rule_poll_ms=1000, priorities=None, dispatch_capacity=10000, batch_size=256, batch_window_ms=0,
+                 last_values=None):
+        self.__db = None
+        self.__db_options = {"db_path": db_path, "registry": registry, "shards": shards}
+        self.__transport = transport
+        self.__rule_poll = rule_poll_ms / 1000
+        self.__rule_cursor = 0
+        self.__feed_thread = None
+        self.__stopping = threading.Event()
+
+        # Serializes changes to the rule set; dispatch reads it without locking
+        self.__rules_lock = threading.Lock()
+        self.__triggers = TriggerIndex()
+        self.__windows = WindowStore()
+        self.__last_values = last_values
+        self.__devices = DeviceStateCache(rate=command_rate, burst=command_burst, last_values=last_values)
+
+        def on_device_message(topic, msg_payload, msg):
+            # Commands from any publisher, which are only expected, and status reports from the devices themselves
+            if isinstance(msg_payload, dict) and "device_id" in msg_payload and "sensor_id" not in msg_payload:
+                if topic.endswith("/send"):
+                    self.__devices.expect(msg_payload["device_id"], msg_payload, time.monotonic())
                 else:
-                    print("Rule " + trigger["name"] + " not valid")
+                    self.__devices.observe(msg_payload["device_id"], msg_payload)
 
-        self.__client.on_connect = on_connect
-        self.__client.on_subscribe = on_subscribe
-        self.__client.on_publish = on_publish
-        self.__client.on_message = on_message
+        def on_message(topic, msg_payload, msg, decision=None):
+            logger.debug("Received message: %s %s %s", topic, msg.qos, msg.payload)
+            on_device_message(topic, msg_payload, msg)
+            started = time.perf_counter()
+            if decision is None:
+                fired = matching_triggers(self.__triggers, topic, msg_payload, self.__windows)
+            else:
+                fired = decided_triggers(decision, msg_payload, self.__windows)
+            RULE_EVALUATION_SECONDS.observe(time.perf_counter() - started)
+            if not fired:
+                return
+            now = time.monotonic()
+            # Every action goes out before any bookkeeping for the message is done
+            sent = []
+            for trigger in fired:
+                published = limited = False
+                for action in trigger.actions:
+                    payload = action.payload
+                    # Commands to a device are deduplicated and rate limited; other publishes always go out
+                    device_id = payload.get("device_id") if isinstance(payload, dict) else None
+                    if device_id is not None:
+                        # Safety commands (gas or water shutoff) are never rate limited away
+                        critical = self.__dispatcher.lane_of(action.topic) <= CRITICAL
+                        reason = self.__devices.check(device_id, payload, now, limited=not critical)
+                        if reason is not None:
+                            limited = limited or reason is RATE_LIMITED
+                            continue
+                    self.publish(action.topic, action.body, action.qos)
+                    published = True
+                if published:
+                    sent.append(trigger)
+                if limited and trigger.debounce is not None:
+                    # A latched or cooling down trigger would never send the held back command
+                    trigger.debounce.rearm()
+            for trigger in fired:
+                logger.debug("Ran trigger_condition: %s", trigger.name)
+                TRIGGER_FIRINGS.labels(trigger.id).inc()
+            timestamp = datetime.datetime.now()
+            for trigger in sent:
+                self.__trigger_log.record(trigger.id, timestamp)
 
-        categories = set(map(lambda cat_tuple: cat_tuple[0], self.__db.get_all_sensor_categories()))
-        for category in categories:
-            self.__client.subscribe(category + "/get", 1)
+        self.__batch = BatchEvaluator(self.__triggers)
+        self.__dispatcher = PriorityDispatcher(on_message, priorities, capacity=dispatch_capacity,
+                                               prepare=self.__batch.prepare if batch_size > 1 else None,
+                                               batch_size=batch_size, batch_window_ms=batch_window_ms)
+        self.__trigger_log = None
 
-    def connect(self, host, port, username, password):
-        self.__client.username_pw_set(username, password)
-        self.__client.connect(host, port)
+        # Every category; the TriggerIndex drops topics no trigger listens to in one lookup
+        self.subscribe("+/get", 1)
+        self.__transport.subscribe("+/send", on_device_message, 1)
 
     def start(self):
-        self.__client.loop_start()
-        self.load_triggers()
+        with STARTUP.phase("controller database open"):
+            self.__db = open_database(**self.__db_options)
+            self.__windows = WindowStore(history=self.__db.get_series)
+        with STARTUP.phase("controller trigger load"):
+            if self.__last_values is None:
+                self.__devices.seed(self.__db.get_device_statuses())
+            # Changes committed while the rules load are in the feed after this cursor
+            self.__rule_cursor = self.__db.get_rule_cursor()
+            self.load_triggers()
+        if self.__trigger_log is None:
+            self.__trigger_log = TriggerLog(self.__db_options["db_path"], self.__db.registry)
+            self.__trigger_log.start()
+        self.__dispatcher.start()
+        if self.__rule_poll and self.__feed_thread is None:
+            self.__stopping.clear()
+            self.__feed_thread = threading.Thread(target=self.__follow_rule_changes, name="RuleFeed", daemon=True)
+            self.__feed_thread.start()
 
     def stop(self):
-        self.__client.loop_stop()
+        self.__dispatcher.stop()
+        if self.__trigger_log is not None:
+            self.__trigger_log.stop()
+            self.__trigger_log = None
+        if self.__feed_thread is not None:
+            self.__stopping.set()
+            self.__feed_thread.join()
+            self.__feed_thread = None
 
     def subscribe(self, topic, qos):
-        self.__client.subscribe(topic, qos)
+        self.__transport.subscribe(topic, self.__dispatcher.submit, qos)
 
     def publish(self, topic, payload, qos):
-        self.__client.publish(topic, payload, qos)
+        self.__transport.publish(topic, payload, qos)
+
+    def device_state(self, device_id):
+        """Last known state of a device as a dict, or None if nothing has been seen from it"""
+        return self.__devices.get(device_id)
 
     def load_triggers(self):
-        db_triggers = self.__db.get_all_triggers()
-        for db_trigger in db_triggers:
-            trigger = {
-                "id": int(db_trigger[0]),
-                "name": db_trigger[1],
-                "condition": {
-                    "sensor_id": int(db_trigger[2]),
-                    "topic": self.__db.get_sensor_category(int(db_trigger[2])) + "/get",
-                    "conditions": json.loads(db_trigger[3]),
-                },
-                "actions": [
-                    {
-                        "topic": self.__db.get_device_category(int(db_trigger[4])) + "/send",
-                        "payload": {"device_id": int(db_trigger[4])} | json.loads(db_trigger[5]),
-                        "qos": 1
-                    }
-                ],
-                "enabled": int(db_trigger[6])
-            }
-            self.__triggers.append(trigger)
-
-    def add_trigger(self, name, sensor_id, conditions, device_id, action_payload):
-        trigger_id = self.__db.add_trigger(name, sensor_id, conditions, device_id, action_payload)
-        trigger = {
-            "id": trigger_id,
-            "name": name,
-            "condition": {
-                "sensor_id": sensor_id,
-                "topic": self.__db.get_sensor_category(sensor_id) + "/get",
-                "conditions": conditions,
-            },
-            "actions": [
-                {
-                    "topic": self.__db.get_device_category(device_id) + "/send",
-                    "payload": {"device_id": device_id} | action_payload,
-                    "qos": 1
-                }
-            ],
-            "enabled": 1
-        }
-        self.__triggers.append(trigger)
+        with self.__rules_lock:
+            self.__triggers.add_many(load_trigger_index(self.__db))
+            # Windows start from the readings already logged, not empty
+            self.__windows.bind(self.__triggers, time.time())
+
+    def apply_rule_changes(self, db, rule_ids=None):
+        """Bring the rules in `rule_ids` (every rule when None) in line with `db`, touching only those
+        that changed; returns the number of rules added, replaced, removed or switched"""
+        with self.__rules_lock:
+            # Read under the lock: rules loaded before an add, edit or delete that this Controller
+            # applies meanwhile would put the older version back
+            loaded = {rule.id: rule for rule in load_rules(db, rule_ids)}
+            ids = set(loaded).union(rule_ids if rule_ids is not None else (trigger.id for trigger in self.__triggers))
+            added, removed, switched = [], [], []
+            for rule_id in ids:
+                current, rule = self.__triggers.get(rule_id), loaded.get(rule_id)
+                if rule is None:
+                    if current is not None:
+                        removed.append(rule_id)
+                elif current is None or current.definition() != rule.definition():
+                    added.append(rule)
+                elif current.enabled != rule.enabled:
+                    # Same rule, so it keeps its debounce state
+                    switched.append((rule_id, rule.enabled))
+            if added or removed:
+                replaced = {rule.id for rule in added}.union(removed)
+                self.__windows.bind([trigger for trigger in self.__triggers if trigger.id not in replaced] + added,
+                                    time.time())
+                for rule_id in removed:
+                    self.__triggers.remove(rule_id)
+                self.__triggers.add_many(added)
+            for rule_id, enabled in switched:
+                self.__triggers.set_enabled(rule_id, enabled)
+        if added or removed or switched:
+            logger.info("Applied rule changes: %d added or edited, %d deleted, %d switched", len(added), len(removed),
+                        len(switched))
+        return len(added) + len(removed) + len(switched)
+
+    def __follow_rule_changes(self):
+        # A connection of its own: data_version only moves when some other connection commits.
+        # Rules always live in the main file, sharded or not.
+        db = Database(db_path=self.__db_options["db_path"], registry=self.__db.registry)
+        version = None
+        prune_deadline = time.monotonic()
+        while True:
+            try:
+                # The first pass always reads the feed: changes may have landed since start() took its cursor
+                current = db.data_version()
+                if current != version:
+                    # Another process may have renamed or recategorised a sensor or device
+                    db.refresh_registry()
+                    self.__rule_cursor, changed = db.get_rule_changes(self.__rule_cursor)
+                    if changed is None:
+                        logger.warning("Rule changes were pruned before they were read. Reloading every rule.")
+                    if changed is None or changed:
+                        self.apply_rule_changes(db, changed)
+                    version = current
+                if time.monotonic() >= prune_deadline:
+                    db.prune_rule_changes()
+                    prune_deadline = time.monotonic() + RULE_CHANGE_PRUNE_INTERVAL
+            except sqlite3.Error as e:
+                logger.error("Could not read rule changes: %s", e)
+            if self.__stopping.wait(self.__rule_poll):
+                break
+        db.close()
+
+    def add_trigger(self, name, sensor_id, conditions, device_id, action_payload, hold_seconds=0, cooldown_seconds=0,
+                    hysteresis=0):
+        # Compiled first, so malformed conditions are rejected before anything is saved
+        trigger = build_trigger(self.__db, None, name, sensor_id, conditions, device_id, action_payload, 1,
+                                hold_seconds, cooldown_seconds, hysteresis)
+        trigger.id = self.__db.add_trigger(name, sensor_id, conditions, device_id, action_payload, hold_seconds,
+                                           cooldown_seconds, hysteresis)
+        self.__index(trigger)
+        return trigger.id
+
+    def add_rule(self, rule):
+        """Save and start running RuleBuilder.build() output; returns the rule's id"""
+        trigger = Rule.from_builder(None, rule)
+        trigger.id = self.__db.add_rule(rule)
+        self.__index(trigger)
+        return trigger.id
+
+    def __index(self, trigger):
+        with self.__rules_lock:
+            # Bind before indexing so the trigger is never evaluated against unbound windows
+            self.__windows.bind(list(self.__triggers) + [trigger], time.time())
+            self.__triggers.add(trigger)
 
     def delete_trigger(self, trigger_id):
         self.__db.delete_trigger(trigger_id)
-        trigger_to_delete = None
-        for trigger in self.__triggers:
-            if trigger["id"] == trigger_id:
-                trigger_to_delete = trigger
-        if trigger_to_delete is not None: self.__triggers.remove(trigger_to_delete)
+        with self.__rules_lock:
+            self.__triggers.remove(trigger_id)
+            self.__windows.bind(self.__triggers, time.time())
 
     def switch_trigger(self, trigger_id):
-        for trigger in self.__triggers:
-            if trigger["id"] == trigger_id:
-                target_state = (trigger["enabled"] + 1) % 2
-                trigger["enabled"] = target_state
+        with self.__rules_lock:
+            trigger = self.__triggers.get(trigger_id)
+            if trigger is not None:
+                target_state = (trigger.enabled + 1) % 2
+                self.__triggers.set_enabled(trigger_id, target_state)
                 self.__db.switch_trigger(trigger_id, target_state)
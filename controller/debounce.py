@@ -0,0 +1,47 @@
+class Debounce:
+    # Firing state of one trigger. Once fired, a trigger with a hold time or hysteresis
+    # stays latched until its relaxed ("sustained") conditions stop holding, so a value
+    # hovering around the threshold fires once instead of on every message.
+    __slots__ = ("hold_seconds", "cooldown_seconds", "latches", "latched", "held_since", "last_fired",
+                 "previous_fired")
+
+    def __init__(self, hold_seconds=0, cooldown_seconds=0, hysteresis=0):
+        self.hold_seconds = hold_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.latches = hold_seconds > 0 or hysteresis > 0
+        self.latched = False
+        self.held_since = None
+        self.last_fired = None
+        self.previous_fired = None
+
+    @classmethod
+    def from_options(cls, options):
+        """None when the trigger fires on every matching message, as it did before debouncing"""
+        if not any(options.values()):
+            return None
+        return cls(options["hold_seconds"], options["cooldown_seconds"], options["hysteresis"])
+
+    def update(self, held, sustained, now):
+        """Whether to fire, given whether the conditions hold and whether their relaxed form does"""
+        if self.latched:
+            if not sustained:
+                self.latched = False
+                self.held_since = None
+            return False
+        if not held:
+            self.held_since = None
+            return False
+        if self.held_since is None:
+            self.held_since = now
+        if now - self.held_since < self.hold_seconds:
+            return False
+        if self.last_fired is not None and now - self.last_fired < self.cooldown_seconds:
+            return False
+        self.previous_fired, self.last_fired = self.last_fired, now
+        self.latched = self.latches
+        return True
+
+    def rearm(self):
+        """Undo the last firing, whose commands did not go out, so the next message that holds fires again"""
+        self.last_fired = self.previous_fired
+        self.latched = False
@@ -0,0 +1,120 @@
+import threading
+
+from metrics import REGISTRY
+
+COMMANDS_SUPPRESSED = REGISTRY.counter("smarthome_commands_suppressed_total",
+                                       "Device commands not published by the Controller", ("reason",))
+_REDUNDANT = COMMANDS_SUPPRESSED.labels("redundant")
+_RATE_LIMITED = COMMANDS_SUPPRESSED.labels("rate_limited")
+
+_MISSING = object()
+
+# Why DeviceStateCache.check() held a command back
+REDUNDANT, RATE_LIMITED = "redundant", "rate_limited"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class DeviceStateCache:
+    # Last known state of every device and the commands it is expected to apply. Status
+    # reports devices publish (with a device_id on '+/get') are its state; commands seen on
+    # '+/send', whoever publishes them, and the ones the Controller sends are only expected
+    # until a report confirms them. A field whose command is not confirmed within
+    # `confirm_seconds` is unknown until the device reports it. A command whose fields
+    # already match the state or an unexpired expectation is redundant, and each device gets
+    # at most `rate` commands per second after an initial burst of `burst`. Given the
+    # process's LastValueCache as `last_values`, states are read from it instead of kept here.
+
+    def __init__(self, rate=1.0, burst=5, confirm_seconds=30.0, last_values=None):
+        self.__rate = rate
+        self.__burst = burst
+        self.__confirm_seconds = confirm_seconds
+        self.__last_values = last_values
+        self.__states = {}
+        self.__expected = {}        # device_id -> {field: (value, deadline)}
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    def seed(self, statuses):
+        """Stored statuses; anything observed since the Controller was created is newer and wins"""
+        with self.__lock:
+            for device_id, status in statuses.items():
+                self.__states.setdefault(device_id, dict(status))
+
+    def get(self, device_id):
+        with self.__lock:
+            state = self.__state(device_id)
+            return dict(state) if state is not None else None
+
+    def observe(self, device_id, payload):
+        """A status report from the device: its fields are applied, whatever was expected of them"""
+        with self.__lock:
+            # The LastValueCache applies the report itself when the Monitor ingests it
+            state = self.__states.setdefault(device_id, {}) if self.__last_values is None else {}
+            expected = self.__expected.get(device_id, {})
+            for key, value in payload.items():
+                if key != "device_id":
+                    state[key] = value
+                    expected.pop(key, None)
+
+    def expect(self, device_id, payload, now):
+        """A command published for the device, which it has not confirmed yet"""
+        with self.__lock:
+            self.__expect(device_id, payload, now)
+
+    def check(self, device_id, payload, now, limited=True):
+        """None if a command is worth publishing, else why not: REDUNDANT or RATE_LIMITED.
+        A command that is sent becomes expected; `limited` False skips the rate limit."""
+        with self.__lock:
+            fields = [(key, value) for key, value in payload.items() if key != "device_id"]
+            # A bare command carries no state to compare, so it is never considered redundant
+            if fields and all(self.__holds(device_id, key, value, now) for key, value in fields):
+                _REDUNDANT.inc()
+                return REDUNDANT
+            if limited:
+                bucket = self.__buckets.get(device_id)
+                if bucket is None:
+                    bucket = self.__buckets[device_id] = TokenBucket(self.__rate, self.__burst, now)
+                if not bucket.take(now):
+                    _RATE_LIMITED.inc()
+                    return RATE_LIMITED
+            self.__expect(device_id, payload, now)
+            return None
+
+    def __holds(self, device_id, key, value, now):
+        expected = self.__expected.get(device_id)
+        if expected is not None and key in expected:
+            # Never confirmed: the device may not have applied it, and a LastValueCache state
+            # already has the command merged in, so the field is unknown until a report
+            expected_value, deadline = expected[key]
+            return now < deadline and expected_value == value
+        return (self.__state(device_id) or {}).get(key, _MISSING) == value
+
+    def __state(self, device_id):
+        if self.__last_values is None:
+            return self.__states.get(device_id)
+        entry = self.__last_values.get("device", device_id)
+        return entry[0] if entry is not None else None
+
+    def __expect(self, device_id, payload, now):
+        expected = self.__expected.setdefault(device_id, {})
+        deadline = now + self.__confirm_seconds
+        for key, value in payload.items():
+            if key != "device_id":
+                expected[key] = (value, deadline)
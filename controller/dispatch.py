@@ -0,0 +1,192 @@
+from collections import deque
+import logging
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Priority classes; a lower number is dispatched first
+CRITICAL, ROUTINE = 0, 1
+
+# Categories whose rules drive safety actuators, e.g. gas and water shutoff valves
+DEFAULT_PRIORITIES = {"gas": CRITICAL, "water": CRITICAL}
+
+LANE_DEPTH = REGISTRY.gauge("smarthome_dispatch_lane_depth", "Messages waiting in a dispatch lane", ("lane",))
+LANE_WAIT = REGISTRY.histogram("smarthome_dispatch_wait_seconds", "Time a message waits in its dispatch lane",
+                               ("lane",))
+LANE_DROPPED = REGISTRY.counter("smarthome_dispatch_dropped_total",
+                                "Messages dropped because their dispatch lane was full", ("lane",))
+
+
+class PriorityDispatcher:
+    # Runs handler(topic, payload, msg) on one worker thread, fed by a bounded lane per
+    # priority class. Lanes are served in strict priority order, so a burst of routine
+    # readings never sits in front of a gas or water reading. A message's class is the
+    # priority of its topic's category ('gas' in 'gas/get'). When a CRITICAL lane is full
+    # submit() waits for room; other lanes drop their oldest message instead. A CRITICAL
+    # message that finds every lane empty and the worker idle is handled by submit() itself,
+    # saving the thread handoff; routine work never runs on the network thread, so it cannot
+    # hold up reading the next message. One handler call runs at a time, in arrival order.
+    # With `prepare`, the worker takes up to `batch_size` messages at once from a lane below
+    # CRITICAL, waiting up to `batch_window_ms` for more to arrive, and calls
+    # prepare(items) -> one context per (topic, payload, msg) item before handling them as
+    # handler(topic, payload, msg, context). CRITICAL messages that arrive meanwhile are
+    # handled between two messages of the batch.
+
+    def __init__(self, handler, priorities=None, default=ROUTINE, capacity=10000, prepare=None, batch_size=256,
+                 batch_window_ms=0):
+        self.__handler = handler
+        self.__priorities = dict(DEFAULT_PRIORITIES if priorities is None else priorities)
+        self.__default = default
+        self.__capacity = capacity
+        self.__prepare = prepare
+        self.__batch_size = max(1, batch_size)
+        self.__batch_window = batch_window_ms / 1000
+        self.__lanes = {lane: deque() for lane in {default, *self.__priorities.values()}}
+        self.__order = [self.__lanes[lane] for lane in sorted(self.__lanes)]
+        self.__names = {id(queue): self.lane_name(lane) for lane, queue in self.__lanes.items()}
+        self.__urgent = [self.__lanes[lane] for lane in sorted(self.__lanes) if lane <= CRITICAL]
+        self.__lock = threading.Lock()
+        self.__ready = threading.Condition(self.__lock)
+        self.__room = threading.Condition(self.__lock)
+        self.__busy = threading.Lock()      # Held while the handler runs; taken before popping a lane
+        self.__stopping = False
+        self.__thread = None
+        for lane, queue in self.__lanes.items():
+            LANE_DEPTH.labels(self.lane_name(lane)).set_function(queue.__len__)
+
+    @staticmethod
+    def lane_name(lane):
+        return {CRITICAL: "critical", ROUTINE: "routine"}.get(lane, str(lane))
+
+    def lane_of(self, topic):
+        return self.__priorities.get(topic.split("/", 1)[0], self.__default)
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, name="Dispatch", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Dispatch what is already queued, then stop the worker"""
+        if self.__thread is None:
+            return
+        with self.__lock:
+            self.__stopping = True
+            self.__ready.notify()
+        self.__thread.join()
+        self.__thread = None
+
+    def submit(self, topic, payload, msg):
+        """Queue a decoded message; transport handler signature, called on the network thread"""
+        lane = self.lane_of(topic)
+        queue = self.__lanes[lane]
+        with self.__lock:
+            inline = (lane <= CRITICAL and self.__thread is not None and self.__next_lane() is None
+                      and self.__busy.acquire(blocking=False))
+            if not inline:
+                self.__enqueue(lane, queue, (topic, payload, msg, time.perf_counter()))
+        if inline:
+            try:
+                self.handle(topic, payload, msg)
+            finally:
+                self.__busy.release()
+
+    def __enqueue(self, lane, queue, item):
+        # Called with the lock held
+        if len(queue) >= self.__capacity:
+            if lane <= CRITICAL:
+                while len(queue) >= self.__capacity and not self.__stopping:
+                    self.__room.wait()
+            else:
+                queue.popleft()
+                LANE_DROPPED.labels(self.lane_name(lane)).inc()
+        queue.append(item)
+        self.__ready.notify()
+
+    def pending(self):
+        with self.__lock:
+            return sum(len(queue) for queue in self.__order)
+
+    def handle(self, topic, payload, msg, *context):
+        try:
+            self.__handler(topic, payload, msg, *context)
+        except Exception:
+            logger.exception("Dispatch error on topic %s", topic)
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                while self.__next_lane() is None and not self.__stopping:
+                    self.__ready.wait()
+                if self.__next_lane() is None:
+                    return
+            with self.__busy:
+                with self.__lock:
+                    queue = self.__next_lane()
+                    if queue is None:
+                        continue
+                    batch = None
+                    if self.__prepare is not None and not any(queue is urgent for urgent in self.__urgent):
+                        batch = self.__take_batch(queue)
+                    else:
+                        topic, payload, msg, queued = queue.popleft()
+                    self.__room.notify_all()
+                if batch is None:
+                    LANE_WAIT.labels(self.__names[id(queue)]).observe(time.perf_counter() - queued)
+                    self.handle(topic, payload, msg)
+                else:
+                    self.__handle_batch(queue, batch)
+
+    def __take_batch(self, queue):
+        # Called with the lock held
+        batch = [queue.popleft() for _ in range(min(len(queue), self.__batch_size))]
+        if self.__batch_window and len(batch) < self.__batch_size:
+            deadline = time.monotonic() + self.__batch_window
+            while len(batch) < self.__batch_size and not self.__stopping:
+                if queue:
+                    batch.append(queue.popleft())
+                    continue
+                # Stop collecting as soon as a CRITICAL message is waiting
+                if any(self.__urgent):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__ready.wait(remaining)
+        return batch
+
+    def __handle_batch(self, queue, batch):
+        # Called with __busy held
+        try:
+            contexts = self.__prepare(batch)
+        except Exception:
+            logger.exception("Batch preparation error; handling %d messages one at a time", len(batch))
+            contexts = [None] * len(batch)
+        wait = LANE_WAIT.labels(self.__names[id(queue)])
+        for (topic, payload, msg, queued), context in zip(batch, contexts):
+            self.__handle_urgent()
+            wait.observe(time.perf_counter() - queued)
+            self.handle(topic, payload, msg, context)
+
+    def __handle_urgent(self):
+        # Called with __busy held; deque truthiness is safe to read without the lock
+        for urgent in self.__urgent:
+            while urgent:
+                with self.__lock:
+                    if not urgent:
+                        break
+                    topic, payload, msg, queued = urgent.popleft()
+                    self.__room.notify_all()
+                LANE_WAIT.labels(self.__names[id(urgent)]).observe(time.perf_counter() - queued)
+                self.handle(topic, payload, msg)
+
+    def __next_lane(self):
+        for queue in self.__order:
+            if queue:
+                return queue
+        return None
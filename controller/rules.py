@@ -1,15 +1,22 @@
 import json
 
+from codec import JSON
+from .conditions import ConditionError, Windowed, compile_conditions, relax_conditions
+from .debounce import Debounce
+
 
 class RuleBuilder:
     def __init__(self, name):
         self.__rule_name = name
         self.__rule_trigger = dict()
         self.__rule_actions = list()
+        self.__rule_options = dict()
 
-    def add_trigger(self, trigger_topic):
+    def add_trigger(self, trigger_topic, sensor_id=None):
+        # Without a sensor_id the rule runs on every message published to the topic
         self.__rule_trigger = {
             'topic': trigger_topic,
+            'sensor_id': sensor_id,
             'conditions': []
         }
         return self
@@ -26,9 +33,88 @@ class RuleBuilder:
         })
         return self
 
+    def set_debounce(self, hold_seconds=0, cooldown_seconds=0, hysteresis=0):
+        self.__rule_options = {
+            'hold_seconds': hold_seconds,
+            'cooldown_seconds': cooldown_seconds,
+            'hysteresis': hysteresis
+        }
+        return self
+
     def build(self):
         return {
             'name': self.__rule_name,
             'trigger': self.__rule_trigger,
-            'actions': self.__rule_actions
+            'actions': self.__rule_actions,
+            'options': self.__rule_options
         }
+
+
+class Action:
+    # One publish of a rule; the payload is encoded on the first firing, not on every one
+    __slots__ = ("topic", "qos", "payload", "__body")
+
+    def __init__(self, topic, qos, payload):
+        self.topic = topic
+        self.qos = qos
+        self.payload = payload
+        self.__body = None
+
+    @property
+    def body(self):
+        if self.__body is None:
+            self.__body = JSON.encode(self.payload)
+        return self.__body
+
+
+class Rule:
+    # A compiled rule as the Controller holds it: when every condition holds for a message
+    # on `topic` (from `sensor_id`, or from any sensor when that is None), the actions run.
+    __slots__ = ("id", "name", "topic", "sensor_id", "conditions", "actions", "enabled", "hold_seconds",
+                 "cooldown_seconds", "hysteresis", "compiled", "sustained", "debounce")
+
+    def __init__(self, rule_id, name, topic, sensor_id, conditions, actions, enabled=1, hold_seconds=0,
+                 cooldown_seconds=0, hysteresis=0):
+        """`conditions` are (payload key, condition) pairs or a mapping, `actions` Action objects.
+        Raises ConditionError for malformed conditions."""
+        self.id = rule_id
+        self.name = name
+        self.topic = topic
+        self.sensor_id = sensor_id
+        self.conditions = tuple(conditions.items() if isinstance(conditions, dict) else conditions)
+        self.actions = tuple(actions)
+        self.enabled = enabled
+        self.hold_seconds = hold_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.hysteresis = hysteresis
+        self.compiled = compile_conditions(self.conditions)
+        if sensor_id is None and any(isinstance(predicate, Windowed) for _, predicate in self.compiled):
+            raise ConditionError("Window conditions need a rule on a single sensor")
+        self.sustained = relax_conditions(self.compiled, hysteresis)
+        self.debounce = Debounce.from_options(self.options)
+
+    @classmethod
+    def from_builder(cls, rule_id, rule, enabled=1):
+        """Compile RuleBuilder.build() output"""
+        trigger = rule["trigger"]
+        return cls(rule_id, rule["name"], trigger["topic"], trigger.get("sensor_id"),
+                   [(condition["key"], condition["value"]) for condition in trigger["conditions"]],
+                   [Action(action["topic"], action["qos"], action["payload"]) for action in rule["actions"]],
+                   enabled, **rule.get("options", {}))
+
+    @property
+    def options(self):
+        return {"hold_seconds": self.hold_seconds, "cooldown_seconds": self.cooldown_seconds,
+                "hysteresis": self.hysteresis}
+
+    def definition(self):
+        """Everything the rule is apart from its id and whether it is enabled; equal definitions behave alike"""
+        return (self.name, self.topic, self.sensor_id, self.conditions,
+                tuple((action.topic, action.qos, action.payload) for action in self.actions),
+                self.hold_seconds, self.cooldown_seconds, self.hysteresis)
+
+    def copy(self, **changes):
+        """Recompiled copy with its own windows and debounce state"""
+        fields = {"rule_id": self.id, "name": self.name, "topic": self.topic, "sensor_id": self.sensor_id,
+                  "conditions": self.conditions, "actions": self.actions, "enabled": self.enabled} | self.options
+        return Rule(**(fields | changes))
@@ -0,0 +1,80 @@
+class TriggerIndex:
+    # Keeps every trigger (a compiled Rule) by id and the enabled ones bucketed by
+    # (topic, sensor_id); rules without a sensor_id are bucketed under (topic, None).
+    # Buckets are immutable tuples replaced on write, so the MQTT thread can read
+    # them while add/delete/switch run on another thread.
+
+    def __init__(self):
+        self.__by_id = {}
+        self.__by_key = {}
+
+    def __len__(self):
+        return len(self.__by_id)
+
+    def __iter__(self):
+        return iter(list(self.__by_id.values()))
+
+    def get(self, trigger_id):
+        return self.__by_id.get(trigger_id)
+
+    def match(self, topic, sensor_id):
+        """Enabled triggers for a message from `sensor_id` on `topic`, including the topic-wide ones"""
+        any_sensor = self.__by_key.get((topic, None))
+        if sensor_id is None:
+            return any_sensor or ()
+        exact = self.__by_key.get((topic, sensor_id), ())
+        return exact + any_sensor if any_sensor else exact
+
+    def buckets(self, topic, sensor_id):
+        """The (exact, topic-wide) buckets match() joins; a bucket that changed is a new object"""
+        exact = self.__by_key.get((topic, sensor_id), ()) if sensor_id is not None else ()
+        return exact, self.__by_key.get((topic, None), ())
+
+    def add(self, trigger):
+        self.remove(trigger.id)
+        self.__by_id[trigger.id] = trigger
+        if trigger.enabled > 0:
+            self.__link(trigger)
+
+    def add_many(self, triggers):
+        """add() for several triggers, rebuilding each affected bucket once"""
+        linked = {}
+        for trigger in triggers:
+            self.remove(trigger.id)
+            self.__by_id[trigger.id] = trigger
+            if trigger.enabled > 0:
+                linked.setdefault(self.key_of(trigger), []).append(trigger)
+        for key, bucket in linked.items():
+            self.__by_key[key] = self.__by_key.get(key, ()) + tuple(bucket)
+
+    def remove(self, trigger_id):
+        trigger = self.__by_id.pop(trigger_id, None)
+        if trigger is not None:
+            self.__unlink(trigger)
+        return trigger
+
+    def set_enabled(self, trigger_id, enabled):
+        trigger = self.__by_id.get(trigger_id)
+        if trigger is None:
+            return None
+        self.__unlink(trigger)
+        trigger.enabled = enabled
+        if enabled > 0:
+            self.__link(trigger)
+        return trigger
+
+    @staticmethod
+    def key_of(trigger):
+        return trigger.topic, trigger.sensor_id
+
+    def __link(self, trigger):
+        key = self.key_of(trigger)
+        self.__by_key[key] = self.__by_key.get(key, ()) + (trigger,)
+
+    def __unlink(self, trigger):
+        key = self.key_of(trigger)
+        bucket = tuple(t for t in self.__by_key.get(key, ()) if t is not trigger)
+        if bucket:
+            self.__by_key[key] = bucket
+        else:
+            self.__by_key.pop(key, None)
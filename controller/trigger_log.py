@@ -0,0 +1,56 @@
+import logging
+import sqlite3
+import threading
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerLog:
+    # Records rule firings (rules.last_triggered) off the dispatch path. Only the latest
+    # firing of each rule matters, so pending entries are kept one per rule and written
+    # in one transaction every `flush_interval_ms`, on a connection of their own.
+
+    def __init__(self, db_path=None, registry=None, flush_interval_ms=500):
+        self.__db_path = db_path
+        self.__registry = registry
+        self.__flush_interval = flush_interval_ms / 1000
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__stopping = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stopping.clear()
+        self.__thread = threading.Thread(target=self.__run, name="TriggerLog", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Write what is pending, then stop"""
+        if self.__thread is None:
+            return
+        self.__stopping.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def record(self, rule_id, timestamp):
+        with self.__lock:
+            self.__pending[rule_id] = timestamp
+
+    def __run(self):
+        db = Database(db_path=self.__db_path, registry=self.__registry)
+        while True:
+            stopping = self.__stopping.wait(self.__flush_interval)
+            with self.__lock:
+                pending, self.__pending = self.__pending, {}
+            if pending:
+                try:
+                    db.log_triggers(pending.items())
+                except sqlite3.Error as e:
+                    logger.error("Could not record %d rule firings: %s", len(pending), e)
+            if stopping:
+                break
+        db.close()
@@ -0,0 +1,130 @@
+from collections import deque
+
+from .conditions import Windowed
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class RunningWindow:
+    # avg/sum/count over the trailing `seconds`: a running total plus the samples to evict.
+    # Every sample is appended and evicted once, so each push is amortized O(1).
+    __slots__ = ("aggregate", "seconds", "samples", "total")
+
+    def __init__(self, aggregate, seconds):
+        self.aggregate = aggregate
+        self.seconds = seconds
+        self.samples = deque()
+        self.total = 0.0
+
+    def push(self, ts, value):
+        self.samples.append((ts, value))
+        self.total += value
+        self.evict(ts)
+
+    def evict(self, now):
+        cutoff = now - self.seconds
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            self.total -= samples.popleft()[1]
+        if not samples:
+            # Do not carry float drift from evicted samples forward
+            self.total = 0.0
+
+    def value(self):
+        if self.aggregate == "count":
+            return len(self.samples)
+        if not self.samples:
+            return None
+        return self.total if self.aggregate == "sum" else self.total / len(self.samples)
+
+
+class ExtremeWindow:
+    # min/max over the trailing `seconds` with a monotonic deque: samples that can never
+    # be the extreme again are dropped on arrival, so the front is always the answer.
+    __slots__ = ("aggregate", "seconds", "samples")
+
+    def __init__(self, aggregate, seconds):
+        self.aggregate = aggregate
+        self.seconds = seconds
+        self.samples = deque()
+
+    def push(self, ts, value):
+        samples = self.samples
+        if self.aggregate == "min":
+            while samples and samples[-1][1] >= value:
+                samples.pop()
+        else:
+            while samples and samples[-1][1] <= value:
+                samples.pop()
+        samples.append((ts, value))
+        self.evict(ts)
+
+    def evict(self, now):
+        cutoff = now - self.seconds
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            samples.popleft()
+
+    def value(self):
+        return self.samples[0][1] if self.samples else None
+
+
+def make_window(aggregate, seconds):
+    return (ExtremeWindow if aggregate in ("min", "max") else RunningWindow)(aggregate, seconds)
+
+
+def windowed_predicates(trigger):
+    for key, predicate in trigger.compiled + trigger.sustained:
+        if isinstance(predicate, Windowed):
+            yield key, predicate
+
+
+class WindowStore:
+    # The sliding windows referenced by a set of triggers, one per (sensor, field,
+    # aggregate, seconds) however many triggers share it. `history(sensor_id, field,
+    # start, end)` returns (timestamps, values) and seeds windows when they are created.
+
+    def __init__(self, history=None):
+        self.__history = history
+        self.__windows = {}
+        self.__by_sensor = {}
+
+    def __len__(self):
+        return len(self.__windows)
+
+    def bind(self, triggers, now):
+        """Point every windowed condition of `triggers` at its window; windows no trigger uses are dropped"""
+        windows = {}
+        for trigger in triggers:
+            sensor_id = trigger.sensor_id
+            for field, predicate in windowed_predicates(trigger):
+                key = (sensor_id, field, predicate.aggregate, predicate.seconds)
+                window = windows.get(key) or self.__windows.get(key)
+                if window is None:
+                    window = self.__seed(make_window(predicate.aggregate, predicate.seconds), sensor_id, field, now)
+                windows[key] = predicate.window = window
+
+        by_sensor = {}
+        for (sensor_id, field, _, _), window in windows.items():
+            by_sensor[sensor_id] = by_sensor.get(sensor_id, ()) + ((field, window),)
+        # Swapped whole so the message thread never sees a half-built mapping
+        self.__windows, self.__by_sensor = windows, by_sensor
+
+    def push(self, sensor_id, msg_payload, now):
+        """Add the message's readings to the windows of its sensor; call before evaluating triggers"""
+        for field, window in self.__by_sensor.get(sensor_id, ()):
+            value = msg_payload.get(field)
+            if _is_number(value):
+                window.push(now, value)
+            else:
+                window.evict(now)
+
+    def __seed(self, window, sensor_id, field, now):
+        if self.__history is not None:
+            timestamps, values = self.__history(sensor_id, field, now - window.seconds, now + 1)
+            for ts, value in zip(timestamps.tolist(), values.tolist()):
+                window.push(ts, value)
+            window.evict(now)
+        return window
@@ -1 +1,2 @@
 from .database import Database
+from .federated import FederatedDatabase, open_database
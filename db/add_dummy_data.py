@@ -1,20 +1,23 @@
 import datetime
-
-from database import Database
+import os
+import sys
 import time
 
+# Allow running as a script (python db/add_dummy_data.py) while importing the db package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from db.migrations import DATA_TABLES
+
 
 # Initialize database
 db = Database()
 
 print("Clearing previous data...")
 
-# Clear all existing data (in reverse order due to foreign keys)
+# Clear all existing data, including the rollups and charted values derived from events
 cursor = db.conn.cursor()
-cursor.execute("DELETE FROM events")
-cursor.execute("DELETE FROM triggers")
-cursor.execute("DELETE FROM devices")
-cursor.execute("DELETE FROM sensors")
+for table in DATA_TABLES:
+    cursor.execute(f"DELETE FROM {table}")
 db.conn.commit()
 
 print("Adding fresh dummy data...")
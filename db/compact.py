@@ -0,0 +1,46 @@
+"""Switch database files created before auto_vacuum=INCREMENTAL to that mode, so the Archiver can
+return the space of the events it removes to the OS.
+
+This is one full VACUUM per file: it needs free disk space about the size of the file and locks
+out every other connection until it finishes. Stop the services first.
+
+Run from the project root:  python -m db.compact [db/smart_home_monitor.db ...]
+"""
+import argparse
+import os
+import time
+
+from .database import Database
+from .federated import shard_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=[os.path.join("db", "smart_home_monitor.db")],
+                        help="database files (default: db/smart_home_monitor.db)")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("SMART_HOME_INGEST_SHARDS", "0")),
+                        help="also convert the shard files of each path (default: SMART_HOME_INGEST_SHARDS)")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        paths.append(path)
+        if args.shards:
+            paths.extend(shard_paths(path, args.shards))
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"{path}: not found")
+            continue
+        db = Database(db_path=path)
+        try:
+            started = time.perf_counter()
+            if db.enable_incremental_vacuum():
+                print(f"{path}: converted in {time.perf_counter() - started:.1f} s")
+            else:
+                print(f"{path}: already incremental")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
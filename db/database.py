@@ -1,134 +1,518 @@
 from datetime import datetime
 import json
+import logging
 import os
 import sqlite3
+import time
+
+from codec import get_codec
+from metrics import REGISTRY
+from . import retention, rollups, series
+from .payloads import (EVENT_COLUMNS, event_row, event_timestamp, payload_action, received_at, scalar_field,
+                       stored_payload)
+from .migrations import configure, migrate
+from .registry import MetadataRegistry
+
+logger = logging.getLogger(__name__)
+
+DB_WRITE_SECONDS = REGISTRY.histogram("smarthome_db_write_seconds", "Time executing writes before commit",
+                                      ("operation",))
+DB_COMMIT_SECONDS = REGISTRY.histogram("smarthome_db_commit_seconds", "Time spent in COMMIT", ("operation",))
+_EVENTS_WRITE = DB_WRITE_SECONDS.labels("log_events")
+_EVENTS_COMMIT = DB_COMMIT_SECONDS.labels("log_events")
+_TRIGGER_WRITE = DB_WRITE_SECONDS.labels("log_trigger")
+_TRIGGER_COMMIT = DB_COMMIT_SECONDS.labels("log_trigger")
 
 
 class Database:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, archive_dir=None, registry=None):
         if db_path is None:
             db_path = os.path.join("db", "smart_home_monitor.db")
-        self.conn = sqlite3.connect(db_path)
+        if archive_dir is None:
+            archive_dir = os.path.join(os.path.dirname(db_path), "archive")
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        # Controller callbacks run on paho's network thread, not the thread that opened the connection
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        configure(self.conn)
         self.create_tables()
+        # Pass a shared registry so every Database in the process serves lookups from one cache
+        self.registry = registry if registry is not None else MetadataRegistry()
+        if not self.registry.loaded:
+            self.registry.load(self.conn)
+
+    def close(self):
+        self.conn.close()
 
     def create_tables(self):
-        cursor = self.conn.cursor()
-        cursor.executescript("""
-        
-        /* Sensors */
-        
-        CREATE TABLE IF NOT EXISTS sensors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,   
-            name TEXT NOT NULL,                             -- User friendly name for GUI, e.g.: 'Living Room Temperature'      
-            category TEXT NOT NULL,                         -- Sensor category, e.q.: 'temperature', 'light', 'gas', 'water' 
-            type TEXT NOT NULL,                             -- Sensor type, e.q.: 'Thermometer', 'Hygrometer'                                                        
-            last_payload TEXT,                              -- Cached JSON of the most recent data from this sensor, e.g.: '{"value": 21.5}'                                                       
-            last_update TIMESTAMP                           -- The date and time 'last_payload' was updated.         
-        );
-
-        /* Devices */
-        
-        CREATE TABLE IF NOT EXISTS devices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,   
-            name TEXT NOT NULL,                             -- User friendly name for GUI, e.g.: 'Main Heater'
-            category TEXT NOT NULL,                         -- Device category, e.q.: 'temperature', 'light', 'gas', 'water' 
-            type TEXT NOT NULL,                             -- Device type, e.q.: 'Heater', 'Plug', 'Lightbulb'                 
-            current_status TEXT,                            -- Cached JSON of the most recent device state, e.g.: '{"state": "on", "mode": "auto"}'
-            last_update TIMESTAMP                           -- The date and time 'current_status' was updated.
-        );
-
-        /* Events */
-        
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_type TEXT NOT NULL,                      -- Specifies which table the 'source_id' refers to, e.g.: 'sensor' or 'device' 
-            source_id INTEGER NOT NULL,                     -- The 'id' from either the 'sensors' or 'devices' table that this event came from
-            payload TEXT NOT NULL,                          -- The full JSON data exactly as it was received, e.g.: '{"value": 21.5, "unit": "C"}' 
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP    -- The date and time this event was saved to the database. (Automatically set by SQLite) 
-        );      
-
-        /* Triggers */
-        
-        CREATE TABLE IF NOT EXISTS triggers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,                             -- User-friendly name for the GUI. e.g.: 'Turn on heater when cold'
-            sensor_id INTEGER NOT NULL,                     -- The 'id' from the 'sensors' table that this rule "listens" to.
-            condition TEXT NOT NULL,                        -- The condition logic, e.g.: 'payload.temperature > 25'
-            device_id INTEGER NOT NULL,                     -- The 'id' from the 'devices' table that this rule controls.
-            action_payload TEXT NOT NULL,                   -- The JSON command to send to device, e.g.: '{"state": "off"}'
-            enabled INTEGER NOT NULL DEFAULT 1,             -- A simple toggle (0=disabled, 1=enabled) so users can turn rules on or off from the GUI 
-            last_triggered TIMESTAMP,                       -- Logs the last time this rule was successfully fired
-            
-            -- Links this rule to a specific sensor
-            FOREIGN KEY (sensor_id) REFERENCES sensors (id),
-            
-            -- Links this rule to a specific device
-            FOREIGN KEY (device_id) REFERENCES devices (id)
-        );
-        """)
-        self.conn.commit()
+        migrate(self.conn)
 
-    def log_event(self, source_type, source_id, payload_json):
+    def log_event(self, source_type, source_id, payload_json, raw=None):
+        event = (source_type, source_id, payload_json, raw)
         cursor = self.conn.cursor()
         cursor.execute("""
-            INSERT INTO events (source_type, source_id, payload)
-            VALUES (?, ?, ?)
-        """, (source_type, source_id, json.dumps(payload_json)))
+            INSERT INTO events (source_type, source_id, payload, content_type, action)
+            VALUES (?, ?, ?, ?, ?)
+        """, (source_type, source_id, *stored_payload(event), payload_action(payload_json)))
+        now = time.time()
+        rollups.apply(self.conn, [event], now)
+        series.apply(self.conn, [event], now)
         self.conn.commit()
 
+    def log_events(self, events, checkpoint=None):
+        # Writes (source_type, source_id, payload_json[, raw[, received]]) tuples in a single
+        # transaction; `raw` is the payload as received and is stored as is, and `received` is
+        # its receive time in epoch seconds, which defaults to now. `checkpoint` is the last
+        # journal sequence number they cover
+        events = list(events)
+        started = time.perf_counter()
+        try:
+            now = time.time()
+            self.conn.executemany("""
+                INSERT INTO events (source_type, source_id, payload, content_type, action, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(event[0], event[1], *stored_payload(event), payload_action(event[2]),
+                   event_timestamp(received_at(event, now))) for event in events])
+            rollups.apply(self.conn, events, now)
+            series.apply(self.conn, events, now)
+            if checkpoint is not None:
+                self.conn.execute("""
+                    INSERT INTO journal_checkpoint (id, seq) VALUES (0, ?)
+                    ON CONFLICT (id) DO UPDATE SET seq = excluded.seq
+                """, (checkpoint,))
+        except BaseException:
+            self.conn.rollback()
+            raise
+        written = time.perf_counter()
+        self.conn.commit()
+        _EVENTS_WRITE.observe(written - started)
+        _EVENTS_COMMIT.observe(time.perf_counter() - written)
+
+    def get_journal_checkpoint(self):
+        row = self.conn.execute("SELECT seq FROM journal_checkpoint WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def get_rollup(self, sensor_id, field, start, end, resolution="hour"):
+        """Aggregates of one numeric field per bucket in [start, end), as
+        (bucket_start, count, min, max, sum, last) rows; resolution is 'minute', 'hour' or 'day'"""
+        return rollups.query(self.conn, sensor_id, field, start, end, resolution)
+
+    def get_series(self, sensor_id, field, start, end):
+        """NumPy (timestamps, values) arrays of one numeric field for start <= ts < end"""
+        return series.query(self.conn, sensor_id, field, start, end)
+
+    def get_envelope(self, sensor_id, field, start, end, resolution="hour"):
+        """get_series() for long windows, traced from the min and max of each rollup bucket"""
+        return series.envelope(self.conn, sensor_id, field, start, end, resolution)
+
+    def get_series_fields(self, sensor_id):
+        return series.fields(self.conn, sensor_id)
+
+    def get_rollup_sensors(self):
+        return rollups.sensors(self.conn)
+
+    def prune_rollups(self, resolution, sensor_id, before, limit=1000):
+        """Delete up to `limit` of a sensor's `resolution` buckets older than `before` in one
+        transaction; returns how many were deleted"""
+        with self.conn:
+            return rollups.prune(self.conn, resolution, sensor_id, before, limit)
+
+    def get_series_sensors(self):
+        return series.sensors(self.conn)
+
+    def prune_series(self, sensor_id, before, limit=1000):
+        """Delete up to `limit` of a sensor's sensor_values readings older than `before` in one
+        transaction; returns how many were deleted"""
+        with self.conn:
+            return series.prune(self.conn, sensor_id, before, limit)
+
     def get_recent_events(self, limit=50):
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM events ORDER BY timestamp DESC LIMIT ?", (limit,))
-        return cursor.fetchall()
+        cursor.execute(f"SELECT {EVENT_COLUMNS} FROM events ORDER BY timestamp DESC LIMIT ?", (limit,))
+        return [event_row(row) for row in cursor]
+
+    def get_events_between(self, start, end, source_type=None, source_id=None):
+        """Events with start <= timestamp < end from SQLite and the archive, oldest first"""
+        query = f"SELECT {EVENT_COLUMNS} FROM events WHERE timestamp >= ? AND timestamp < ?"
+        params = [retention.format_timestamp(start), retention.format_timestamp(end)]
+        if source_type is not None:
+            query += " AND source_type = ?"
+            params.append(source_type)
+        if source_id is not None:
+            query += " AND source_id = ?"
+            params.append(source_id)
+        hot = [event_row(row) for row in self.conn.execute(query, params)]
+        archived = retention.read_partitions(self.archive_dir, start, end, source_type, source_id)
+        # An interrupted archive run can leave a row in both places; keep one copy
+        merged = {row[0]: row for row in archived}
+        merged.update((row[0], row) for row in hot)
+        return sorted(merged.values(), key=lambda row: (row[4], row[0]))
+
+    def iter_events(self, start=None, end=None, source_type=None, chunk_size=5000):
+        """Stream events with start <= timestamp < end, ordered by (timestamp, id), one page at a time"""
+        query = f"SELECT {EVENT_COLUMNS} FROM events WHERE (timestamp, id) > (?, ?)"
+        params = []
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(retention.format_timestamp(end))
+        if source_type is not None:
+            # Unary + keeps the planner on the timestamp index, which also serves the ORDER BY
+            query += " AND +source_type = ?"
+            params.append(source_type)
+        query += " ORDER BY timestamp, id LIMIT ?"
+        cursor_position = (retention.format_timestamp(start) if start is not None else "", -1)
+        while True:
+            rows = [event_row(row) for row in self.conn.execute(query, (*cursor_position, *params, chunk_size))]
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            cursor_position = (rows[-1][4], rows[-1][0])
+
+    def get_event_values(self, sensor_id, field, start=None, end=None):
+        """(timestamp, value) of one payload field in a sensor's events with start <= timestamp < end,
+        in iter_events order. Timestamps are UTC epoch seconds of events.timestamp; values are the
+        numbers and strings the payloads hold, None where the field is missing or holds anything else."""
+        path = '$."' + field.replace('"', '\\"') + '"'
+        query = """
+            SELECT CAST(strftime('%s', timestamp) AS REAL),
+                   CASE WHEN content_type IS NOT NULL OR NOT json_valid(payload) THEN NULL
+                        WHEN json_type(payload, ?) IN ('integer', 'real', 'text') THEN json_extract(payload, ?)
+                   END,
+                   content_type, CASE WHEN content_type IS NOT NULL THEN payload END
+            FROM events WHERE source_type = 'sensor' AND source_id = ?
+        """
+        params = [path, path, sensor_id]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(retention.format_timestamp(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(retention.format_timestamp(end))
+        rows = []
+        for timestamp, value, content_type, payload in self.conn.execute(query + " ORDER BY timestamp, id", params):
+            if content_type is not None:
+                # Binary encodings are decoded here, as event_row() does for every reader
+                codec = get_codec(content_type)
+                value = scalar_field(codec.decode(payload), field) if codec is not None else None
+            rows.append((timestamp, value))
+        return rows
+
+    def get_events_page(self, before=None, after=None, limit=100, source_type=None, source_id=None, category=None,
+                        start=None, end=None, action=None):
+        """One page of at most `limit` events, newest first, for browsing the events table without an OFFSET.
+        `before` and `after` are (timestamp, id) cursors, usually the last or first row of the previous
+        page: the page holds the events just older than `before`, or just newer than `after`. Filters
+        apply in SQL; archived events are not included."""
+        where, params = [], []
+        if before is not None:
+            where.append("(timestamp, id) < (?, ?)")
+            params += before
+        if after is not None:
+            where.append("(timestamp, id) > (?, ?)")
+            params += after
+        if start is not None:
+            where.append("timestamp >= ?")
+            params.append(retention.format_timestamp(start))
+        if end is not None:
+            where.append("timestamp < ?")
+            params.append(retention.format_timestamp(end))
+        if source_type is not None and source_id is not None:
+            where.append("source_type = ? AND source_id = ?")
+            params += (source_type, source_id)
+        elif source_id is not None:
+            where.append("source_id = ?")
+            params.append(source_id)
+        elif source_type is not None:
+            # Most events match a bare type; unary + keeps the planner on the timestamp index,
+            # which serves the ORDER BY, instead of sorting every event of that type
+            where.append("+source_type = ?")
+            params.append(source_type)
+        if category is not None:
+            # Categories live in the registry, not in events; match the sources that have this one
+            sources = [(kind, entity.id)
+                       for kind, entities in (("sensor", self.registry.sensors()), ("device", self.registry.devices()))
+                       if source_type in (None, kind) for entity in entities if entity.category == category]
+            if not sources:
+                return []
+            where.append("(+source_type, +source_id) IN "
+                         "(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))")
+            params.append(json.dumps(sources))
+        if action is not None:
+            where.append("action = ?")
+            params.append(action)
+
+        # Walk the index towards older rows for `before`, towards newer ones for `after`
+        order = "ASC" if after is not None and before is None else "DESC"
+        query = (f"SELECT {EVENT_COLUMNS} FROM events {'WHERE ' + ' AND '.join(where) if where else ''} "
+                 f"ORDER BY timestamp {order}, id {order} LIMIT ?")
+        rows = [event_row(row) for row in self.conn.execute(query, (*params, limit))]
+        if order == "ASC":
+            rows.reverse()
+        return rows
+
+    def get_event_sources(self):
+        # Distinct (source_type, source_id, category) triples present in events. Categories come
+        # from the registry, so this also works on shard files that hold no sensors or devices.
+        cursor = self.conn.execute("SELECT DISTINCT source_type, source_id FROM events")
+        return [(source_type, source_id,
+                 self.get_sensor_category(source_id) if source_type == "sensor" else self.get_device_category(source_id))
+                for source_type, source_id in cursor.fetchall()]
+
+    def reclaim_space(self, pages_per_step=1024):
+        if not self.is_incremental():
+            # A full VACUUM rewrites the whole file under an exclusive lock, so it is left to
+            # enable_incremental_vacuum(), run offline; until then freed pages are only reused
+            logger.info("%s is not in auto_vacuum=INCREMENTAL mode; run python -m db.compact "
+                        "with the services stopped to return freed space to the OS", self.db_path)
+            return
+        # Free pages in small steps so the write lock is released between them
+        while self.conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            self.conn.execute(f"PRAGMA incremental_vacuum({pages_per_step})").fetchall()
+            self.conn.commit()
+
+    def is_incremental(self):
+        return self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self):
+        """Switch a file created before auto_vacuum=INCREMENTAL to that mode. This is one full
+        VACUUM: it needs about twice the file's size on disk and locks out every other connection
+        until it finishes, so only run it while no service has the file open."""
+        if self.is_incremental():
+            return False
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("VACUUM")
+        return True
 
     def get_sensor_category(self, sensor_id):
-        cur = self.conn.cursor()
-        cur.execute("SELECT category FROM sensors WHERE id=?", (sensor_id,))
-        row = cur.fetchone()
-        return row[0] if row else "unknown"
+        sensor = self.registry.sensor(sensor_id) or self.__load_entity("sensor", sensor_id)
+        return sensor.category if sensor else "unknown"
 
     def get_device_category(self, device_id):
-        cur = self.conn.cursor()
-        cur.execute("SELECT category FROM devices WHERE id=?", (device_id,))
-        row = cur.fetchone()
-        return row[0] if row else "unknown"
+        device = self.registry.device(device_id) or self.__load_entity("device", device_id)
+        return device.category if device else "unknown"
 
-    def add_trigger(self, name, sensor_id, condition, device_id, action_payload):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO triggers (name, sensor_id, condition, device_id, action_payload)
-            VALUES (?, ?, ?, ?, ?);
-        """, (name, sensor_id, json.dumps(condition), device_id, json.dumps(action_payload)))
-        trigger_id = cursor.lastrowid
-        self.conn.commit()
-        return trigger_id
+    def __load_entity(self, kind, entity_id):
+        # Registry miss: the row may have been added by another process since the bulk load
+        table = "sensors" if kind == "sensor" else "devices"
+        row = self.conn.execute(f"SELECT id, name, category, type FROM {table} WHERE id=?", (entity_id,)).fetchone()
+        if row is None:
+            return None
+        getattr(self.registry, "put_" + kind)(*row)
+        return getattr(self.registry, kind)(entity_id)
+
+    def add_sensor(self, name, category, type):
+        with self.conn:
+            sensor_id = self.conn.execute("""
+                INSERT INTO sensors (name, category, type) VALUES (?, ?, ?)
+            """, (name, category, type)).lastrowid
+        self.registry.put_sensor(sensor_id, name, category, type)
+        return sensor_id
+
+    def add_device(self, name, category, type):
+        with self.conn:
+            device_id = self.conn.execute("""
+                INSERT INTO devices (name, category, type) VALUES (?, ?, ?)
+            """, (name, category, type)).lastrowid
+        self.registry.put_device(device_id, name, category, type)
+        return device_id
+
+    def update_sensor(self, sensor_id, name, category, type):
+        with self.conn:
+            self.conn.execute("""
+                UPDATE sensors SET name = ?, category = ?, type = ? WHERE id = ?
+            """, (name, category, type, sensor_id))
+        self.registry.put_sensor(sensor_id, name, category, type)
+
+    def update_device(self, device_id, name, category, type):
+        with self.conn:
+            self.conn.execute("""
+                UPDATE devices SET name = ?, category = ?, type = ? WHERE id = ?
+            """, (name, category, type, device_id))
+        self.registry.put_device(device_id, name, category, type)
+
+    def get_device_statuses(self):
+        """{device_id: decoded current_status} for every device with a cached status"""
+        statuses = {}
+        for device_id, status in self.conn.execute("SELECT id, current_status FROM devices WHERE current_status IS NOT NULL"):
+            try:
+                status = json.loads(status)
+            except ValueError:
+                continue
+            if isinstance(status, dict):
+                statuses[device_id] = status
+        return statuses
+
+    def get_last_values(self):
+        """(source_type, source_id, payload, timestamp) rows from sensors.last_payload and devices.current_status"""
+        rows = []
+        cursor = self.conn.execute("""
+            SELECT 'sensor', id, last_payload, last_update FROM sensors WHERE last_payload IS NOT NULL
+            UNION ALL
+            SELECT 'device', id, current_status, last_update FROM devices WHERE current_status IS NOT NULL
+        """)
+        for source_type, source_id, payload, timestamp in cursor:
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                continue
+            if isinstance(payload, dict):
+                rows.append((source_type, source_id, payload, timestamp))
+        return rows
+
+    def update_last_values(self, rows):
+        """Write (source_type, source_id, payload, timestamp) rows back in one transaction"""
+        sensors = [(json.dumps(payload), timestamp, source_id) for source_type, source_id, payload, timestamp in rows
+                   if source_type == "sensor"]
+        devices = [(json.dumps(payload), timestamp, source_id) for source_type, source_id, payload, timestamp in rows
+                   if source_type == "device"]
+        with self.conn:
+            self.conn.executemany("UPDATE sensors SET last_payload = ?, last_update = ? WHERE id = ?", sensors)
+            self.conn.executemany("UPDATE devices SET current_status = ?, last_update = ? WHERE id = ?", devices)
+
+    def refresh_registry(self):
+        """Reload the registry, picking up sensors and devices that another process added or changed.
+        Lookups only fall back to SQL on a miss, so a changed category stays stale until this runs."""
+        self.registry.load(self.conn)
+
+    def add_rule(self, rule, enabled=1):
+        """Save RuleBuilder.build() output; returns the new rule's id"""
+        trigger, options = rule["trigger"], rule.get("options", {})
+        with self.conn:
+            rule_id = self.conn.execute("""
+                INSERT INTO rules (name, topic, sensor_id, enabled, hold_seconds, cooldown_seconds, hysteresis)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (rule["name"], trigger["topic"], trigger.get("sensor_id"), enabled, options.get("hold_seconds", 0),
+                  options.get("cooldown_seconds", 0), options.get("hysteresis", 0))).lastrowid
+            self.conn.executemany("""
+                INSERT INTO rule_conditions (rule_id, position, key, condition) VALUES (?, ?, ?, ?)
+            """, [(rule_id, position, condition["key"], json.dumps(condition["value"]))
+                  for position, condition in enumerate(trigger["conditions"])])
+            self.conn.executemany("""
+                INSERT INTO rule_actions (rule_id, position, topic, qos, payload) VALUES (?, ?, ?, ?, ?)
+            """, [(rule_id, position, action["topic"], action["qos"], json.dumps(action["payload"]))
+                  for position, action in enumerate(rule["actions"])])
+        return rule_id
+
+    def get_rules(self, rule_ids=None):
+        """Every rule, or those in `rule_ids`, as (id, name, topic, sensor_id, [(key, condition)],
+        [(topic, qos, payload)], enabled, hold_seconds, cooldown_seconds, hysteresis), read in one query.
+        Rules share the decoded conditions and payloads they have in common, so treat those as read-only."""
+        rules = {}
+        # Rules mostly repeat a handful of thresholds and commands; decode each distinct one once
+        decoded = {}
+        if rule_ids is None:
+            rules_filter, actions_filter, params = "", "", ()
+        else:
+            rules_filter = "WHERE r.id IN (SELECT value FROM json_each(?))"
+            actions_filter = "WHERE rule_id IN (SELECT value FROM json_each(?))"
+            params = (json.dumps(list(rule_ids)),) * 2
+        cursor = self.conn.execute(f"""
+            SELECT r.id, 0 AS kind, c.position, c.key, c.condition, NULL,
+                   r.name, r.topic, r.sensor_id, r.enabled, r.hold_seconds, r.cooldown_seconds, r.hysteresis
+            FROM rules AS r LEFT JOIN rule_conditions AS c ON c.rule_id = r.id
+            {rules_filter}
+            UNION ALL
+            SELECT rule_id, 1, position, topic, payload, qos, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+            FROM rule_actions
+            {actions_filter}
+            ORDER BY 1, 2, 3
+        """, params)
+        for rule_id, kind, position, key, value, qos, *columns in cursor:
+            if kind == 0:
+                rule = rules.get(rule_id)
+                if rule is None:
+                    name, topic, sensor_id, *options = columns
+                    rule = rules[rule_id] = (rule_id, name, topic, sensor_id, [], [], *options)
+                if position is not None:
+                    condition = decoded.get(value)
+                    if condition is None:
+                        condition = decoded[value] = json.loads(value)
+                    rule[4].append((key, condition))
+            elif rule_id in rules:
+                payload = decoded.get(value)
+                if payload is None:
+                    payload = decoded[value] = json.loads(value)
+                rules[rule_id][5].append((key, qos, payload))
+        return list(rules.values())
+
+    def data_version(self):
+        """Changes whenever another connection commits to the database file; cheap enough to poll"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_rule_cursor(self):
+        """Sequence number of the latest rule change; read it before loading the rules it covers"""
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rule_changes'").fetchone()
+        return row[0] if row is not None else 0
+
+    def get_rule_changes(self, since):
+        """(cursor, ids of the rules added, edited or deleted after change `since`). The ids are
+        None if changes after `since` were already pruned, in which case reload every rule."""
+        rows = self.conn.execute("SELECT seq, rule_id FROM rule_changes WHERE seq > ? ORDER BY seq",
+                                 (since,)).fetchall()
+        if not rows:
+            latest = self.get_rule_cursor()
+            return (since, set()) if latest == since else (latest, None)
+        # Sequence numbers have no gaps (AUTOINCREMENT, and rolled back changes roll it back too)
+        if rows[0][0] != since + 1:
+            return rows[-1][0], None
+        return rows[-1][0], {rule_id for _, rule_id in rows}
+
+    def prune_rule_changes(self, max_age_days=1):
+        with self.conn:
+            self.conn.execute("DELETE FROM rule_changes WHERE changed_at < datetime('now', ?)",
+                              (f"-{max_age_days} days",))
+
+    def add_trigger(self, name, sensor_id, condition, device_id, action_payload, hold_seconds=0, cooldown_seconds=0,
+                    hysteresis=0):
+        """A rule on one sensor that sends `action_payload` to one device"""
+        return self.add_rule({
+            "name": name,
+            "trigger": {
+                "topic": self.get_sensor_category(sensor_id) + "/get",
+                "sensor_id": sensor_id,
+                "conditions": [{"key": key, "value": value} for key, value in condition.items()],
+            },
+            "actions": [{
+                "topic": self.get_device_category(device_id) + "/send",
+                "qos": 1,
+                "payload": {"device_id": device_id} | action_payload,
+            }],
+            "options": {"hold_seconds": hold_seconds, "cooldown_seconds": cooldown_seconds, "hysteresis": hysteresis},
+        })
 
     def log_trigger(self, trigger_id, timestamp):
+        started = time.perf_counter()
         cursor = self.conn.cursor()
         cursor.execute("""
-            UPDATE triggers
+            UPDATE rules
             SET last_triggered= ?
             WHERE id= ?
         """, (timestamp, trigger_id))
+        written = time.perf_counter()
         self.conn.commit()
+        _TRIGGER_WRITE.observe(written - started)
+        _TRIGGER_COMMIT.observe(time.perf_counter() - written)
 
-    def delete_trigger(self, trigger_id):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            DELETE FROM triggers
-            WHERE id= ?
-        """, (trigger_id,))
+    def log_triggers(self, firings):
+        """Record (trigger_id, timestamp) firings in one transaction"""
+        started = time.perf_counter()
+        self.conn.executemany("UPDATE rules SET last_triggered = ? WHERE id = ?",
+                              [(timestamp, trigger_id) for trigger_id, timestamp in firings])
+        written = time.perf_counter()
         self.conn.commit()
+        _TRIGGER_WRITE.observe(written - started)
+        _TRIGGER_COMMIT.observe(time.perf_counter() - written)
 
-    def get_all_triggers(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM triggers DESC")
-        return cursor.fetchall()
+    def delete_trigger(self, trigger_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM rule_conditions WHERE rule_id = ?", (trigger_id,))
+            self.conn.execute("DELETE FROM rule_actions WHERE rule_id = ?", (trigger_id,))
+            self.conn.execute("DELETE FROM rules WHERE id = ?", (trigger_id,))
 
     def switch_trigger(self, trigger_id, target_state):
         cursor = self.conn.cursor()
         cursor.execute("""
-                    UPDATE triggers
+                    UPDATE rules
                     SET enabled= ?
                     WHERE id= ?
                 """, (target_state, trigger_id))
@@ -0,0 +1,137 @@
+import heapq
+import os
+import zlib
+
+from .database import Database
+
+
+def shard_of(source_type, source_id, shards):
+    """Shard index of an event source; stable across processes and restarts"""
+    return zlib.crc32(f"{source_type}:{source_id}".encode()) % shards
+
+
+def shard_paths(db_path, shards):
+    base, ext = os.path.splitext(db_path)
+    return [f"{base}.shard{index}{ext}" for index in range(shards)]
+
+
+def shard_archive_dirs(archive_dir, shards):
+    return [os.path.join(archive_dir, f"shard{index}") for index in range(shards)]
+
+
+def open_database(db_path=None, archive_dir=None, registry=None, shards=0):
+    """A Database, or a FederatedDatabase when events are sharded over `shards` files"""
+    if shards:
+        return FederatedDatabase(db_path=db_path, archive_dir=archive_dir, registry=registry, shards=shards)
+    return Database(db_path=db_path, archive_dir=archive_dir, registry=registry)
+
+
+class FederatedDatabase(Database):
+    # Sensors, devices and rules stay in the main file; events, rollups and series are
+    # spread over one file per shard by shard_of. Reads merge the shards, and event ids
+    # are reported as local_id * shards + shard so they stay unique across shards.
+
+    def __init__(self, db_path=None, archive_dir=None, registry=None, shards=2):
+        if db_path is None:
+            db_path = os.path.join("db", "smart_home_monitor.db")
+        if archive_dir is None:
+            archive_dir = os.path.join(os.path.dirname(db_path), "archive")
+        super().__init__(db_path=db_path, archive_dir=archive_dir, registry=registry)
+        self.shards = [Database(db_path=path, archive_dir=shard_archive, registry=self.registry)
+                       for path, shard_archive in zip(shard_paths(db_path, shards),
+                                                      shard_archive_dirs(archive_dir, shards))]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        super().close()
+
+    def shard_for(self, source_type, source_id):
+        return self.shards[shard_of(source_type, source_id, len(self.shards))]
+
+    def __global_rows(self, index, rows):
+        count = len(self.shards)
+        return [(row[0] * count + index, *row[1:]) for row in rows]
+
+    def __global_stream(self, index, rows):
+        count = len(self.shards)
+        for row in rows:
+            yield (row[0] * count + index, *row[1:])
+
+    def log_event(self, source_type, source_id, payload_json, raw=None):
+        self.shard_for(source_type, source_id).log_event(source_type, source_id, payload_json, raw)
+
+    def log_events(self, events, checkpoint=None):
+        # One transaction per shard; batches from a ShardedWriter only ever touch one
+        if checkpoint is not None:
+            raise ValueError("The ingest journal cannot be applied to sharded storage")
+        by_shard = {}
+        for event in events:
+            by_shard.setdefault(shard_of(event[0], event[1], len(self.shards)), []).append(event)
+        for index, shard_events in by_shard.items():
+            self.shards[index].log_events(shard_events)
+
+    def get_rollup(self, sensor_id, field, start, end, resolution="hour"):
+        return self.shard_for("sensor", sensor_id).get_rollup(sensor_id, field, start, end, resolution)
+
+    def get_series(self, sensor_id, field, start, end):
+        return self.shard_for("sensor", sensor_id).get_series(sensor_id, field, start, end)
+
+    def get_envelope(self, sensor_id, field, start, end, resolution="hour"):
+        return self.shard_for("sensor", sensor_id).get_envelope(sensor_id, field, start, end, resolution)
+
+    def get_series_fields(self, sensor_id):
+        return self.shard_for("sensor", sensor_id).get_series_fields(sensor_id)
+
+    def get_recent_events(self, limit=50):
+        # Each shard's newest `limit` rows, merged; ties are broken like the unsharded query's
+        per_shard = [self.__global_rows(index, shard.get_recent_events(limit))
+                     for index, shard in enumerate(self.shards)]
+        return list(heapq.merge(*per_shard, key=lambda row: row[4], reverse=True))[:limit]
+
+    def get_events_between(self, start, end, source_type=None, source_id=None):
+        if source_type is not None and source_id is not None:
+            index = shard_of(source_type, source_id, len(self.shards))
+            return self.__global_rows(index, self.shards[index].get_events_between(start, end, source_type, source_id))
+        per_shard = [self.__global_rows(index, shard.get_events_between(start, end, source_type, source_id))
+                     for index, shard in enumerate(self.shards)]
+        return list(heapq.merge(*per_shard, key=lambda row: (row[4], row[0])))
+
+    def iter_events(self, start=None, end=None, source_type=None, chunk_size=5000):
+        streams = [self.__global_stream(index, shard.iter_events(start, end, source_type, chunk_size))
+                   for index, shard in enumerate(self.shards)]
+        return heapq.merge(*streams, key=lambda row: (row[4], row[0]))
+
+    def get_event_values(self, sensor_id, field, start=None, end=None):
+        return self.shard_for("sensor", sensor_id).get_event_values(sensor_id, field, start, end)
+
+    def get_events_page(self, before=None, after=None, limit=100, source_type=None, source_id=None, category=None,
+                        start=None, end=None, action=None):
+        # Cursors carry global ids. A shard's rows are before the cursor when
+        # local_id * count + index < id, i.e. local_id < ceil((id - index) / count), and after
+        # it when local_id > floor((id - index) / count), so each shard gets its own local cursor.
+        count = len(self.shards)
+        filters = dict(limit=limit, source_type=source_type, source_id=source_id, category=category, start=start,
+                       end=end, action=action)
+        if source_type is not None and source_id is not None:
+            indexes = [shard_of(source_type, source_id, count)]
+        else:
+            indexes = range(count)
+        per_shard = []
+        for index in indexes:
+            shard_before = (before[0], -((index - before[1]) // count)) if before is not None else None
+            shard_after = (after[0], (after[1] - index) // count) if after is not None else None
+            rows = self.shards[index].get_events_page(shard_before, shard_after, **filters)
+            per_shard.append(self.__global_rows(index, rows))
+        merged = heapq.merge(*per_shard, key=lambda row: (row[4], row[0]), reverse=True)
+        if after is not None and before is None:
+            # The pages hold each shard's `limit` rows just newer than the cursor; keep the oldest of them
+            return list(merged)[-limit:]
+        return list(merged)[:limit]
+
+    def get_event_sources(self):
+        return [source for shard in self.shards for source in shard.get_event_sources()]
+
+    def reclaim_space(self, pages_per_step=1024):
+        for shard in self.shards:
+            shard.reclaim_space(pages_per_step)
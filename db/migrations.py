@@ -0,0 +1,349 @@
+import sqlite3
+
+# Connection tuning applied to every connection, before migrations run
+PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",   # Takes effect on new files; python -m db.compact converts old ones
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",        # Durable across application crashes; WAL makes this safe for the DB file
+    "PRAGMA mmap_size=268435456",       # 256 MiB of the file served by memory mapping
+    "PRAGMA cache_size=-65536",         # 64 MiB page cache (negative values are KiB)
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Each entry upgrades the schema by one version. PRAGMA user_version stores the
+# number of entries already applied, so existing files are upgraded in place.
+# Append new migrations; never edit one that has shipped.
+MIGRATIONS = (
+    # 1: Base schema. Files created before versioning already have these tables.
+    """
+    /* Sensors */
+    
+    CREATE TABLE IF NOT EXISTS sensors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,   
+        name TEXT NOT NULL,                             -- User friendly name for GUI, e.g.: 'Living Room Temperature'      
+        category TEXT NOT NULL,                         -- Sensor category, e.q.: 'temperature', 'light', 'gas', 'water' 
+        type TEXT NOT NULL,                             -- Sensor type, e.q.: 'Thermometer', 'Hygrometer'                                                        
+        last_payload TEXT,                              -- Cached JSON of the most recent data from this sensor, e.g.: '{"value": 21.5}'                                                       
+        last_update TIMESTAMP                           -- The date and time 'last_payload' was updated.         
+    );
+
+    /* Devices */
+    
+    CREATE TABLE IF NOT EXISTS devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,   
+        name TEXT NOT NULL,                             -- User friendly name for GUI, e.g.: 'Main Heater'
+        category TEXT NOT NULL,                         -- Device category, e.q.: 'temperature', 'light', 'gas', 'water' 
+        type TEXT NOT NULL,                             -- Device type, e.q.: 'Heater', 'Plug', 'Lightbulb'                 
+        current_status TEXT,                            -- Cached JSON of the most recent device state, e.g.: '{"state": "on", "mode": "auto"}'
+        last_update TIMESTAMP                           -- The date and time 'current_status' was updated.
+    );
+
+    /* Events */
+    
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_type TEXT NOT NULL,                      -- Specifies which table the 'source_id' refers to, e.g.: 'sensor' or 'device' 
+        source_id INTEGER NOT NULL,                     -- The 'id' from either the 'sensors' or 'devices' table that this event came from
+        payload TEXT NOT NULL,                          -- The full JSON data exactly as it was received, e.g.: '{"value": 21.5, "unit": "C"}' 
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP    -- The date and time this event was saved to the database. (Automatically set by SQLite) 
+    );      
+
+    /* Triggers */
+    
+    CREATE TABLE IF NOT EXISTS triggers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,                             -- User-friendly name for the GUI. e.g.: 'Turn on heater when cold'
+        sensor_id INTEGER NOT NULL,                     -- The 'id' from the 'sensors' table that this rule "listens" to.
+        condition TEXT NOT NULL,                        -- The condition logic, e.g.: 'payload.temperature > 25'
+        device_id INTEGER NOT NULL,                     -- The 'id' from the 'devices' table that this rule controls.
+        action_payload TEXT NOT NULL,                   -- The JSON command to send to device, e.g.: '{"state": "off"}'
+        enabled INTEGER NOT NULL DEFAULT 1,             -- A simple toggle (0=disabled, 1=enabled) so users can turn rules on or off from the GUI 
+        last_triggered TIMESTAMP,                       -- Logs the last time this rule was successfully fired
+        
+        -- Links this rule to a specific sensor
+        FOREIGN KEY (sensor_id) REFERENCES sensors (id),
+        
+        -- Links this rule to a specific device
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    );
+    """,
+
+    # 2: Secondary indexes for recent/per-source event queries and trigger lookups
+    """
+    CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_events_source ON events (source_type, source_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_triggers_sensor_id ON triggers (sensor_id);
+    """,
+
+    # 3: Per-sensor rollups of numeric payload fields, maintained incrementally by log_event(s)
+    """
+    CREATE TABLE IF NOT EXISTS rollup_1m (
+        sensor_id INTEGER NOT NULL,
+        field TEXT NOT NULL,                            -- Numeric payload key, e.g.: 'temperature'
+        bucket INTEGER NOT NULL,                        -- Start of the 1-minute bucket as UTC epoch seconds
+        count INTEGER NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        sum REAL NOT NULL,
+        last REAL NOT NULL,                             -- Most recent value logged in the bucket
+        PRIMARY KEY (sensor_id, field, bucket)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS rollup_1h (
+        sensor_id INTEGER NOT NULL,
+        field TEXT NOT NULL,                            -- Numeric payload key, e.g.: 'temperature'
+        bucket INTEGER NOT NULL,                        -- Start of the 1-hour bucket as UTC epoch seconds
+        count INTEGER NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        sum REAL NOT NULL,
+        last REAL NOT NULL,                             -- Most recent value logged in the bucket
+        PRIMARY KEY (sensor_id, field, bucket)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS rollup_1d (
+        sensor_id INTEGER NOT NULL,
+        field TEXT NOT NULL,                            -- Numeric payload key, e.g.: 'temperature'
+        bucket INTEGER NOT NULL,                        -- Start of the 1-day bucket as UTC epoch seconds
+        count INTEGER NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        sum REAL NOT NULL,
+        last REAL NOT NULL,                             -- Most recent value logged in the bucket
+        PRIMARY KEY (sensor_id, field, bucket)
+    ) WITHOUT ROWID;
+
+    /* Backfill from events logged before rollups existed */
+
+    INSERT INTO rollup_1m (sensor_id, field, bucket, count, min, max, sum, last)
+    SELECT sensor_id, field, bucket, COUNT(*), MIN(value), MAX(value), SUM(value), MAX(last)
+    FROM (
+        SELECT e.source_id AS sensor_id, j.key AS field, j.value AS value,
+               CAST(strftime('%s', e.timestamp) AS INTEGER) / 60 * 60 AS bucket,
+               LAST_VALUE(j.value) OVER (
+                   PARTITION BY e.source_id, j.key, CAST(strftime('%s', e.timestamp) AS INTEGER) / 60
+                   ORDER BY e.id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+               ) AS last
+        FROM (SELECT * FROM events WHERE source_type = 'sensor' AND json_valid(payload)) AS e, json_each(e.payload) AS j
+        WHERE j.type IN ('integer', 'real') AND j.key NOT IN ('sensor_id', 'device_id')
+    )
+    GROUP BY sensor_id, field, bucket;
+
+    INSERT INTO rollup_1h (sensor_id, field, bucket, count, min, max, sum, last)
+    SELECT sensor_id, field, bucket, COUNT(*), MIN(value), MAX(value), SUM(value), MAX(last)
+    FROM (
+        SELECT e.source_id AS sensor_id, j.key AS field, j.value AS value,
+               CAST(strftime('%s', e.timestamp) AS INTEGER) / 3600 * 3600 AS bucket,
+               LAST_VALUE(j.value) OVER (
+                   PARTITION BY e.source_id, j.key, CAST(strftime('%s', e.timestamp) AS INTEGER) / 3600
+                   ORDER BY e.id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+               ) AS last
+        FROM (SELECT * FROM events WHERE source_type = 'sensor' AND json_valid(payload)) AS e, json_each(e.payload) AS j
+        WHERE j.type IN ('integer', 'real') AND j.key NOT IN ('sensor_id', 'device_id')
+    )
+    GROUP BY sensor_id, field, bucket;
+
+    INSERT INTO rollup_1d (sensor_id, field, bucket, count, min, max, sum, last)
+    SELECT sensor_id, field, bucket, COUNT(*), MIN(value), MAX(value), SUM(value), MAX(last)
+    FROM (
+        SELECT e.source_id AS sensor_id, j.key AS field, j.value AS value,
+               CAST(strftime('%s', e.timestamp) AS INTEGER) / 86400 * 86400 AS bucket,
+               LAST_VALUE(j.value) OVER (
+                   PARTITION BY e.source_id, j.key, CAST(strftime('%s', e.timestamp) AS INTEGER) / 86400
+                   ORDER BY e.id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+               ) AS last
+        FROM (SELECT * FROM events WHERE source_type = 'sensor' AND json_valid(payload)) AS e, json_each(e.payload) AS j
+        WHERE j.type IN ('integer', 'real') AND j.key NOT IN ('sensor_id', 'device_id')
+    )
+    GROUP BY sensor_id, field, bucket;
+    """,
+
+    # 4: Numeric readings as typed columns for charting, filled at ingest alongside the rollups
+    """
+    CREATE TABLE IF NOT EXISTS sensor_values (
+        sensor_id INTEGER NOT NULL,
+        field TEXT NOT NULL,                            -- Numeric payload key, e.g.: 'temperature'
+        ts REAL NOT NULL,                               -- UTC epoch seconds the reading was logged
+        value REAL NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_sensor_values_series ON sensor_values (sensor_id, field, ts);
+
+    INSERT INTO sensor_values (sensor_id, field, ts, value)
+    SELECT e.source_id, j.key, CAST(strftime('%s', e.timestamp) AS REAL), j.value
+    FROM (SELECT * FROM events WHERE source_type = 'sensor' AND json_valid(payload)) AS e, json_each(e.payload) AS j
+    WHERE j.type IN ('integer', 'real') AND j.key NOT IN ('sensor_id', 'device_id')
+    ORDER BY e.id;
+    """,
+
+    # 5: Per-trigger debouncing; all zero keeps the original fire-on-every-match behaviour
+    """
+    ALTER TABLE triggers ADD COLUMN hold_seconds REAL NOT NULL DEFAULT 0;       -- Conditions must hold this long before firing
+    ALTER TABLE triggers ADD COLUMN cooldown_seconds REAL NOT NULL DEFAULT 0;   -- Minimum time between two firings
+    ALTER TABLE triggers ADD COLUMN hysteresis REAL NOT NULL DEFAULT 0;         -- Margin numeric thresholds must fall back past to re-arm
+    """,
+
+    # 6: Last ingest journal record applied to events, committed in the same transaction as the events
+    """
+    CREATE TABLE IF NOT EXISTS journal_checkpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 0),          -- Single row
+        seq INTEGER NOT NULL
+    );
+    """,
+
+    # 7: Rules with any number of conditions and actions, replacing the one-sensor, one-device triggers table
+    """
+    CREATE TABLE IF NOT EXISTS rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,           -- Existing trigger ids are kept
+        name TEXT NOT NULL,
+        topic TEXT NOT NULL,                            -- The topic this rule listens to, e.g.: 'temperature/get'
+        sensor_id INTEGER,                              -- Only messages from this sensor; NULL for every message on the topic
+        enabled INTEGER NOT NULL DEFAULT 1,
+        hold_seconds REAL NOT NULL DEFAULT 0,
+        cooldown_seconds REAL NOT NULL DEFAULT 0,
+        hysteresis REAL NOT NULL DEFAULT 0,
+        last_triggered TIMESTAMP,
+        FOREIGN KEY (sensor_id) REFERENCES sensors (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS rule_conditions (
+        rule_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        key TEXT NOT NULL,                              -- Payload key, e.g.: 'temperature'
+        condition TEXT NOT NULL,                        -- The condition as JSON, e.g.: '">=14"' or 'true'
+        PRIMARY KEY (rule_id, position),
+        FOREIGN KEY (rule_id) REFERENCES rules (id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS rule_actions (
+        rule_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        topic TEXT NOT NULL,                            -- e.g.: 'temperature/send'
+        qos INTEGER NOT NULL DEFAULT 1,
+        payload TEXT NOT NULL,                          -- The JSON to publish, e.g.: '{"device_id": 1, "state": "off"}'
+        PRIMARY KEY (rule_id, position),
+        FOREIGN KEY (rule_id) REFERENCES rules (id)
+    ) WITHOUT ROWID;
+
+    INSERT INTO rules (id, name, topic, sensor_id, enabled, hold_seconds, cooldown_seconds, hysteresis, last_triggered)
+    SELECT t.id, t.name, COALESCE(s.category, 'unknown') || '/get', t.sensor_id,
+           -- Unreadable conditions would become a rule with none, firing on every message
+           CASE WHEN json_valid(t.condition) AND json_type(t.condition) = 'object' THEN t.enabled ELSE 0 END, t.hold_seconds,
+           t.cooldown_seconds, t.hysteresis, t.last_triggered
+    FROM triggers AS t LEFT JOIN sensors AS s ON s.id = t.sensor_id;
+
+    INSERT INTO rule_conditions (rule_id, position, key, condition)
+    SELECT t.id, ROW_NUMBER() OVER (PARTITION BY t.id ORDER BY j.id) - 1, j.key,
+           CASE WHEN j.type IN ('true', 'false', 'null') THEN j.type
+                WHEN j.type IN ('object', 'array') THEN j.value
+                ELSE json_quote(j.value) END
+    FROM (SELECT * FROM triggers WHERE json_valid(condition)) AS t, json_each(t.condition) AS j
+    WHERE json_type(t.condition) = 'object';
+
+    INSERT INTO rule_actions (rule_id, position, topic, qos, payload)
+    SELECT t.id, 0, COALESCE(d.category, 'unknown') || '/send', 1,
+           json_patch(json_object('device_id', t.device_id), t.action_payload)
+    FROM triggers AS t LEFT JOIN devices AS d ON d.id = t.device_id
+    WHERE json_valid(t.action_payload);
+
+    DROP TABLE triggers;
+    """,
+
+    # 8: Change feed of rule edits from any connection or process, read by running Controllers
+    """
+    CREATE TABLE IF NOT EXISTS rule_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,          -- Readers keep the last seq they applied
+        rule_id INTEGER NOT NULL,                       -- Added, edited or deleted rule
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    /* last_triggered is written on every firing and is not a change to the rule */
+    CREATE TRIGGER IF NOT EXISTS rules_changed_insert AFTER INSERT ON rules
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.id); END;
+    CREATE TRIGGER IF NOT EXISTS rules_changed_update
+    AFTER UPDATE OF name, topic, sensor_id, enabled, hold_seconds, cooldown_seconds, hysteresis ON rules
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.id); END;
+    CREATE TRIGGER IF NOT EXISTS rules_changed_delete AFTER DELETE ON rules
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (OLD.id); END;
+
+    CREATE TRIGGER IF NOT EXISTS rule_conditions_changed_insert AFTER INSERT ON rule_conditions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id); END;
+    CREATE TRIGGER IF NOT EXISTS rule_conditions_changed_update AFTER UPDATE ON rule_conditions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id); END;
+    CREATE TRIGGER IF NOT EXISTS rule_conditions_changed_delete AFTER DELETE ON rule_conditions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (OLD.rule_id); END;
+
+    CREATE TRIGGER IF NOT EXISTS rule_actions_changed_insert AFTER INSERT ON rule_actions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id); END;
+    CREATE TRIGGER IF NOT EXISTS rule_actions_changed_update AFTER UPDATE ON rule_actions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id); END;
+    CREATE TRIGGER IF NOT EXISTS rule_actions_changed_delete AFTER DELETE ON rule_actions
+    BEGIN INSERT INTO rule_changes (rule_id) VALUES (OLD.rule_id); END;
+    """,
+
+    # 9: Payloads are stored as received; binary encodings are kept as bytes with their content type
+    """
+    ALTER TABLE events ADD COLUMN content_type TEXT;    -- e.g.: 'application/vnd.smarthome.reading'; NULL for JSON text
+    """,
+
+    # 10: The payload's 'action' field as a column, so the event browser filters on it in SQL
+    """
+    ALTER TABLE events ADD COLUMN action TEXT;          -- e.g.: 'get', 'send'; NULL when the payload has none
+
+    UPDATE events SET action = json_extract(payload, '$.action')
+    WHERE content_type IS NULL AND json_valid(payload) AND json_type(payload) = 'object';
+
+    CREATE INDEX IF NOT EXISTS idx_events_action ON events (action, timestamp) WHERE action IS NOT NULL;
+    """,
+
+    # 11: Per-sensor rule lookups, as idx_triggers_sensor_id served until 7 dropped the triggers table.
+    # rule_conditions and rule_actions are already keyed by (rule_id, position).
+    """
+    CREATE INDEX IF NOT EXISTS idx_rules_sensor_id ON rules (sensor_id, topic);
+    """,
+)
+
+# Tables holding sensors, devices, rules and everything recorded about them, children before
+# the tables they reference. Keep in step with MIGRATIONS. journal_checkpoint and rule_changes
+# are bookkeeping for running processes and are left alone.
+DATA_TABLES = ("events", "rollup_1m", "rollup_1h", "rollup_1d", "sensor_values", "rule_conditions", "rule_actions",
+               "rules", "devices", "sensors")
+
+
+def configure(conn):
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def split_statements(script):
+    statements, current = [], ""
+    for part in script.split(";"):
+        current += part + ";"
+        # ';' inside comments or string literals leaves the statement incomplete
+        if sqlite3.complete_statement(current):
+            if current.strip(" \t\n;"):
+                statements.append(current)
+            current = ""
+    return statements
+
+
+def migrate(conn):
+    """Apply pending migrations, one transaction per version"""
+    for target in range(schema_version(conn) + 1, len(MIGRATIONS) + 1):
+        # BEGIN IMMEDIATE takes the write lock, so concurrent processes apply each version once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= target:
+                conn.rollback()
+                continue
+            for statement in split_statements(MIGRATIONS[target - 1]):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
@@ -0,0 +1,64 @@
+import json
+import time
+
+from codec import JSON, detect, get_codec
+
+# Column list of event rows as stored; event_row() turns one into the usual 5-tuple
+EVENT_COLUMNS = "id, source_type, source_id, payload, timestamp, content_type"
+
+
+def stored_payload(event):
+    """(payload, content_type) columns for a (source_type, source_id, payload[, raw]) event.
+    The payload is kept as received when `raw` is given: JSON as text, so SQLite's JSON
+    functions still apply to it, and binary encodings as bytes with their content type."""
+    raw = event[3] if len(event) > 3 else None
+    if raw is not None:
+        codec = detect(raw)
+        if codec is not JSON:
+            return bytes(raw), codec.content_type
+        if isinstance(raw, str):
+            return raw, None
+        try:
+            return bytes(raw).decode(), None
+        except UnicodeDecodeError:
+            pass
+    return json.dumps(event[2]), None
+
+
+def received_at(event, default):
+    """Epoch seconds a (source_type, source_id, payload, raw, received) event was received; events
+    without a receive time are logged as they arrive, at `default`"""
+    received = event[4] if len(event) > 4 else None
+    return default if received is None else received
+
+
+def event_timestamp(epoch):
+    """events.timestamp text for epoch seconds, in the UTC format of SQLite's CURRENT_TIMESTAMP"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def payload_action(payload):
+    """The 'action' field of a payload, stored in its own column for filtering. Anything but a
+    string is stored as compact JSON text, as the json_extract backfill of migration 10 did."""
+    action = payload.get("action") if isinstance(payload, dict) else None
+    if action is None or isinstance(action, str):
+        return action
+    return json.dumps(action, separators=(",", ":"))
+
+
+def event_row(row):
+    """(id, source_type, source_id, payload, timestamp) with the payload as JSON text however it is stored"""
+    event_id, source_type, source_id, payload, timestamp, content_type = row
+    if content_type is not None:
+        codec = get_codec(content_type)
+        if codec is not None:
+            payload = json.dumps(codec.decode(payload))
+    return event_id, source_type, source_id, payload, timestamp
+
+
+def scalar_field(payload, field):
+    """A payload field if it holds a number or a string, else None"""
+    value = payload.get(field) if isinstance(payload, dict) else None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    return value
@@ -0,0 +1,53 @@
+from collections import namedtuple
+import threading
+
+Entity = namedtuple("Entity", ("id", "name", "category", "type"))
+
+
+class MetadataRegistry:
+    # In-memory copy of the sensors and devices tables (id, name, category, type).
+    # One instance is shared by every Database in the process, so category lookups
+    # from the GUI and the Controller never go to SQL once it is loaded.
+
+    def __init__(self):
+        self.__sensors = {}
+        self.__devices = {}
+        self.__lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, conn):
+        """Replace the contents with one bulk query over both tables"""
+        cursor = conn.execute("""
+            SELECT 'sensor', id, name, category, type FROM sensors
+            UNION ALL
+            SELECT 'device', id, name, category, type FROM devices
+        """)
+        sensors, devices = {}, {}
+        for kind, *row in cursor:
+            (sensors if kind == "sensor" else devices)[row[0]] = Entity(*row)
+        with self.__lock:
+            self.__sensors, self.__devices = sensors, devices
+            self.loaded = True
+
+    def put_sensor(self, sensor_id, name, category, type):
+        with self.__lock:
+            self.__sensors[sensor_id] = Entity(sensor_id, name, category, type)
+
+    def put_device(self, device_id, name, category, type):
+        with self.__lock:
+            self.__devices[device_id] = Entity(device_id, name, category, type)
+
+    def sensor(self, sensor_id):
+        return self.__sensors.get(sensor_id)
+
+    def device(self, device_id):
+        return self.__devices.get(device_id)
+
+    def sensors(self):
+        return list(self.__sensors.values())
+
+    def devices(self):
+        return list(self.__devices.values())
+
+    def sensor_categories(self):
+        return {sensor.category for sensor in self.sensors()}
@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+import gzip
+import json
+import logging
+import os
+import threading
+
+from .payloads import EVENT_COLUMNS, event_row
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_timestamp(value):
+    # events.timestamp is CURRENT_TIMESTAMP text, so bounds are compared as text too
+    return value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+
+
+class RetentionPolicy:
+    # Days to keep events in SQLite. A category rule ('gas') wins over a source type
+    # rule ('sensor'), which wins over the default; None keeps events forever.
+    # `rollup_days` maps a rollup resolution ('minute', 'hour', 'day') to the days its
+    # buckets are kept; resolutions it leaves out are kept forever.
+
+    def __init__(self, default_days=None, by_source_type=None, by_category=None, rollup_days=None):
+        self.default_days = default_days
+        self.by_source_type = dict(by_source_type or {})
+        self.by_category = dict(by_category or {})
+        self.rollup_days = dict(rollup_days or {})
+
+    def max_age_days(self, source_type, category):
+        if category in self.by_category:
+            return self.by_category[category]
+        if source_type in self.by_source_type:
+            return self.by_source_type[source_type]
+        return self.default_days
+
+    def is_empty(self):
+        return (self.default_days is None and not any(self.by_source_type.values())
+                and not any(self.by_category.values()) and not any(self.rollup_days.values()))
+
+
+def partition_path(archive_dir, day):
+    return os.path.join(archive_dir, f"events-{day}.jsonl.gz")
+
+
+def write_partitions(archive_dir, rows):
+    """Append (id, source_type, source_id, payload, timestamp) rows to their per-day gzip JSONL files"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[4][:10], []).append(row)
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, day_rows in by_day.items():
+        # Each append adds a gzip member; readers see one continuous stream
+        with gzip.open(partition_path(archive_dir, day), "at", encoding="utf-8") as f:
+            for event_id, source_type, source_id, payload, timestamp in day_rows:
+                f.write(json.dumps({"id": event_id, "source_type": source_type, "source_id": source_id,
+                                    "payload": payload, "timestamp": timestamp}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_partitions(archive_dir, start, end, source_type=None, source_id=None):
+    """Archived rows with start <= timestamp < end, in the same tuple shape as the events table"""
+    start, end = format_timestamp(start), format_timestamp(end)
+    day = datetime.strptime(start[:10], "%Y-%m-%d")
+    last_day = datetime.strptime(end[:10], "%Y-%m-%d")
+    rows = []
+    while day <= last_day:
+        path = partition_path(archive_dir, day.strftime("%Y-%m-%d"))
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if not start <= event["timestamp"] < end:
+                        continue
+                    if source_type is not None and event["source_type"] != source_type:
+                        continue
+                    if source_id is not None and event["source_id"] != source_id:
+                        continue
+                    rows.append((event["id"], event["source_type"], event["source_id"],
+                                 event["payload"], event["timestamp"]))
+        day += timedelta(days=1)
+    return rows
+
+
+class Archiver:
+    # Background job that moves expired events into date-partitioned archives. Rows are
+    # written to the archive before they are deleted, one short transaction per chunk,
+    # so the ingest writer is never locked out for long. Charting readings in sensor_values
+    # expire with their sensor's events and rollup buckets after the policy's rollup_days;
+    # both are deleted, since the archive has the events they were computed from.
+
+    def __init__(self, policy, db_path=None, archive_dir=None, chunk_size=1000, interval_s=3600, registry=None):
+        self.__policy = policy
+        self.__db_path = db_path
+        self.__archive_dir = archive_dir
+        # A shard file has no sensors or devices of its own; categories come from this registry
+        self.__registry = registry
+        self.__chunk_size = chunk_size
+        self.__interval = interval_s
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        if self.__thread is not None or self.__policy.is_empty():
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, name="Archiver", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def __run(self):
+        from .database import Database
+
+        db = Database(db_path=self.__db_path, archive_dir=self.__archive_dir, registry=self.__registry)
+        while not self.__stop.is_set():
+            try:
+                self.run_once(db)
+            except Exception:
+                logger.exception("Error while archiving events")
+            self.__stop.wait(self.__interval)
+        db.close()
+
+    def run_once(self, db, now=None):
+        """Archive and delete every expired event; returns the number of events moved"""
+        now = now or datetime.utcnow()
+        moved = 0
+        for source_type, source_id, category in db.get_event_sources():
+            days = self.__policy.max_age_days(source_type, category)
+            if days is None:
+                continue
+            cutoff = format_timestamp(now - timedelta(days=days))
+            while not self.__stop.is_set():
+                rows = [event_row(row) for row in db.conn.execute(f"""
+                    SELECT {EVENT_COLUMNS} FROM events
+                    WHERE source_type = ? AND source_id = ? AND timestamp < ?
+                    ORDER BY timestamp LIMIT ?
+                """, (source_type, source_id, cutoff, self.__chunk_size))]
+                if not rows:
+                    break
+                write_partitions(db.archive_dir, rows)
+                with db.conn:
+                    db.conn.executemany("DELETE FROM events WHERE id = ?", [(row[0],) for row in rows])
+                moved += len(rows)
+        if moved + self.__prune_series(db, now) + self.__prune_rollups(db, now):
+            db.reclaim_space()
+        return moved
+
+    def __prune_series(self, db, now):
+        pruned = 0
+        for sensor_id in db.get_series_sensors():
+            days = self.__policy.max_age_days("sensor", db.get_sensor_category(sensor_id))
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            while not self.__stop.is_set():
+                deleted = db.prune_series(sensor_id, cutoff, self.__chunk_size)
+                pruned += deleted
+                if deleted < self.__chunk_size:
+                    break
+        return pruned
+
+    def __prune_rollups(self, db, now):
+        pruned = 0
+        for resolution, days in self.__policy.rollup_days.items():
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            for sensor_id in db.get_rollup_sensors():
+                while not self.__stop.is_set():
+                    deleted = db.prune_rollups(resolution, sensor_id, cutoff, self.__chunk_size)
+                    pruned += deleted
+                    if deleted < self.__chunk_size:
+                        break
+        return pruned
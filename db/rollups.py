@@ -0,0 +1,102 @@
+import calendar
+from datetime import datetime, timezone
+
+from .payloads import received_at
+
+# resolution name -> (table, bucket width in seconds)
+RESOLUTIONS = {
+    "minute": ("rollup_1m", 60),
+    "hour": ("rollup_1h", 3600),
+    "day": ("rollup_1d", 86400),
+}
+
+# Identifiers, not readings
+_SKIPPED_FIELDS = {"sensor_id", "device_id"}
+
+_UPSERT = """
+    INSERT INTO {table} (sensor_id, field, bucket, count, min, max, sum, last)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (sensor_id, field, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max),
+        sum = sum + excluded.sum,
+        last = excluded.last
+"""
+
+
+def to_epoch(value):
+    """Accepts epoch seconds or a datetime; naive datetimes are UTC, like SQLite's CURRENT_TIMESTAMP"""
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+    return float(value)
+
+
+def numeric_fields(payload):
+    if not isinstance(payload, dict):
+        return
+    for field, value in payload.items():
+        if field in _SKIPPED_FIELDS or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        yield field, float(value)
+
+
+def aggregate(events, timestamp):
+    """Fold a batch of (source_type, source_id, payload[, raw[, received]]) events into per-bucket
+    partial aggregates; events without a receive time count at `timestamp`"""
+    partials = {resolution: {} for resolution in RESOLUTIONS}
+    for event in events:
+        source_type, source_id, payload = event[:3]
+        if source_type != "sensor":
+            continue
+        received = received_at(event, timestamp)
+        for field, value in numeric_fields(payload):
+            for resolution, (_, width) in RESOLUTIONS.items():
+                key = (source_id, field, int(received // width * width))
+                partial = partials[resolution].get(key)
+                if partial is None:
+                    partials[resolution][key] = [1, value, value, value, value]
+                else:
+                    partial[0] += 1
+                    partial[1] = min(partial[1], value)
+                    partial[2] = max(partial[2], value)
+                    partial[3] += value
+                    partial[4] = value
+    return partials
+
+
+def apply(conn, events, timestamp):
+    # Runs inside the caller's transaction so rollups never drift from the events table
+    for resolution, rows in aggregate(events, timestamp).items():
+        if rows:
+            conn.executemany(_UPSERT.format(table=RESOLUTIONS[resolution][0]),
+                             [key + tuple(partial) for key, partial in rows.items()])
+
+
+def prune(conn, resolution, sensor_id, before, limit):
+    """Delete up to `limit` of a sensor's `resolution` buckets starting before `before`; returns how many were deleted"""
+    table, _ = RESOLUTIONS[resolution]
+    return conn.execute(f"""
+        DELETE FROM {table} WHERE (sensor_id, field, bucket) IN (
+            SELECT sensor_id, field, bucket FROM {table} WHERE sensor_id = ? AND bucket < ? LIMIT ?
+        )
+    """, (sensor_id, to_epoch(before), limit)).rowcount
+
+
+def sensors(conn):
+    # rollup_1d has the fewest rows, and every sensor with a bucket at any resolution has one there
+    return [row[0] for row in conn.execute("SELECT DISTINCT sensor_id FROM rollup_1d")]
+
+
+def query(conn, sensor_id, field, start, end, resolution):
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown rollup resolution {resolution!r}, expected one of {', '.join(RESOLUTIONS)}")
+    table, width = RESOLUTIONS[resolution]
+    start, end = to_epoch(start), to_epoch(end)
+    cursor = conn.execute(f"""
+        SELECT bucket, count, min, max, sum, last FROM {table}
+        WHERE sensor_id = ? AND field = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket
+    """, (sensor_id, field, int(start // width * width), end))
+    return [(datetime.fromtimestamp(bucket, timezone.utc).replace(tzinfo=None),) + tuple(row)
+            for bucket, *row in cursor]
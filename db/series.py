@@ -0,0 +1,61 @@
+from .payloads import received_at
+from .rollups import RESOLUTIONS, numeric_fields, to_epoch
+
+
+def apply(conn, events, timestamp):
+    # Numeric readings are split out at ingest so charts never parse payload JSON
+    rows = [(event[1], field, received_at(event, timestamp), value)
+            for event in events if event[0] == "sensor"
+            for field, value in numeric_fields(event[2])]
+    if rows:
+        conn.executemany("INSERT INTO sensor_values (sensor_id, field, ts, value) VALUES (?, ?, ?, ?)", rows)
+
+
+def query(conn, sensor_id, field, start, end):
+    """(timestamps, values) float64 arrays for start <= ts < end; timestamps are UTC epoch seconds"""
+    import numpy as np
+
+    cursor = conn.execute("""
+        SELECT ts, value FROM sensor_values
+        WHERE sensor_id = ? AND field = ? AND ts >= ? AND ts < ?
+        ORDER BY ts
+    """, (sensor_id, field, to_epoch(start), to_epoch(end)))
+    data = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 2)
+    return data[:, 0].copy(), data[:, 1].copy()
+
+
+def envelope(conn, sensor_id, field, start, end, resolution):
+    """query() for long windows: (timestamps, values) arrays holding the min and then the max of
+    each rollup bucket overlapping [start, end), both at the bucket's start. A month of hourly
+    buckets is 1,440 points however often the sensor reports."""
+    import numpy as np
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown rollup resolution {resolution!r}, expected one of {', '.join(RESOLUTIONS)}")
+    table, width = RESOLUTIONS[resolution]
+    start, end = to_epoch(start), to_epoch(end)
+    cursor = conn.execute(f"""
+        SELECT bucket, min, max FROM {table}
+        WHERE sensor_id = ? AND field = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket
+    """, (sensor_id, field, int(start // width * width), end))
+    data = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+    return np.repeat(data[:, 0], 2), data[:, 1:].ravel().copy()
+
+
+def prune(conn, sensor_id, before, limit):
+    """Delete up to `limit` of a sensor's readings logged before `before`; returns how many were deleted"""
+    return conn.execute("""
+        DELETE FROM sensor_values WHERE rowid IN (
+            SELECT rowid FROM sensor_values WHERE sensor_id = ? AND ts < ? LIMIT ?
+        )
+    """, (sensor_id, to_epoch(before), limit)).rowcount
+
+
+def sensors(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT sensor_id FROM sensor_values")]
+
+
+def fields(conn, sensor_id):
+    cursor = conn.execute("SELECT DISTINCT field FROM rollup_1d WHERE sensor_id = ? ORDER BY field", (sensor_id,))
+    return [row[0] for row in cursor]
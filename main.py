@@ -1,26 +1,138 @@
+import time
+
+_LAUNCHED = time.perf_counter()
+
+import argparse
+import logging
+import os
+import threading
+
 from controller import Controller
-from monitor import Monitor
-from wireframe import start_gui
+from db.federated import shard_archive_dirs, shard_paths
+from db.registry import MetadataRegistry
+from db.retention import Archiver, RetentionPolicy
+from metrics import STARTUP, MetricsServer
+from monitor import EventFeed, Journal, LastValueCache, Monitor
+from transport import MqttTransport
 import paho.mqtt.client as paho
 
+# Tk, matplotlib and NumPy are only imported with the GUI (see __main__)
+STARTUP.launched = _LAUNCHED
+STARTUP.record("imports", time.perf_counter() - _LAUNCHED)
+
+SERVICES = ("controller", "monitor")
+
+# Metrics port of a process running the monitor, and of one running the controller alone,
+# so the two services can run as separate processes on one host
+METRICS_PORT = 9108
+CONTROLLER_METRICS_PORT = 9109
 
-def main():
+
+def main(feed, registry, last_values, shards, services=SERVICES, transport=None, metrics_port=None):
     HOST = "910e146c7f1f4c0fa6799235de0cd0fe.s1.eu.hivemq.cloud"
     PORT = 8883
     USERNAME = "main_connection"
     PASSWORD = "dycrax-3ruzdU"
 
-    controller = Controller(client_id='Controller', protocol=paho.MQTTv5)
-    controller.connect(HOST, PORT, USERNAME, PASSWORD)
-    controller.start()
-    print("CONTROLLER: Service Started.")
+    # Days of events kept in SQLite before they move to db/archive, and of minute and hour rollups
+    RETENTION = RetentionPolicy(by_source_type={"sensor": 90, "device": 365}, by_category={"gas": 730},
+                                rollup_days={"minute": 90, "hour": 730})
+
+    # One broker connection shared by every service; each message is decoded once
+    if transport is None:
+        transport = MqttTransport(client_id='Smart_Home', protocol=paho.MQTTv5)
+
+    started = []
+    # Constructing services only registers their subscriptions; nothing blocks yet
+    if "controller" in services:
+        # Device states come from the Monitor's last values when it runs here, not from SQL
+        controller = Controller(transport, registry=registry, shards=shards,
+                                last_values=last_values if "monitor" in services else None)
+        started.append(("CONTROLLER", controller))
+    if "monitor" in services:
+        if shards:
+            # Each shard worker process writes its own SQLite file
+            monitor = Monitor(transport, feed=feed, last_values=last_values, shards=shards)
+        else:
+            # Incoming events are appended here first, so SQLite stalls never block the network thread
+            with STARTUP.phase("journal recovery"):
+                journal = Journal(os.path.join("db", "journal"))
+            monitor = Monitor(transport, feed=feed, last_values=last_values, journal=journal)
+        started.append(("MONITOR", monitor))
+
+    # The TLS handshake runs on paho's network thread while the services open their databases
+    transport.connect_async(HOST, PORT, USERNAME, PASSWORD)
+    transport.start()
 
-    monitor = Monitor(client_id='Monitor_Service', protocol=paho.MQTTv5)
-    monitor.connect(HOST, PORT, USERNAME, PASSWORD)
-    monitor.start()
-    print("MONITOR: Service Started.")
+    def start_service(name, service):
+        service.start()
+        logging.info("%s: Service Started.", name)
+
+    threads = [threading.Thread(target=start_service, args=service, name=f"start-{service[0].lower()}")
+               for service in started]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    STARTUP.milestone("services started")
+
+    # Retention runs where the events are written
+    if "monitor" in services and shards:
+        db_path = os.path.join("db", "smart_home_monitor.db")
+        for shard_path, archive_dir in zip(shard_paths(db_path, shards),
+                                           shard_archive_dirs(os.path.join("db", "archive"), shards)):
+            Archiver(RETENTION, db_path=shard_path, archive_dir=archive_dir, registry=registry).start()
+    elif "monitor" in services:
+        archiver = Archiver(RETENTION)
+        archiver.start()
+
+    if metrics_port is None:
+        default_port = METRICS_PORT if "monitor" in services else CONTROLLER_METRICS_PORT
+        metrics_port = int(os.environ.get("SMART_HOME_METRICS_PORT", default_port))
+    try:
+        metrics_server = MetricsServer(port=metrics_port)
+        metrics_server.start()
+    except OSError as e:
+        logging.error("Could not serve metrics on port %d: %s", metrics_port, e)
+
+    def report():
+        # Logged once the first message has gone through every handler, or after 30 s
+        transport.wait_first_message(timeout=30)
+        logging.info("%s", STARTUP.summary())
+
+    threading.Thread(target=report, name="startup-report", daemon=True).start()
+    return transport, [service for _, service in started]
 
 
 if __name__ == "__main__":
-    main()
-    start_gui()
+    parser = argparse.ArgumentParser(description="Smart home controller and monitor")
+    parser.add_argument("--headless", action="store_true", help="run the services without the Tk GUI")
+    parser.add_argument("--services", nargs="+", choices=SERVICES, default=list(SERVICES),
+                        help="services to run (default: all)")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"port for /metrics; 0 picks a free one (default: $SMART_HOME_METRICS_PORT, or "
+                             f"{METRICS_PORT} with the monitor and {CONTROLLER_METRICS_PORT} for the controller alone)")
+    args = parser.parse_args()
+
+    # Per-message logs are DEBUG, so they cost nothing at the default INFO level
+    logging.basicConfig(level=os.environ.get("SMART_HOME_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    event_feed = EventFeed()
+    metadata = MetadataRegistry()
+    current_values = LastValueCache()
+    # Worker processes for ingest; 0 keeps ingest in this process
+    ingest_shards = int(os.environ.get("SMART_HOME_INGEST_SHARDS", "0"))
+    transport, services = main(event_feed, metadata, current_values, ingest_shards, args.services,
+                               metrics_port=args.metrics_port)
+
+    if args.headless:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            for service in services:
+                service.stop()
+            transport.stop()
+    else:
+        from wireframe import start_gui
+
+        start_gui(feed=event_feed, registry=metadata, last_values=current_values, shards=ingest_shards)
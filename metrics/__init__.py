@@ -0,0 +1,3 @@
+from .http import MetricsServer
+from .registry import REGISTRY, MetricsRegistry
+from .startup import STARTUP, StartupReport
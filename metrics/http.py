@@ -0,0 +1,46 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+from .registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsServer:
+    # Serves the registry at http://<host>:<port>/metrics for Prometheus or curl
+
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9108):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="MetricsServer", daemon=True)
+        self.__thread.start()
+        logger.info("Metrics available at http://%s:%s/metrics", *self.__server.server_address[:2])
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+from .registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = REGISTRY.gauge("smarthome_startup_seconds",
+                                 "Startup phase durations, and milestones as seconds since launch", ("phase",))
+
+
+class StartupReport:
+    # Times startup phases (which may run in parallel) and milestones measured from launch.
+    # Set `launched` as early as possible, i.e. before the entry point's imports.
+
+    def __init__(self, launched=None):
+        self.launched = time.perf_counter() if launched is None else launched
+        self.__entries = []
+        self.__lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.__lock:
+            self.__entries.append((name, seconds, False))
+        STARTUP_SECONDS.labels(name).set(seconds)
+
+    def phase(self, name):
+        """Context manager timing one phase"""
+        return _Phase(self, name)
+
+    def milestone(self, name):
+        seconds = time.perf_counter() - self.launched
+        with self.__lock:
+            if any(entry[0] == name for entry in self.__entries):
+                return
+            self.__entries.append((name, seconds, True))
+        STARTUP_SECONDS.labels(name).set(seconds)
+        logger.info("Startup: %s %.0f ms after launch", name, seconds * 1000)
+
+    def summary(self):
+        with self.__lock:
+            entries = list(self.__entries)
+        lines = ["Startup report:"]
+        lines += [f"  {name:<28} {'at' if milestone else '  '} {seconds * 1000:8.1f} ms"
+                  for name, seconds, milestone in entries]
+        return "\n".join(lines)
+
+
+class _Phase:
+    __slots__ = ("report", "name", "started")
+
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.report.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+# Process-wide report; main.py sets `launched` before its own imports
+STARTUP = StartupReport()
@@ -1 +1,4 @@
-from .monitor import Monitor
\ No newline at end of file
+from .monitor import Monitor
+from .live_feed import EventFeed
+from .last_values import LastValueCache
+from .journal import Journal
@@ -0,0 +1,145 @@
+import time
+from tkinter import ttk
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from db import open_database
+
+WINDOWS = {
+    "15 minutes": 15 * 60,
+    "1 hour": 3600,
+    "1 day": 86400,
+    "1 week": 7 * 86400,
+    "30 days": 30 * 86400,
+}
+
+# Long windows are traced from the min and max of rollup buckets instead of every reading,
+# which would be millions of rows for a sensor reporting every second
+ROLLUP_RESOLUTIONS = {
+    "1 day": "minute",
+    "1 week": "minute",
+    "30 days": "hour",
+}
+
+
+def minmax_decimate(timestamps, values, buckets):
+    """Keep the min and max sample of each of `buckets` equal slices, in time order.
+    Spikes survive, and the result never has more than 2 * buckets points."""
+    if len(values) <= 2 * buckets:
+        return timestamps, values
+    size = len(values) // buckets
+    usable = size * buckets
+    shaped = values[:usable].reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    lows = shaped.argmin(axis=1) + offsets
+    highs = shaped.argmax(axis=1) + offsets
+    picked = np.unique(np.concatenate((lows, highs, np.arange(usable, len(values)))))
+    return timestamps[picked], values[picked]
+
+
+class ChartPanel(ttk.Frame):
+    # Plots one sensor field over a sliding time window from Database.get_series, or from
+    # Database.get_envelope for the windows in ROLLUP_RESOLUTIONS
+
+    def __init__(self, parent, db_path=None, registry=None, tick_ms=2000, shards=0):
+        super().__init__(parent)
+        self.db = open_database(db_path=db_path, registry=registry, shards=shards)
+        self.tick_ms = tick_ms
+        self.timestamps = np.empty(0)
+        self.values = np.empty(0)
+        self.sensors = {}
+        self.setup_ui()
+        self.refresh_sensors()
+        self.after(self.tick_ms, self.tick)
+
+    def setup_ui(self):
+        """Setup the chart controls and canvas"""
+        controls = ttk.Frame(self)
+        controls.pack(fill="x", pady=(0, 5))
+
+        self.sensor_box = ttk.Combobox(controls, state="readonly", width=24)
+        self.sensor_box.pack(side="left", padx=(0, 5))
+        self.sensor_box.bind("<<ComboboxSelected>>", lambda _: self.select_sensor())
+
+        self.field_box = ttk.Combobox(controls, state="readonly", width=14)
+        self.field_box.pack(side="left", padx=(0, 5))
+        self.field_box.bind("<<ComboboxSelected>>", lambda _: self.reload())
+
+        self.window_box = ttk.Combobox(controls, state="readonly", width=10, values=list(WINDOWS))
+        self.window_box.set("1 hour")
+        self.window_box.pack(side="left")
+        self.window_box.bind("<<ComboboxSelected>>", lambda _: self.reload())
+
+        figure = Figure(figsize=(5, 2.5), dpi=100)
+        self.axes = figure.add_subplot(111)
+        self.line, = self.axes.plot([], [], linewidth=1)
+        figure.autofmt_xdate()
+        self.canvas = FigureCanvasTkAgg(figure, master=self)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+
+    def refresh_sensors(self):
+        self.sensors = {f"{sensor.name} (#{sensor.id})": sensor.id for sensor in self.db.registry.sensors()}
+        self.sensor_box.configure(values=list(self.sensors))
+
+    def select_sensor(self):
+        fields = self.db.get_series_fields(self.sensors[self.sensor_box.get()])
+        self.field_box.configure(values=fields)
+        self.field_box.set(fields[0] if fields else "")
+        self.reload()
+
+    def selection(self):
+        sensor = self.sensors.get(self.sensor_box.get())
+        field = self.field_box.get()
+        return (sensor, field) if sensor is not None and field else None
+
+    def reload(self):
+        """Fetch the whole window for the current selection"""
+        selection = self.selection()
+        if selection is None:
+            return
+        now = time.time()
+        self.timestamps, self.values = self.fetch(selection, now - WINDOWS[self.window_box.get()], now + 1)
+        self.redraw(now)
+
+    def fetch(self, selection, start, end):
+        resolution = ROLLUP_RESOLUTIONS.get(self.window_box.get())
+        if resolution is None:
+            return self.db.get_series(*selection, start, end)
+        return self.db.get_envelope(*selection, start, end, resolution)
+
+    def tick(self):
+        """Append only readings newer than the last one plotted and drop those that left the window"""
+        selection = self.selection()
+        if selection is not None:
+            now = time.time()
+            window = self.window_box.get()
+            if not len(self.timestamps):
+                since = now - WINDOWS[window]
+            elif window in ROLLUP_RESOLUTIONS:
+                # The last bucket is still filling, so it is fetched again
+                since = self.timestamps[-1]
+            else:
+                since = self.timestamps[-1] + 1e-6
+            new_timestamps, new_values = self.fetch(selection, since, now + 1)
+            start = np.searchsorted(self.timestamps, now - WINDOWS[window])
+            stop = np.searchsorted(self.timestamps, since)
+            if len(new_timestamps) or start or stop < len(self.timestamps):
+                self.timestamps = np.concatenate((self.timestamps[start:stop], new_timestamps))
+                self.values = np.concatenate((self.values[start:stop], new_values))
+                self.redraw(now)
+        self.after(self.tick_ms, self.tick)
+
+    def redraw(self, now):
+        # Reuse the existing line; at most two points per horizontal pixel are handed to matplotlib
+        width = max(self.canvas.get_tk_widget().winfo_width(), 100)
+        timestamps, values = minmax_decimate(self.timestamps, self.values, width)
+        self.line.set_data((timestamps * 1000).astype("datetime64[ms]"), values)
+        window = WINDOWS[self.window_box.get()]
+        self.axes.set_xlim(np.datetime64(int((now - window) * 1000), "ms"), np.datetime64(int(now * 1000), "ms"))
+        if len(values):
+            low, high = float(values.min()), float(values.max())
+            margin = (high - low) * 0.05 or 1.0
+            self.axes.set_ylim(low - margin, high + margin)
+        self.canvas.draw_idle()
@@ -0,0 +1,49 @@
+import json
+from tkinter import ttk
+
+
+class CurrentValuesPanel(ttk.Frame):
+    # Current state of the house from a LastValueCache; each refresh touches only the
+    # rows that changed since the previous one and runs no SQL
+
+    def __init__(self, parent, last_values, registry=None, refresh_ms=1000):
+        super().__init__(parent)
+        self.last_values = last_values
+        self.registry = registry
+        self.refresh_ms = refresh_ms
+        self.version = 0
+        self.rows = {}
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        """Setup the current values table"""
+        header = ttk.Label(self, text="🏡 Current State", font=("Segoe UI", 12))
+        header.pack(pady=(10, 5))
+
+        columns = ("Name", "Value", "Updated")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=8)
+        for column in columns:
+            self.tree.heading(column, text=column)
+        self.tree.column("Name", width=160)
+        self.tree.column("Value", width=180)
+        self.tree.column("Updated", width=130)
+        self.tree.pack(fill="both", expand=True)
+
+    def name_of(self, source_type, source_id):
+        entity = None
+        if self.registry is not None:
+            entity = self.registry.sensor(source_id) if source_type == "sensor" else self.registry.device(source_id)
+        return entity.name if entity else f"{source_type} #{source_id}"
+
+    def refresh(self):
+        self.version, changed = self.last_values.changed_since(self.version)
+        for key, payload, timestamp in changed:
+            shown = json.dumps({field: value for field, value in payload.items()
+                                if field not in ("sensor_id", "device_id")})
+            item = self.rows.get(key)
+            if item is None:
+                self.rows[key] = self.tree.insert("", "end", values=(self.name_of(*key), shown, timestamp))
+            else:
+                self.tree.item(item, values=(self.tree.set(item, "Name"), shown, timestamp))
+        self.after(self.refresh_ms, self.refresh)
@@ -0,0 +1,249 @@
+from datetime import datetime
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from codec import JSON, detect
+from db import Database
+from db.retention import TIMESTAMP_FORMAT
+from metrics import REGISTRY, STARTUP
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = REGISTRY.gauge("smarthome_queue_depth", "Items waiting in an internal queue", ("queue",))
+BATCH_SIZE = REGISTRY.histogram("smarthome_ingest_batch_size", "Events written per ingest transaction",
+                                buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+EVENTS_DROPPED = REGISTRY.counter("smarthome_events_dropped_total", "Ingested events that were never written",
+                                  ("reason",))
+_REJECTED = EVENTS_DROPPED.labels("rejected")
+
+# Pause before writing a batch again after a transient error, doubling up to the maximum
+RETRY_MIN_SECONDS = 0.1
+RETRY_MAX_SECONDS = 5.0
+# Failed writes of the last batch before stop() gives up on it
+SHUTDOWN_RETRIES = 5
+
+
+def retry_pause(failures):
+    return min(RETRY_MAX_SECONDS, RETRY_MIN_SECONDS * 2 ** (failures - 1))
+
+_STOP = object()
+
+
+def write_events(db, batch, checkpoint=None, seqs=None):
+    """db.log_events(batch, checkpoint), dropping any event the database rejects instead of the
+    whole batch. `seqs` are the events' journal sequence numbers, committed with each of them
+    when they have to be written one at a time. Returns the events written, or None when a
+    transient error (locked, busy, out of disk) means the batch should be retried."""
+    try:
+        db.log_events(batch, checkpoint)
+        return batch
+    except sqlite3.OperationalError as e:
+        logger.error("Could not write %d events: %s", len(batch), e)
+        return None
+    except sqlite3.Error as e:
+        logger.error("Could not write %d events, writing them one at a time: %s", len(batch), e)
+    # Retrying a rejected event can never succeed, so it must not hold up the ones after it
+    written = []
+    try:
+        for index, event in enumerate(batch):
+            try:
+                db.log_events([event], seqs[index] if seqs is not None else None)
+                written.append(event)
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.Error as e:
+                logger.error("Dropping event from %s %r: %s", event[0], event[1], e)
+                _REJECTED.inc()
+        if checkpoint is not None:
+            db.log_events([], checkpoint)
+    except sqlite3.OperationalError as e:
+        logger.error("Could not write events: %s", e)
+        return None
+    return written
+
+
+class EventWriter:
+    # Background ingest writer: owns one long-lived connection and flushes queued
+    # events with executemany, every `batch_size` events or every `flush_interval_ms`.
+    # A LastValueCache given as `last_values` is written back every `last_value_interval_ms`.
+    # With a Journal, submit() appends to it instead of the queue and never blocks; the
+    # writer applies the journal in order and commits its position with each batch.
+
+    def __init__(self, db_path=None, batch_size=500, flush_interval_ms=200, max_queue=10000, put_timeout=1.0,
+                 feed=None, last_values=None, last_value_interval_ms=1000, journal=None):
+        self.__db_path = db_path
+        self.__journal = journal
+        self.__feed = feed
+        self.__last_values = last_values
+        self.__last_value_interval = last_value_interval_ms / 1000
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval_ms / 1000
+        self.__put_timeout = put_timeout
+        self.__queue = queue.Queue(maxsize=max_queue)
+        self.__stopping = threading.Event()
+        self.__thread = None
+        QUEUE_DEPTH.labels("ingest").set_function(self.pending)
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stopping.clear()
+        run = self.__run if self.__journal is None else self.__run_journal
+        self.__thread = threading.Thread(target=run, name="EventWriter", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stopping.set()
+        self.__queue.put(_STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def submit(self, source_type, source_id, payload, raw=None):
+        """Queue a decoded event; returns False if the queue stayed full and the event was dropped.
+        `raw` is the payload as received, which is what the journal and the events table store.
+        The event is logged with the time it was submitted, however long it waits to be written."""
+        received = time.time()
+        if self.__journal is not None:
+            try:
+                self.__journal.append(source_type, source_id, raw if raw is not None else JSON.encode(payload),
+                                      received)
+                return True
+            except (OSError, ValueError) as e:
+                logger.error("Could not append to the ingest journal: %s", e)
+                return False
+        try:
+            self.__queue.put((source_type, source_id, payload, raw, received), timeout=self.__put_timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        return self.__queue.qsize() if self.__journal is None else self.__journal.pending()
+
+    def __run(self):
+        with STARTUP.phase("ingest database open"):
+            db = Database(db_path=self.__db_path)
+        last_values = self.__last_values
+        if last_values is not None:
+            last_values.seed(db.get_last_values())
+        batch = []
+        deadline = None
+        # After a failed write the batch is kept and written again at retry_at
+        retry_at, failures = 0.0, 0
+        sync_deadline = time.monotonic() + self.__last_value_interval
+        running = True
+        while running or batch:
+            if running and len(batch) < self.__batch_size:
+                deadlines = [max(deadline, retry_at)] if batch else []
+                if last_values is not None and last_values.has_dirty():
+                    deadlines.append(sync_deadline)
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                try:
+                    item = self.__queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                # Drain whatever is already waiting so bursts land in one transaction
+                while item is not None:
+                    if item is _STOP:
+                        running = False
+                        break
+                    if not batch:
+                        deadline = time.monotonic() + self.__flush_interval
+                    batch.append(item)
+                    if len(batch) >= self.__batch_size:
+                        break
+                    try:
+                        item = self.__queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+            else:
+                # A full batch, or the last one at shutdown, waiting to be written again
+                time.sleep(max(0.0, retry_at - time.monotonic()))
+
+            now = time.monotonic()
+            if batch and now >= retry_at and (not running or len(batch) >= self.__batch_size or now >= deadline):
+                if self.__flush(db, batch):
+                    batch, failures = [], 0
+                elif (not running or self.__stopping.is_set()) and failures >= SHUTDOWN_RETRIES:
+                    logger.error("Dropping %d events at shutdown after %d failed writes", len(batch), failures + 1)
+                    EVENTS_DROPPED.labels("shutdown").inc(len(batch))
+                    batch = []
+                else:
+                    # Locked, busy or out of disk: keep the batch; the queue fills up meanwhile and
+                    # submit() reports that, rather than events disappearing here
+                    failures += 1
+                    retry_at = now + retry_pause(failures)
+
+            if last_values is not None and (not running or time.monotonic() >= sync_deadline):
+                self.__sync_last_values(db, last_values)
+                sync_deadline = time.monotonic() + self.__last_value_interval
+        db.close()
+
+    def __run_journal(self):
+        with STARTUP.phase("ingest database open"):
+            db = Database(db_path=self.__db_path)
+        journal, last_values = self.__journal, self.__last_values
+        if last_values is not None:
+            last_values.seed(db.get_last_values())
+        # Records up to the checkpoint were committed before the last shutdown or crash
+        journal.seek(db.get_journal_checkpoint())
+        sync_deadline = time.monotonic() + self.__last_value_interval
+        while True:
+            records = journal.read(self.__batch_size)
+            if records:
+                batch, seqs = [], []
+                for seq, source_type, source_id, raw, received in records:
+                    try:
+                        batch.append((source_type, source_id, detect(raw).decode(raw), raw, received))
+                        seqs.append(seq)
+                    except ValueError:
+                        logger.warning("Skipping undecodable journal record %d", seq)
+                        EVENTS_DROPPED.labels("undecodable").inc()
+                if self.__flush(db, batch, records[-1][0], seqs):
+                    journal.discard(records[-1][0])
+                else:
+                    # Read again from the last committed record after a pause
+                    journal.seek(db.get_journal_checkpoint())
+                    if self.__stopping.wait(self.__flush_interval):
+                        break
+
+            if last_values is not None and (self.__stopping.is_set() or time.monotonic() >= sync_deadline):
+                self.__sync_last_values(db, last_values)
+                sync_deadline = time.monotonic() + self.__last_value_interval
+            if len(records) < self.__batch_size:
+                if self.__stopping.is_set():
+                    break
+                journal.flush()
+                self.__stopping.wait(self.__flush_interval)
+        db.close()
+
+    @staticmethod
+    def __sync_last_values(db, last_values):
+        rows = last_values.take_dirty()
+        if not rows:
+            return
+        try:
+            db.update_last_values(rows)
+        except sqlite3.Error as e:
+            logger.error("Could not write %d last values: %s", len(rows), e)
+
+    def __flush(self, db, batch, checkpoint=None, seqs=None):
+        # `seqs` are the journal sequence numbers of the events in `batch`
+        batch = write_events(db, batch, checkpoint, seqs)
+        if batch is None:
+            return False
+        BATCH_SIZE.observe(len(batch))
+        timestamp = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        if self.__last_values is not None:
+            self.__last_values.update_many(batch, timestamp)
+        if self.__feed is not None:
+            # Same shape as events rows; the row id is not needed by live views
+            self.__feed.publish_many([(None, source_type, source_id, payload, timestamp)
+                                      for source_type, source_id, payload, *_ in batch])
+        return True
@@ -0,0 +1,204 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# length of the body, crc32 of seq + body, seq
+_HEADER = struct.Struct("<IIQ")
+# source_id, receive time in epoch seconds, length of source_type; followed by source_type
+# and the raw payload bytes
+_BODY = struct.Struct("<qdB")
+_SEQ = struct.Struct("<Q")
+
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+def _segment_name(first_seq):
+    return f"{first_seq:020d}.journal"
+
+
+class _Segment:
+    # One preallocated, memory-mapped journal file. Unwritten space is zeros, so the first
+    # header with length 0 (or a bad checksum after a crash) marks the end of the data.
+
+    def __init__(self, path, first_seq, size=None):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = first_seq - 1
+        self.end = 0
+        with open(path, "r+b" if size is None else "w+b") as f:
+            if size is not None:
+                f.truncate(size)
+            self.size = os.fstat(f.fileno()).st_size
+            self.map = mmap.mmap(f.fileno(), self.size)
+
+    def scan(self):
+        """Find the last intact record after a restart; a torn final write is ignored"""
+        offset, expected = 0, self.first_seq
+        while True:
+            record = self.record_at(offset)
+            if record is None or record[0] != expected:
+                break
+            offset = record[2]
+            self.last_seq = expected
+            expected += 1
+        self.end = offset
+
+    def record_at(self, offset):
+        """(seq, body, next offset) of the record at `offset`, or None if there is no valid one"""
+        if offset + _HEADER.size > self.size:
+            return None
+        length, crc, seq = _HEADER.unpack_from(self.map, offset)
+        start = offset + _HEADER.size
+        if length == 0 or start + length > self.size:
+            return None
+        body = self.map[start:start + length]
+        if zlib.crc32(body, zlib.crc32(_SEQ.pack(seq))) != crc:
+            return None
+        return seq, body, start + length
+
+    def write(self, seq, body):
+        offset = self.end
+        start = offset + _HEADER.size
+        self.map[start:start + len(body)] = body
+        _HEADER.pack_into(self.map, offset, len(body), zlib.crc32(body, zlib.crc32(_SEQ.pack(seq))), seq)
+        # Readers in this process stop at `end`, so it moves only once the record is complete
+        self.last_seq = seq
+        self.end = start + len(body)
+
+    def close(self):
+        self.map.close()
+
+
+class Journal:
+    # Append-only ingest journal in `directory`. Monitor appends raw messages at memory
+    # speed; one consumer (the EventWriter) reads them back in order, applies them to
+    # SQLite and discards the segments it has applied. Records survive a process crash
+    # once appended; flush() also makes them survive a power loss.
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.__segment_size = segment_size
+        self.__lock = threading.Lock()
+        self.__segments = []
+        os.makedirs(directory, exist_ok=True)
+
+        next_seq = 1
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".journal"):
+                continue
+            segment = _Segment(os.path.join(directory, name), int(name.split(".")[0]))
+            segment.scan()
+            next_seq = max(next_seq, segment.last_seq + 1)
+            if segment.end:
+                self.__segments.append(segment)
+            else:
+                segment.close()
+                os.remove(segment.path)
+        if self.__segments:
+            logger.info("Recovered %d journal records in %d segments",
+                        self.__segments[-1].last_seq - self.__segments[0].first_seq + 1, len(self.__segments))
+
+        self.__next_seq = next_seq
+        self.__recovered_seq = next_seq - 1
+        self.__active = self.__open_segment(next_seq, segment_size)
+        self.__cursor = (self.__segments[0], 0)
+        self.__applied = self.__segments[0].first_seq - 1
+
+    @property
+    def last_seq(self):
+        return self.__next_seq - 1
+
+    def pending(self):
+        """Records appended but not yet read back by the consumer"""
+        return self.__next_seq - 1 - self.__applied
+
+    def append(self, source_type, source_id, payload, received=None):
+        """Append one event with its raw payload bytes, received at `received` epoch seconds
+        (now by default); returns its sequence number. `source_id` must be an int."""
+        source_type = source_type.encode()
+        try:
+            header = _BODY.pack(source_id, time.time() if received is None else received, len(source_type))
+        except struct.error as e:
+            raise ValueError(f"Cannot journal {source_type.decode()} id {source_id!r}: {e}") from None
+        body = header + source_type + payload
+        with self.__lock:
+            if self.__active.end + _HEADER.size + len(body) > self.__active.size:
+                self.__active = self.__open_segment(self.__next_seq,
+                                                    max(self.__segment_size, 2 * (_HEADER.size + len(body))))
+            seq = self.__next_seq
+            self.__active.write(seq, body)
+            self.__next_seq = seq + 1
+        return seq
+
+    def seek(self, seq):
+        """Move the consumer past every record up to and including `seq`"""
+        with self.__lock:
+            segments = list(self.__segments)
+        if seq > self.__recovered_seq:
+            # The journal directory was removed or replaced; nothing in it has been applied
+            logger.warning("Journal checkpoint %d is ahead of the journal (%d); replaying it all",
+                           seq, self.__recovered_seq)
+            seq = segments[0].first_seq - 1
+        segment = segments[0]
+        for candidate in segments:
+            if candidate.first_seq > seq + 1:
+                break
+            segment = candidate
+        self.__cursor = (segment, 0)
+        self.__applied = segment.first_seq - 1
+        while self.__applied < seq and self.read(min(seq - self.__applied, 10000)):
+            pass
+
+    def read(self, limit):
+        """Up to `limit` (seq, source_type, source_id, payload bytes, received) records after the consumer's position"""
+        segment, offset = self.__cursor
+        records = []
+        while len(records) < limit:
+            if offset < segment.end:
+                seq, body, offset = segment.record_at(offset)
+                source_id, received, type_length = _BODY.unpack_from(body)
+                start = _BODY.size + type_length
+                records.append((seq, body[_BODY.size:start].decode(), source_id, body[start:], received))
+                continue
+            with self.__lock:
+                segments = self.__segments
+                position = segments.index(segment)
+                if position + 1 == len(segments):
+                    break
+                segment, offset = segments[position + 1], 0
+        self.__cursor = (segment, offset)
+        if records:
+            self.__applied = records[-1][0]
+        return records
+
+    def discard(self, seq):
+        """Delete segments whose records are all applied up to `seq`; the active segment is kept"""
+        with self.__lock:
+            current = self.__cursor[0]
+            while len(self.__segments) > 1 and self.__segments[0].last_seq <= seq and self.__segments[0] is not current:
+                segment = self.__segments.pop(0)
+                segment.close()
+                os.remove(segment.path)
+
+    def flush(self):
+        """msync the active segment so appended records also survive a power loss"""
+        self.__active.map.flush()
+
+    def close(self):
+        with self.__lock:
+            for segment in self.__segments:
+                segment.map.flush()
+                segment.close()
+            self.__segments = []
+
+    def __open_segment(self, first_seq, size):
+        # Called with the lock held, or from __init__
+        segment = _Segment(os.path.join(self.directory, _segment_name(first_seq)), first_seq, size)
+        self.__segments.append(segment)
+        return segment
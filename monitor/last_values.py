@@ -0,0 +1,80 @@
+import threading
+
+
+class LastValueCache:
+    # Most recent payload of every sensor and merged state of every device, kept in memory
+    # for the GUI and services. Changes are marked dirty and written back to
+    # sensors.last_payload / devices.current_status by the EventWriter, coalesced per entity.
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__values = {}
+        # key -> version of its last change, kept in change order for changed_since
+        self.__changes = {}
+        self.__version = 0
+        self.__dirty = set()
+
+    def __len__(self):
+        return len(self.__values)
+
+    @property
+    def version(self):
+        return self.__version
+
+    def seed(self, rows):
+        """Load (source_type, source_id, payload, timestamp) rows stored by an earlier run; newer values win"""
+        with self.__lock:
+            for source_type, source_id, payload, timestamp in rows:
+                key = (source_type, source_id)
+                if key not in self.__values:
+                    self.__values[key] = (payload, timestamp)
+                    self.__touch(key)
+
+    def update_many(self, events, timestamp):
+        """Record (source_type, source_id, payload[, raw]) events logged at `timestamp`"""
+        with self.__lock:
+            for source_type, source_id, payload, *_ in events:
+                key = (source_type, source_id)
+                if source_type == "device":
+                    # Commands and status reports carry only the fields they change
+                    previous = self.__values.get(key)
+                    state = dict(previous[0]) if previous is not None else {}
+                    state.update((field, value) for field, value in payload.items() if field != "device_id")
+                    payload = state
+                self.__values[key] = (payload, timestamp)
+                self.__dirty.add(key)
+                self.__touch(key)
+
+    def get(self, source_type, source_id):
+        """(payload, timestamp) of an entity, or None"""
+        return self.__values.get((source_type, source_id))
+
+    def snapshot(self):
+        with self.__lock:
+            return dict(self.__values)
+
+    def changed_since(self, version):
+        """(current version, [(key, payload, timestamp)]) for entities changed after `version`;
+        costs one step per changed entity, not per entity."""
+        with self.__lock:
+            changed = []
+            for key in reversed(self.__changes):
+                if self.__changes[key] <= version:
+                    break
+                changed.append((key, *self.__values[key]))
+            return self.__version, changed
+
+    def has_dirty(self):
+        return bool(self.__dirty)
+
+    def take_dirty(self):
+        """Entities changed since the last call as (source_type, source_id, payload, timestamp) rows"""
+        with self.__lock:
+            dirty, self.__dirty = self.__dirty, set()
+            return [(source_type, source_id, *self.__values[(source_type, source_id)])
+                    for source_type, source_id in dirty]
+
+    def __touch(self, key):
+        self.__version += 1
+        self.__changes.pop(key, None)
+        self.__changes[key] = self.__version
@@ -0,0 +1,37 @@
+from collections import deque
+import threading
+
+
+class EventFeed:
+    # Thread-safe ring buffer of newly logged events. Writers publish from the ingest
+    # thread; readers keep a sequence cursor and pull only what they have not seen.
+    # A reader that falls more than `capacity` events behind skips the oldest ones.
+
+    def __init__(self, capacity=5000):
+        self.__events = deque(maxlen=capacity)
+        self.__lock = threading.Lock()
+        self.__seq = 0
+
+    @property
+    def last_seq(self):
+        return self.__seq
+
+    def publish(self, event):
+        self.publish_many((event,))
+
+    def publish_many(self, events):
+        with self.__lock:
+            for event in events:
+                self.__seq += 1
+                self.__events.append((self.__seq, event))
+
+    def read_since(self, seq):
+        """Returns (latest_seq, events newer than seq, oldest first)"""
+        with self.__lock:
+            newer = []
+            for event_seq, event in reversed(self.__events):
+                if event_seq <= seq:
+                    break
+                newer.append(event)
+            newer.reverse()
+            return self.__seq, newer
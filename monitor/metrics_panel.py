@@ -0,0 +1,56 @@
+from tkinter import ttk
+
+from metrics import REGISTRY
+
+
+class MetricsPanel(ttk.Frame):
+    # Live view of the in-process metrics registry; histograms show count and mean
+
+    def __init__(self, parent, registry=REGISTRY, refresh_ms=1000):
+        super().__init__(parent)
+        self.registry = registry
+        self.refresh_ms = refresh_ms
+        self.rows = {}
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        """Setup the metrics table"""
+        header = ttk.Label(self, text="📈 Metrics", font=("Segoe UI", 12))
+        header.pack(pady=(10, 5))
+
+        columns = ("Metric", "Value")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=8)
+        self.tree.heading("Metric", text="Metric")
+        self.tree.heading("Value", text="Value")
+        self.tree.column("Metric", width=260)
+        self.tree.column("Value", width=140, anchor="e")
+        self.tree.pack(fill="both", expand=True)
+
+    def samples(self):
+        for metric in self.registry.metrics():
+            short_name = metric.name.removeprefix("smarthome_")
+            if metric.kind != "histogram":
+                for _, labels, value in metric.samples():
+                    yield short_name + labels, f"{value:g}"
+                continue
+            totals = {}
+            for name, labels, value in metric.samples():
+                if name.endswith(("_sum", "_count")):
+                    totals.setdefault(labels, {})[name.rsplit("_", 1)[1]] = value
+            for labels, total in totals.items():
+                if total["count"]:
+                    mean = total["sum"] / total["count"]
+                    shown = f"{mean * 1000:.3f} ms" if metric.name.endswith("_seconds") else f"{mean:.1f}"
+                    # The count changes with every observation, so it belongs with the value, not the key
+                    yield short_name + labels, f"{shown} (n={total['count']})"
+
+    def refresh(self):
+        """Update values in place; rows are only inserted for newly seen series"""
+        for key, value in self.samples():
+            item = self.rows.get(key)
+            if item is None:
+                self.rows[key] = self.tree.insert("", "end", values=(key, value))
+            else:
+                self.tree.set(item, "Value", value)
+        self.after(self.refresh_ms, self.refresh)
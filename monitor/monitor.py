@@ -1,33 +1,40 @@
-import json
-import paho.mqtt.client as paho
-from paho import mqtt
-from db import Database
+import logging
 
+from .event_writer import EventWriter
+from .sharded_writer import ShardedWriter
+
+logger = logging.getLogger(__name__)
 
-class Monitor:
-    def __init__(self, client_id, protocol, db_path=None):
-        self.__db_path = db_path
-        self.__client = paho.Client(client_id=client_id, protocol=protocol, userdata=None)
-        self.__client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
 
-        def on_connect(client, userdata, flags, rc, properties=None):
-            print(f"MONITOR: CONNACK received with code {rc}")
-            client.subscribe("+/get", qos=1)
-            print("MONITOR: Subscribed to topic '+/get'")
+def entity_id(value):
+    """A sensor_id or device_id from a payload as the int the database and the journal key
+    events by, or None if it is not one; numeric strings like "1" are accepted"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+    if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+        return None
+    return value
 
-            client.subscribe("+/send", qos=1)
-            print("MONITOR: Subscribed to topic '+/send'")
 
-        def on_subscribe(client, userdata, mid, granted_qos, properties=None):
-            print(f"MONITOR: Subscribed: {mid} {granted_qos}")
+class Monitor:
+    def __init__(self, transport, db_path=None, feed=None, last_values=None, journal=None, shards=0):
+        if shards and journal is not None:
+            raise ValueError("Sharded ingest does not use the journal; pass one or the other")
+        if shards:
+            self.__writer = ShardedWriter(db_path=db_path, shards=shards, feed=feed, last_values=last_values)
+        else:
+            self.__writer = EventWriter(db_path=db_path, feed=feed, last_values=last_values, journal=journal)
 
-        def on_message(client, userdata, msg):
-            print(f"MONITOR: Received message: {msg.topic} {msg.payload}")
-            
-            db = Database(db_path=self.__db_path)
+        def on_message(topic, payload_data, msg):
+            logger.debug("Received message: %s %s", topic, msg.payload)
 
             try:
-                payload_data = json.loads(msg.payload)
+                source_type, source_id = None, None
 
                 if "sensor_id" in payload_data:
                     source_id = payload_data["sensor_id"]
@@ -36,29 +43,30 @@ class Monitor:
                     source_id = payload_data["device_id"]
                     source_type = "device"
 
-                if source_type and source_id is not None:   
-                    db.log_event(source_type, source_id, payload_data)
-                    print(f"MONITOR: Logged event from {source_type} {source_id}.")
+                if source_type and entity_id(source_id) is None:
+                    logger.warning("Invalid %s_id %r. Not logging.", source_type, source_id)
+                elif source_type:
+                    source_id = entity_id(source_id)
+                    if self.__writer.submit(source_type, source_id, payload_data, msg.payload):
+                        logger.debug("Queued event from %s %s.", source_type, source_id)
+                    else:
+                        logger.warning("Ingest queue full. Dropped event from %s %s.", source_type, source_id)
                 else:
-                    print("MONITOR: 'sensor_id' or 'device_id' not in payload. Not logging.")
+                    logger.debug("'sensor_id' or 'device_id' not in payload. Not logging.")
 
-            except json.JSONDecodeError:
-                print(f"MONITOR: Error: Could not decode JSON payload from topic {msg.topic}")
-            except Exception as e:
-                print(f"MONITOR: An error occurred while logging event: {e}")
+            except Exception:
+                logger.exception("An error occurred while logging event")
 
-        self.__client.on_connect = on_connect
-        self.__client.on_subscribe = on_subscribe
-        self.__client.on_message = on_message
+        transport.subscribe("+/get", on_message, qos=1)
+        logger.info("Subscribed to topic '+/get'")
 
-    def connect(self, host, port, username, password):
-        self.__client.username_pw_set(username, password)
-        self.__client.connect(host, port)
+        transport.subscribe("+/send", on_message, qos=1)
+        logger.info("Subscribed to topic '+/send'")
 
     def start(self):
-        print("MONITOR: Starting loop...")
-        self.__client.loop_start()
+        logger.info("Starting writer...")
+        self.__writer.start()
 
     def stop(self):
-        print("MONITOR: Stopping loop...")
-        self.__client.loop_stop()
\ No newline at end of file
+        logger.info("Stopping writer...")
+        self.__writer.stop()
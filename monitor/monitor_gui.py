@@ -1,85 +1,318 @@
 import json
+import logging
+import time
 from tkinter import ttk
-from db.database import Database
+from db import open_database
+
+logger = logging.getLogger(__name__)
+
+# Fetch the next page once the visible rows are this close to either end of the window
+SCROLL_MARGIN = 0.1
+# Stands in for the id of live rows, which have none, when paging below them
+MAX_ID = 2 ** 63 - 1
 
 
 class MonitorGUI(ttk.Frame):
-    # Monitor component for displaying smart home events
-    
-    def __init__(self, parent, db_path=None):
+    # Monitor component for displaying smart home events. The list is a window of at
+    # most `max_rows` rows over the events table: pages of `page_size` are fetched with
+    # keyset cursors as the view nears either end, and rows beyond the window are dropped.
+
+    def __init__(self, parent, db_path=None, feed=None, registry=None, max_rows=200, tick_ms=250, shards=0,
+                 page_size=50):
         super().__init__(parent)
-        self.db = Database(db_path=db_path)
+        self.db = open_database(db_path=db_path, registry=registry, shards=shards)
+        self.feed = feed
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.tick_ms = tick_ms
+        self.feed_seq = 0
+        self.filters = {}
+        self.cursors = {}           # Treeview item -> (timestamp, id) of its event; id is None for live rows
+        self.at_head = True         # The newest matching event is in the window
+        self.at_tail = True         # The oldest matching event is in the window
+        self.fetch_pending = False
         self.setup_ui()
         self.load_events()
-    
+        if self.feed is not None:
+            self.after(self.tick_ms, self.poll_feed)
+
     def setup_ui(self):
         """Setup the monitor interface"""
         # Header
-        header = ttk.Label(self, text="📊 Recent Events", font=("Segoe UI", 14, "bold"))
+        header = ttk.Label(self, text="📊 Events", font=("Segoe UI", 14, "bold"))
         header.pack(pady=(0, 10))
-        
+
+        # Filters
+        filters = ttk.Frame(self)
+        filters.pack(fill="x", pady=(0, 5))
+
+        ttk.Label(filters, text="Type").pack(side="left")
+        self.type_box = ttk.Combobox(filters, state="readonly", width=7, values=("", "sensor", "device"))
+        self.type_box.pack(side="left", padx=(2, 8))
+
+        ttk.Label(filters, text="ID").pack(side="left")
+        self.source_entry = ttk.Entry(filters, width=5)
+        self.source_entry.pack(side="left", padx=(2, 8))
+
+        ttk.Label(filters, text="Category").pack(side="left")
+        self.category_box = ttk.Combobox(filters, width=11, postcommand=self.refresh_categories)
+        self.category_box.pack(side="left", padx=(2, 8))
+
+        ttk.Label(filters, text="Action").pack(side="left")
+        self.action_entry = ttk.Entry(filters, width=8)
+        self.action_entry.pack(side="left", padx=(2, 8))
+
+        ttk.Label(filters, text="From").pack(side="left")
+        self.start_entry = ttk.Entry(filters, width=19)
+        self.start_entry.pack(side="left", padx=(2, 8))
+
+        ttk.Label(filters, text="To").pack(side="left")
+        self.end_entry = ttk.Entry(filters, width=19)
+        self.end_entry.pack(side="left", padx=(2, 8))
+
+        ttk.Button(filters, text="Apply", command=self.apply_filters).pack(side="left")
+
         # Frame for treeview and scrollbar
         tree_frame = ttk.Frame(self)
         tree_frame.pack(fill="both", expand=True, pady=5)
-        
+
         # Treeview
         columns = ("Type", "Topic", "Payload", "Time")
         self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=12)
-        
+
         # Configure columns
         self.tree.heading("Type", text="Type")
         self.tree.heading("Topic", text="Topic")
         self.tree.heading("Payload", text="Payload")
         self.tree.heading("Time", text="Time")
-        
+
         self.tree.column("Type", width=80)
         self.tree.column("Topic", width=200)
         self.tree.column("Payload", width=180)
         self.tree.column("Time", width=140)
-        
+
         # Scrollbar
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
-        
+        self.scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscroll=self.on_scroll)
+
         # Pack tree and scrollbar
         self.tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        
-        # Refresh button
+        self.scrollbar.pack(side="right", fill="y")
+
+        # Refresh button and status line
         refresh_btn = ttk.Button(self, text="🔄 Refresh", command=self.load_events)
         refresh_btn.pack(pady=5)
-    
+        self.status = ttk.Label(self, text="")
+        self.status.pack()
+
+    def refresh_categories(self):
+        categories = {entity.category for entity in self.db.registry.sensors() + self.db.registry.devices()}
+        self.category_box.configure(values=["", *sorted(categories)])
+
+    def apply_filters(self):
+        """Read the filter controls and reload from the newest matching event"""
+        filters = {
+            "source_type": self.type_box.get() or None,
+            "category": self.category_box.get().strip() or None,
+            "action": self.action_entry.get().strip() or None,
+            "start": self.start_entry.get().strip() or None,
+            "end": self.end_entry.get().strip() or None,
+        }
+        source_id = self.source_entry.get().strip()
+        if source_id:
+            try:
+                filters["source_id"] = int(source_id)
+            except ValueError:
+                self.status.configure(text=f"Invalid ID: {source_id}")
+                return
+        self.filters = {key: value for key, value in filters.items() if value is not None}
+        self.load_events()
+
     def load_events(self):
-        """Load recent events from database"""
+        """Load the newest events matching the filters"""
+        # Events published before this reload are already part of the query result
+        if self.feed is not None:
+            self.feed_seq = self.feed.last_seq
+
         # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
+        self.tree.delete(*self.tree.get_children())
+        self.cursors.clear()
+
         # Fetch events
-        events = self.db.get_recent_events(limit=50)
-        
+        events = self.db.get_events_page(limit=self.page_size, **self.filters)
+        self.at_head = True
+        self.at_tail = len(events) < self.page_size
+
         # Populate treeview
+        self.insert_rows(events, "end")
+        self.show_status()
+
+    def on_scroll(self, first, last):
+        """Treeview scroll callback: update the scrollbar and fetch a page when near an end of the window"""
+        self.scrollbar.set(first, last)
+        if self.fetch_pending:
+            return
+        if float(last) > 1 - SCROLL_MARGIN and not self.at_tail:
+            self.fetch_pending = True
+            self.after_idle(self.load_older)
+        elif float(first) < SCROLL_MARGIN and not self.at_head:
+            self.fetch_pending = True
+            self.after_idle(self.load_newer)
+
+    def load_older(self):
+        """Append the page after the bottom row and drop rows above the window"""
+        self.fetch_pending = False
+        children = self.tree.get_children()
+        if not children:
+            return
+        # Below only live rows: page from the oldest of them, which may repeat a few events of that second
+        cursor = self.edge_cursor(reversed(children)) or (self.cursors[children[-1]][0], MAX_ID)
+        top = self.top_index()
+        # A page can hold only events that are not displayed; keep going so scrolling never stalls on one
+        while True:
+            events = self.db.get_events_page(before=cursor, limit=self.page_size, **self.filters)
+            self.at_tail = len(events) < self.page_size
+            if self.insert_rows(events, "end") or self.at_tail:
+                break
+            cursor = (events[-1][4], events[-1][0])
+
+        children = self.tree.get_children()
+        drop = max(0, len(children) - self.max_rows)
+        # Rows from the live feed carry no id to page from; the window starts below them
+        while drop and drop < len(children) and self.cursors[children[drop]][1] is None:
+            drop += 1
+        if drop:
+            self.remove_rows(children[:drop])
+            self.at_head = False
+        self.scroll_to(top - drop)
+        self.show_status()
+
+    def load_newer(self):
+        """Prepend the page before the top row and drop rows below the window"""
+        self.fetch_pending = False
+        cursor = self.edge_cursor(self.tree.get_children())
+        if cursor is None:
+            return
+        seq = self.feed.last_seq if self.feed is not None else 0
+        top = self.top_index()
+        while True:
+            events = self.db.get_events_page(after=cursor, limit=self.page_size, **self.filters)
+            added = self.insert_rows(events, 0)
+            if added or len(events) < self.page_size:
+                break
+            cursor = (events[0][4], events[0][0])
+        if len(events) < self.page_size:
+            # Back at the newest event; the live feed takes over from here
+            self.at_head = True
+            self.feed_seq = seq
+
+        children = self.tree.get_children()
+        if len(children) > self.max_rows:
+            self.remove_rows(children[self.max_rows:])
+            self.at_tail = False
+        self.scroll_to(top + added)
+        self.show_status()
+
+    def poll_feed(self):
+        """Apply events published since the last tick as deltas: newest on top, trimmed tail"""
+        started = time.perf_counter()
+        self.feed_seq, events = self.feed.read_since(self.feed_seq)
+
+        # Scrolled away from the newest events: these are fetched from the database on the way back
+        if self.at_head:
+            # Under burst load only the newest rows can stay on screen, so skip the rest
+            events = [event for event in events[-self.max_rows:] if self.matches(event)]
+            for event in events:
+                self.insert_rows((event,), 0)
+
+            children = self.tree.get_children()
+            if len(children) > self.max_rows:
+                self.remove_rows(children[self.max_rows:])
+                self.at_tail = False
+
+        # Back off when applying a tick gets expensive so the Tk main loop stays responsive
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.after(max(self.tick_ms, int(elapsed_ms * 4)), self.poll_feed)
+
+    def insert_rows(self, events, index):
+        """Insert events, newest first, at the top (0) or the bottom ("end"); returns the number of rows added"""
+        added = 0
         for event in events:
-            event_id, source_type, source_id, payload, timestamp = event
-
-            if isinstance(payload, str):
-                payload = json.loads(payload)
-                if not isinstance(payload, dict):
-                    print(f"⚠️ Skipping event {event_id}: payload is not JSON.")
-                    continue
-
-            if source_type == 'sensor':
-                category = self.db.get_sensor_category(source_id)
-            elif source_type == 'device':
-                category = self.db.get_device_category(source_id)
-            else:
-                category = "unknown"
-
-            topic = f"{category}/{payload.get('action', 'none')}"
-
-            # Truncate payload if too long
-            payload_short = payload[:40] + "..." if len(payload) > 40 else payload
-            # Truncate timestamp to just date and time
-            time_short = timestamp.split('.')[0] if timestamp else ""
-            
-            self.tree.insert("", "end", values=(source_type, topic, payload_short, time_short))
\ No newline at end of file
+            values = self.row_values(event)
+            if values is not None:
+                item = self.tree.insert("", added if index == 0 else "end", values=values)
+                self.cursors[item] = (event[4], event[0])
+                added += 1
+        return added
+
+    def remove_rows(self, items):
+        self.tree.delete(*items)
+        for item in items:
+            del self.cursors[item]
+
+    def edge_cursor(self, items):
+        # Cursor of the first row in `items` that came from the database
+        for item in items:
+            cursor = self.cursors[item]
+            if cursor[1] is not None:
+                return cursor
+        return None
+
+    def top_index(self):
+        # Index of the first visible row, to keep the same rows in view when the window moves
+        return round(self.tree.yview()[0] * len(self.tree.get_children()))
+
+    def scroll_to(self, index):
+        count = len(self.tree.get_children())
+        if count:
+            self.tree.yview_moveto(max(0, index) / count)
+
+    def show_status(self):
+        rows = len(self.tree.get_children())
+        if not rows:
+            self.status.configure(text="No matching events")
+        else:
+            self.status.configure(text=f"{rows} rows loaded" + (" (oldest reached)" if self.at_tail else ""))
+
+    def matches(self, event):
+        """Whether a live feed event passes the current filters, as get_events_page would apply them"""
+        _, source_type, source_id, payload, timestamp = event
+        filters = self.filters
+        if filters.get("source_type", source_type) != source_type:
+            return False
+        if filters.get("source_id", source_id) != source_id:
+            return False
+        if "category" in filters and self.category_of(source_type, source_id) != filters["category"]:
+            return False
+        if "action" in filters and (not isinstance(payload, dict) or payload.get("action") != filters["action"]):
+            return False
+        if "start" in filters and timestamp < filters["start"]:
+            return False
+        return "end" not in filters or timestamp < filters["end"]
+
+    def category_of(self, source_type, source_id):
+        if source_type == 'sensor':
+            return self.db.get_sensor_category(source_id)
+        if source_type == 'device':
+            return self.db.get_device_category(source_id)
+        return "unknown"
+
+    def row_values(self, event):
+        event_id, source_type, source_id, payload, timestamp = event
+
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+            if not isinstance(payload, dict):
+                logger.warning("Skipping event %s: payload is not JSON.", event_id)
+                return None
+
+        category = self.category_of(source_type, source_id)
+        topic = f"{category}/{payload.get('action', 'none')}"
+
+        # Truncate payload if too long
+        payload_text = str(payload)
+        payload_short = payload_text[:40] + "..." if len(payload_text) > 40 else payload_text
+        # Truncate timestamp to just date and time
+        time_short = timestamp.split('.')[0] if timestamp else ""
+
+        return source_type, topic, payload_short, time_short
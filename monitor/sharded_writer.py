@@ -0,0 +1,228 @@
+from datetime import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from codec import JSON, detect
+from db import Database
+from db.federated import shard_of, shard_paths
+from db.retention import TIMESTAMP_FORMAT
+from .event_writer import EVENTS_DROPPED, QUEUE_DEPTH, SHUTDOWN_RETRIES, retry_pause, write_events
+
+logger = logging.getLogger(__name__)
+
+
+def _write(db, db_path, batch, stopping, dropped):
+    # Transient errors (locked, busy, out of disk) are retried until the writer stops; the
+    # inbox fills up meanwhile and the parent reports the chunks it cannot hand over.
+    # Events that are never written are added to the `dropped` count the parent exposes.
+    failures = 0
+    while True:
+        written = write_events(db, batch)
+        if written is not None:
+            lost = len(batch) - len(written)
+            break
+        failures += 1
+        if stopping.is_set() and failures > SHUTDOWN_RETRIES:
+            logging.getLogger(__name__).error("Shard %s dropped %d events after %d failed writes",
+                                              db_path, len(batch), failures)
+            lost = len(batch)
+            break
+        time.sleep(retry_pause(failures))
+    if lost:
+        with dropped.get_lock():
+            dropped.value += lost
+
+
+def _run_shard(db_path, inbox, batch_size, flush_interval, stopping, dropped):
+    # Worker process: decodes chunks of raw events and writes them to its own shard file
+    logging.basicConfig(level=os.environ.get("SMART_HOME_LOG_LEVEL", "INFO").upper())
+    db = Database(db_path=db_path)
+    batch = []
+    deadline = None
+    running = True
+    while running:
+        timeout = None if not batch else max(0.0, deadline - time.monotonic())
+        try:
+            chunk = inbox.get(timeout=timeout)
+        except queue.Empty:
+            chunk = ()
+        if chunk is None:
+            running = False
+            chunk = ()
+        for source_type, source_id, raw, received in chunk:
+            try:
+                payload = detect(raw).decode(raw)
+            except ValueError:
+                with dropped.get_lock():
+                    dropped.value += 1
+                continue
+            if not batch:
+                deadline = time.monotonic() + flush_interval
+            batch.append((source_type, source_id, payload, raw, received))
+        if batch and (not running or len(batch) >= batch_size or time.monotonic() >= deadline):
+            _write(db, db_path, batch, stopping, dropped)
+            batch = []
+    db.close()
+
+
+class ShardedWriter:
+    # Ingest across `shards` worker processes, each writing its own SQLite file, so
+    # decoding and writing scale with cores instead of one connection. Events are routed
+    # by shard_of(source_type, source_id) and handed over in chunks; read them back with
+    # FederatedDatabase. Same interface as EventWriter. submit() only buffers: a writer
+    # thread hands chunks to the shards, which may block, and publishes the events of
+    # the chunks a shard accepted.
+
+    def __init__(self, db_path=None, shards=2, batch_size=500, flush_interval_ms=200, chunk_size=256,
+                 max_chunks=256, put_timeout=1.0, feed=None, last_values=None, last_value_interval_ms=1000):
+        self.__db_path = db_path if db_path is not None else os.path.join("db", "smart_home_monitor.db")
+        self.__shards = shards
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval_ms / 1000
+        self.__chunk_size = chunk_size
+        self.__max_chunks = max_chunks
+        self.__put_timeout = put_timeout
+        self.__feed = feed
+        self.__last_values = last_values
+        self.__last_value_interval = last_value_interval_ms / 1000
+        self.__lock = threading.Lock()
+        self.__buffers = [[] for _ in range(shards)]
+        # Full chunks waiting for the writer thread, as (shard index, events)
+        self.__ready = []
+        self.__inboxes = []
+        self.__workers = []
+        self.__wake = threading.Event()
+        self.__stopping = threading.Event()
+        # Set in the workers too, so a shard retrying a failed write gives up at shutdown
+        self.__workers_stopping = None
+        # Events the workers could not write, summed across them; __run adds it to EVENTS_DROPPED
+        self.__dropped = None
+        self.__dropped_seen = 0
+        self.__thread = None
+        QUEUE_DEPTH.labels("ingest").set_function(self.pending)
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        # Spawned, not forked: the parent runs paho's network thread
+        context = multiprocessing.get_context("spawn")
+        self.__workers_stopping = context.Event()
+        self.__dropped = context.Value("q", 0)
+        for index, path in enumerate(shard_paths(self.__db_path, self.__shards)):
+            inbox = context.Queue(self.__max_chunks)
+            worker = context.Process(target=_run_shard,
+                                     args=(path, inbox, self.__batch_size, self.__flush_interval,
+                                           self.__workers_stopping, self.__dropped),
+                                     name=f"IngestShard-{index}", daemon=True)
+            worker.start()
+            self.__inboxes.append(inbox)
+            self.__workers.append(worker)
+        self.__stopping.clear()
+        self.__thread = threading.Thread(target=self.__run, name="ShardedWriter", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stopping.set()
+        self.__wake.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__workers_stopping.set()
+        for inbox in self.__inboxes:
+            inbox.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__inboxes, self.__workers = [], []
+        self.__count_dropped()
+
+    def submit(self, source_type, source_id, payload, raw=None):
+        """Route one event to its shard without blocking; returns False if `max_chunks` full
+        chunks are already waiting for the writer thread and the event was dropped"""
+        index = shard_of(source_type, source_id, self.__shards)
+        event = (source_type, source_id, payload, raw if raw is not None else JSON.encode(payload), time.time())
+        with self.__lock:
+            buffer = self.__buffers[index]
+            if len(buffer) + 1 >= self.__chunk_size and len(self.__ready) >= self.__max_chunks:
+                return False
+            buffer.append(event)
+            if len(buffer) < self.__chunk_size:
+                return True
+            self.__buffers[index] = []
+            self.__ready.append((index, buffer))
+        self.__wake.set()
+        return True
+
+    def pending(self):
+        return sum(len(buffer) for buffer in self.__buffers) + sum(len(events) for _, events in self.__ready)
+
+    def __send(self, index, events):
+        # Workers get the raw bytes and decode them again in their own process
+        chunk = [(source_type, source_id, raw, received) for source_type, source_id, _, raw, received in events]
+        try:
+            self.__inboxes[index].put(chunk, timeout=self.__put_timeout)
+            return True
+        except queue.Full:
+            logger.warning("Ingest shard %d is full. Dropped %d events.", index, len(chunk))
+            EVENTS_DROPPED.labels("shard_full").inc(len(chunk))
+            return False
+
+    def __run(self):
+        # Ships partial chunks every flush interval and keeps the in-process views current
+        db = Database(db_path=self.__db_path) if self.__last_values is not None else None
+        if db is not None:
+            self.__last_values.seed(db.get_last_values())
+        sync_deadline = time.monotonic() + self.__last_value_interval
+        flush_deadline = time.monotonic() + self.__flush_interval
+        while True:
+            self.__wake.wait(max(0.0, flush_deadline - time.monotonic()))
+            self.__wake.clear()
+            stopping = self.__stopping.is_set()
+            flush = stopping or time.monotonic() >= flush_deadline
+            with self.__lock:
+                chunks, self.__ready = self.__ready, []
+                if flush:
+                    # Partial chunks go out every flush interval
+                    chunks.extend((index, buffer) for index, buffer in enumerate(self.__buffers) if buffer)
+                    self.__buffers = [[] for _ in range(self.__shards)]
+            if flush:
+                flush_deadline = time.monotonic() + self.__flush_interval
+            handed = []
+            for index, events in chunks:
+                if self.__send(index, events):
+                    handed.extend(events)
+            if handed:
+                self.__publish(handed)
+            self.__count_dropped()
+            if db is not None and (stopping or time.monotonic() >= sync_deadline):
+                rows = self.__last_values.take_dirty()
+                if rows:
+                    try:
+                        db.update_last_values(rows)
+                    except sqlite3.Error as e:
+                        logger.error("Could not write %d last values: %s", len(rows), e)
+                sync_deadline = time.monotonic() + self.__last_value_interval
+            if stopping:
+                break
+        if db is not None:
+            db.close()
+
+    def __count_dropped(self):
+        dropped = self.__dropped.value
+        if dropped > self.__dropped_seen:
+            EVENTS_DROPPED.labels("shard").inc(dropped - self.__dropped_seen)
+            self.__dropped_seen = dropped
+
+    def __publish(self, events):
+        # Live views see events when they are handed to the shards, not when those commit
+        timestamp = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        if self.__last_values is not None:
+            self.__last_values.update_many(events, timestamp)
+        if self.__feed is not None:
+            self.__feed.publish_many([(None, source_type, source_id, payload, timestamp)
+                                      for source_type, source_id, payload, *_ in events])
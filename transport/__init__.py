@@ -0,0 +1,2 @@
+from .mqtt_transport import MqttTransport, content_type_properties
+from .router import TopicRouter, topic_matches
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+
+import paho.mqtt.client as paho
+from paho import mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from codec import content_type_of, detect
+from metrics import REGISTRY, STARTUP
+from .router import TopicRouter
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_RECEIVED = REGISTRY.counter("smarthome_messages_received_total", "MQTT messages received", ("topic",))
+DECODE_SECONDS = REGISTRY.histogram("smarthome_decode_seconds", "Time spent decoding MQTT payloads")
+DECODE_ERRORS = REGISTRY.counter("smarthome_decode_errors_total", "MQTT payloads that could not be decoded")
+
+
+def content_type_properties(content_type):
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = content_type
+    return properties
+
+
+class MqttTransport:
+    # Owns the one broker connection shared by every service in the process. Each
+    # payload is decoded once, with the codec named by its MQTTv5 content type (JSON when
+    # there is none), and handed to the handlers whose topic filters match, as
+    # handler(topic, payload, msg).
+
+    def __init__(self, client_id, protocol, client=None):
+        # `client` lets benchmarks substitute an in-process stand-in for the paho client
+        self.__client = client or paho.Client(client_id=client_id, protocol=protocol, userdata=None)
+        self.__client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
+        self.__router = TopicRouter()
+        self.__qos = {}
+        self.__subscribed = {}
+        self.__connected = False
+        self.__connected_event = threading.Event()
+        self.__first_message = threading.Event()
+        self.__lock = threading.Lock()
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            logger.info("CONNACK received with code %s", rc)
+            with self.__lock:
+                self.__connected = rc == 0
+                # Subscriptions do not survive a reconnect with a clean session
+                self.__subscribed = {}
+            self.__sync_subscriptions()
+            if rc == 0:
+                STARTUP.milestone("broker connected")
+                self.__connected_event.set()
+
+        def on_disconnect(client, userdata, *args):
+            with self.__lock:
+                self.__connected = False
+            self.__connected_event.clear()
+
+        def on_subscribe(client, userdata, mid, granted_qos, properties=None):
+            logger.debug("Subscribed: %s %s", mid, granted_qos)
+
+        def on_publish(client, userdata, mid, *args):
+            logger.debug("Published mid: %s", mid)
+
+        def on_message(client, userdata, msg):
+            MESSAGES_RECEIVED.labels(msg.topic).inc()
+            started = time.perf_counter()
+            codec = detect(msg.payload, content_type_of(msg))
+            if codec is None:
+                DECODE_ERRORS.inc()
+                logger.warning("Unsupported content type %r on topic %s", content_type_of(msg), msg.topic)
+                return
+            try:
+                payload = codec.decode(msg.payload)
+            except ValueError:
+                DECODE_ERRORS.inc()
+                logger.warning("Could not decode %s payload from topic %s", codec.content_type, msg.topic)
+                return
+            DECODE_SECONDS.observe(time.perf_counter() - started)
+            for handler in self.__router.handlers_for(msg.topic):
+                try:
+                    handler(msg.topic, payload, msg)
+                except Exception:
+                    logger.exception("Handler error on topic %s", msg.topic)
+            if not self.__first_message.is_set():
+                self.__first_message.set()
+                STARTUP.milestone("first message processed")
+
+        self.__client.on_connect = on_connect
+        self.__client.on_disconnect = on_disconnect
+        self.__client.on_subscribe = on_subscribe
+        self.__client.on_publish = on_publish
+        self.__client.on_message = on_message
+
+    def connect(self, host, port, username, password):
+        self.__client.username_pw_set(username, password)
+        self.__client.connect(host, port)
+
+    def connect_async(self, host, port, username, password):
+        """Connect from the network thread once start() runs; returns immediately"""
+        self.__client.username_pw_set(username, password)
+        self.__client.connect_async(host, port)
+
+    def wait_connected(self, timeout=None):
+        return self.__connected_event.wait(timeout)
+
+    def wait_first_message(self, timeout=None):
+        return self.__first_message.wait(timeout)
+
+    def start(self):
+        self.__client.loop_start()
+
+    def stop(self):
+        self.__client.loop_stop()
+
+    def subscribe(self, pattern, handler, qos=1):
+        self.__router.add(pattern, handler)
+        self.__qos[pattern] = max(qos, self.__qos.get(pattern, 0))
+        self.__sync_subscriptions()
+
+    def unsubscribe(self, pattern, handler):
+        self.__router.remove(pattern, handler)
+        self.__sync_subscriptions()
+
+    def publish(self, topic, payload, qos, content_type=None):
+        """Publish encoded `payload`; a `content_type` other than JSON is sent as the MQTTv5 property"""
+        if content_type is None:
+            self.__client.publish(topic, payload, qos)
+        else:
+            self.__client.publish(topic, payload, qos, properties=content_type_properties(content_type))
+
+    def __sync_subscriptions(self):
+        # Broker subscriptions are the registered filters minus those covered by a broader one,
+        # which is subscribed at the highest QoS asked of any of them
+        with self.__lock:
+            if not self.__connected:
+                return
+            wanted = self.__router.broker_patterns(self.__qos)
+            # Subscribing to a filter again replaces its QoS
+            added = {pattern: qos for pattern, qos in wanted.items() if self.__subscribed.get(pattern) != qos}
+            removed = [pattern for pattern in self.__subscribed if pattern not in wanted]
+            self.__subscribed = wanted
+        for pattern, qos in added.items():
+            self.__client.subscribe(pattern, qos)
+        for pattern in removed:
+            self.__client.unsubscribe(pattern)
@@ -0,0 +1,78 @@
+import threading
+
+
+def topic_matches(pattern, topic):
+    """MQTT filter matching: '+' matches one level, a trailing '#' matches the rest"""
+    if topic.startswith("$") and pattern[:1] in ("+", "#"):
+        # Wildcards at the first level never match $SYS-style topics
+        return False
+    pattern_levels = pattern.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(pattern_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+def pattern_covers(general, specific):
+    """True if every topic matched by `specific` is also matched by `general`"""
+    general_levels = general.split("/")
+    specific_levels = specific.split("/")
+    for i, level in enumerate(general_levels):
+        if level == "#":
+            return True
+        if i >= len(specific_levels):
+            return False
+        other = specific_levels[i]
+        if other == "#" or (level != "+" and level != other):
+            return False
+    return len(general_levels) == len(specific_levels)
+
+
+class TopicRouter:
+    # Maps topic filters to handlers. Resolved handler tuples are cached per concrete
+    # topic, so steady-state routing is one dict lookup; registering replaces the route
+    # list and the cache, so a lookup racing it never stores a stale entry in the new cache.
+
+    def __init__(self):
+        self.__routes = []
+        self.__cache = {}
+        self.__lock = threading.Lock()
+
+    def add(self, pattern, handler):
+        with self.__lock:
+            self.__routes = self.__routes + [(pattern, handler)]
+            self.__cache = {}
+
+    def remove(self, pattern, handler):
+        with self.__lock:
+            self.__routes = [route for route in self.__routes if route != (pattern, handler)]
+            self.__cache = {}
+
+    def patterns(self):
+        return list(dict.fromkeys(pattern for pattern, _ in self.__routes))
+
+    def broker_patterns(self, qos=None):
+        """{pattern: QoS} of the registered patterns minus those covered by a broader one, so the
+        broker never sends a message twice. `qos` maps patterns to the QoS they were registered
+        with (1 when missing); a broader pattern takes the highest QoS of those it covers."""
+        qos = qos or {}
+        patterns = self.patterns()
+        wanted = {}
+        for pattern in patterns:
+            if any(other != pattern and pattern_covers(other, pattern) for other in patterns):
+                continue
+            wanted[pattern] = max(qos.get(other, 1) for other in patterns
+                                  if other == pattern or pattern_covers(pattern, other))
+        return wanted
+
+    def handlers_for(self, topic):
+        # Routes and cache are read once; an add() or remove() meanwhile replaces both
+        cache, routes = self.__cache, self.__routes
+        handlers = cache.get(topic)
+        if handlers is None:
+            handlers = tuple(handler for pattern, handler in routes if topic_matches(pattern, topic))
+            cache[topic] = handlers
+        return handlers
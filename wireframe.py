@@ -1,8 +1,11 @@
 import tkinter as tk
 from tkinter import ttk
+from monitor.chart_panel import ChartPanel
+from monitor.current_values_panel import CurrentValuesPanel
+from monitor.metrics_panel import MetricsPanel
 from monitor.monitor_gui import MonitorGUI
 
-def start_gui():
+def start_gui(feed=None, registry=None, last_values=None, shards=0):
     # Root Window
     root = tk.Tk()
     root.title("Smart Home GUI")
@@ -40,13 +43,21 @@ def start_gui():
     ttk.Button(controller_frame, text="➕ Add Rule").pack(pady=5, fill="x")
     ttk.Button(controller_frame, text="✏️ Edit Rules").pack(pady=5, fill="x")
 
+    if last_values is not None:
+        CurrentValuesPanel(controller_frame, last_values, registry=registry).pack(fill="both", expand=True)
+
+    MetricsPanel(controller_frame).pack(fill="both", expand=True)
+
     # Monitor Frame
     monitor_frame = ttk.Frame(main_frame, padding=20)
     monitor_frame.pack(side="right", fill="both", expand=True, padx=(10, 0))
 
-    monitor_gui = MonitorGUI(monitor_frame)
+    monitor_gui = MonitorGUI(monitor_frame, feed=feed, registry=registry, shards=shards)
     monitor_gui.pack(fill="both", expand=True)
 
+    chart_panel = ChartPanel(monitor_frame, registry=registry, shards=shards)
+    chart_panel.pack(fill="both", expand=True, pady=(10, 0))
+
     # Footer
     ttk.Label(root, text="v0.1 | Made with ❤️ in Python", font=("Segoe UI", 9)).pack(side="bottom", pady=10)
 